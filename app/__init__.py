@@ -16,4 +16,24 @@ def create_app(config_class=Config):
     init_db(app) # Ensure tables exist on startup
     app.teardown_appcontext(close_db)
 
+    # Start the group-commit writer (before the job workers, so it is closed after them)
+    from app.write_buffer import init_write_buffer
+    init_write_buffer(app)
+
+    # Start background job workers (pattern analysis, learning topics)
+    from app.jobs import init_jobs
+    init_jobs(app)
+
+    # Create and keep refreshing the cached Echo system prompt
+    from app.prompt_cache import init_prompt_cache
+    init_prompt_cache(app)
+
+    # Span tree per request; slow ones are kept for /debug/traces
+    from app.tracing import init_tracing
+    init_tracing(app)
+
+    # Time requests and expose Prometheus metrics at /metrics
+    from app.metrics import init_metrics
+    init_metrics(app)
+
     return app
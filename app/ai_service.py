@@ -1,10 +1,23 @@
-from google import genai
+from google.genai import errors as genai_errors
 from flask import current_app
+import asyncio
 import json
 import logging
-from app.key_manager import get_key_manager
+import re
+import time
+from app.key_manager import get_key_manager, mask_key
+from app.client_pool import get_client_pool
+from app.fanout import LLMBusyError, cancelled, get_llm_executor
+from app.hedging import get_hedger
+from app.model_router import get_model_router
+from app.metrics import GEMINI_CALL_SECONDS, GEMINI_JSON_ERRORS, GEMINI_RATE_LIMITED, GEMINI_RETRIES
+from app.prompt_cache import get_prompt_cache
+from app.prompt_context import build_transcript, estimate_tokens
+from app.tracing import open_span, span
 
 class GeminiService:
+    REFLECTION_MODEL = "gemini-1.5-flash"
+
     SYSTEM_PROMPT = """You are Echo, a deeply empathetic, psychological mirror and guide. Your core purpose is to help users explore their inner world with radical validation and proactive curiosity.
 
 The 3 Pillars of Echo:
@@ -27,76 +40,376 @@ You must respond in JSON format with the following keys:
 """
 
     @staticmethod
-    def _call_gemini(model_name, contents, config, retry_count=3):
-        """Internal helper to handle retries and key rotation."""
+    def _retry_delay(e):
+        """Extracts the server-provided retry delay (seconds) from an API error, if any."""
+        details = getattr(e, "details", None)
+        error = details.get("error", details) if isinstance(details, dict) else {}
+        for item in error.get("details", None) or []:
+            if isinstance(item, dict) and str(item.get("@type", "")).endswith("RetryInfo"):
+                match = re.match(r"([\d.]+)s", str(item.get("retryDelay", "")))
+                if match:
+                    return float(match.group(1))
+
+        headers = getattr(getattr(e, "response", None), "headers", None)
+        if headers and headers.get("retry-after"):
+            try:
+                return float(headers.get("retry-after"))
+            except ValueError:
+                pass
+        return None
+
+    @staticmethod
+    def _handle_error(km, api_key, e):
+        """Classifies a failed call and cools down or disables the key accordingly."""
+        if isinstance(e, genai_errors.APIError):
+            if e.code == 429:
+                GEMINI_RATE_LIMITED.inc()
+                km.mark_failed(api_key, "quota_exhausted", retry_after=GeminiService._retry_delay(e))
+                # Continue to next attempt with a new key
+                return
+            if e.code in (401, 403) or (e.code == 400 and "API_KEY_INVALID" in str(e.details)):
+                km.disable_key(api_key, "invalid_or_revoked")
+                return
+            if isinstance(e, genai_errors.ServerError):
+                # Not the key's fault: retry on another key without cooling this one down
+                logging.warning(f"Gemini server error {e.code}: {e.message}")
+                return
+
+        logging.error(f"Unexpected Gemini Error: {e}")
+        # For non-quota errors, we might still want to try another key
+        km.mark_failed(api_key, "general_failure")
+
+    @staticmethod
+    def _is_model_failure(e):
+        """Quota and key errors belong to the key, not the model, so they don't count against its error budget."""
+        return not (isinstance(e, genai_errors.APIError) and e.code in (401, 403, 429))
+
+    @staticmethod
+    def _record_attempt(router, call_type, model_name, elapsed, error=None):
+        """Feeds one attempt's latency and outcome to the metrics and the model router."""
+        GEMINI_CALL_SECONDS.observe(elapsed, call_type=call_type, model=model_name, outcome="error" if error else "ok")
+        if error is None:
+            router.record(call_type, model_name, elapsed, ok=True)
+        elif GeminiService._is_model_failure(error):
+            router.record(call_type, model_name, elapsed, ok=False)
+
+    @staticmethod
+    def _estimate_tokens(contents):
+        """Cheap pre-call token estimate for the TPM budget (see app/prompt_context.py)."""
+        return estimate_tokens(str(contents)) + 1
+
+    @staticmethod
+    def _usage_tokens(response):
+        usage = getattr(response, "usage_metadata", None)
+        return getattr(usage, "total_token_count", None) if usage else None
+
+    @staticmethod
+    def _system_prompt_config(api_key, model_name):
+        """Config fields carrying SYSTEM_PROMPT: a cached-content reference when one is live (no API call)."""
+        cache = get_prompt_cache()
+        if cache:
+            return cache.config_for(api_key, model_name)
+        return {"system_instruction": GeminiService.SYSTEM_PROMPT}
+
+    @staticmethod
+    def _attempt(km, api_key, model_name, contents, config, estimated_tokens, system_prompt=False):
+        """One generate_content call on one key. Key health is updated; errors are re-raised."""
+        try:
+            client = get_client_pool().get(api_key)
+            call_config = config
+            if system_prompt:
+                call_config = {**config, **GeminiService._system_prompt_config(api_key, model_name)}
+            try:
+                response = client.models.generate_content(
+                    model=model_name,
+                    contents=contents,
+                    config=call_config
+                )
+            except genai_errors.ClientError as e:
+                if "cached_content" not in call_config or e.code == 429:
+                    raise
+                # The prompt cache was rejected (expired/deleted): drop it and send the prompt inline
+                get_prompt_cache().invalidate(api_key, model_name)
+                response = client.models.generate_content(
+                    model=model_name,
+                    contents=contents,
+                    config={**config, "system_instruction": GeminiService.SYSTEM_PROMPT}
+                )
+        except Exception as e:
+            GeminiService._handle_error(km, api_key, e)
+            raise
+
+        km.record_usage(api_key, estimated_tokens, GeminiService._usage_tokens(response))
+        if response.text:
+            km.mark_success(api_key)
+        return response.text
+
+    @staticmethod
+    def _call_gemini(call_type, contents, config, retry_count=3, system_prompt=False):
+        """
+        Internal helper to handle retries, key rotation, model routing and (optional) hedging.
+        call_type ("reflection", "analysis", "topic", "summary") selects the models (see app/model_router.py);
+        a failed attempt is retried on the next model in the route.
+        With system_prompt=True, SYSTEM_PROMPT is attached as a (cached) system instruction.
+        """
         km = get_key_manager()
-        
+        hedger = get_hedger()
+        router = get_model_router()
+        llm = get_llm_executor()
+        models = router.candidates(call_type)
+        estimated_tokens = GeminiService._estimate_tokens(contents)
+
         for attempt in range(retry_count):
-            api_key = km.get_key()
+            model_name = models[attempt % len(models)]
+            if cancelled():
+                return None
+
+            if attempt:
+                GEMINI_RETRIES.inc(call_type=call_type)
+
+            def call(key, model_name=model_name, attempt=attempt):
+                with llm.slot(), span("gemini.attempt", call_type=call_type, model=model_name, key=mask_key(key), attempt=attempt) as s:
+                    start = time.perf_counter()
+                    try:
+                        result = GeminiService._attempt(km, key, model_name, contents, config, estimated_tokens, system_prompt)
+                    except Exception as e:
+                        s.set(outcome="error", code=getattr(e, "code", None))
+                        GeminiService._record_attempt(router, call_type, model_name, time.perf_counter() - start, e)
+                        raise
+                    s.set(outcome="ok" if result else "empty")
+                    GeminiService._record_attempt(router, call_type, model_name, time.perf_counter() - start)
+                    return result
+
+            with span("gemini.key_wait"):
+                api_key = km.get_key(estimated_tokens)
             if not api_key:
                 logging.error("No active API keys available for this request.")
                 return None
 
             try:
-                client = genai.Client(api_key=api_key)
-                response = client.models.generate_content(
+                if hedger:
+                    return hedger.run(
+                        call, api_key,
+                        lambda: km.get_key(estimated_tokens, exclude=api_key)
+                    ) or None
+                return call(api_key) or None
+            except LLMBusyError:
+                return None
+            except Exception:
+                # Continue to next attempt with a new key
+                continue
+        
+        return None
+
+    @staticmethod
+    def _stream_gemini(call_type, contents, config, retry_count=3, system_prompt=False):
+        """
+        Streaming variant of _call_gemini: yields text chunks as they arrive.
+        Keys and models are only rotated before the first chunk; a stream that breaks midway ends early.
+        """
+        km = get_key_manager()
+        router = get_model_router()
+        llm = get_llm_executor()
+        models = router.candidates(call_type)
+        estimated_tokens = GeminiService._estimate_tokens(contents)
+
+        for attempt in range(retry_count):
+            model_name = models[attempt % len(models)]
+            if cancelled():
+                return
+            if attempt:
+                GEMINI_RETRIES.inc(call_type=call_type)
+            with span("gemini.key_wait"):
+                api_key = km.get_key(estimated_tokens)
+            if not api_key:
+                logging.error("No active API keys available for this request.")
+                return
+            try:
+                llm.acquire()
+            except LLMBusyError:
+                return
+            start = time.perf_counter()
+            attempt_span = open_span(
+                "gemini.stream_attempt", call_type=call_type, model=model_name, key=mask_key(api_key), attempt=attempt)
+
+            started = False
+            call_config = config
+            try:
+                client = get_client_pool().get(api_key)
+                if system_prompt:
+                    call_config = {**config, **GeminiService._system_prompt_config(api_key, model_name)}
+                usage_tokens = None
+                for chunk in client.models.generate_content_stream(
                     model=model_name,
                     contents=contents,
-                    config=config
-                )
-                
-                if response.text:
-                    km.mark_success(api_key)
-                    return response.text
-                return None
+                    config=call_config
+                ):
+                    usage_tokens = GeminiService._usage_tokens(chunk) or usage_tokens
+                    if chunk.text:
+                        if not started:
+                            attempt_span.set(first_chunk_ms=round((time.perf_counter() - start) * 1000, 2))
+                        started = True
+                        yield chunk.text
+                km.record_success(api_key, estimated_tokens, usage_tokens)
+                GeminiService._record_attempt(router, call_type, model_name, time.perf_counter() - start)
+                attempt_span.set(outcome="ok")
+                attempt_span.finish()
+                return
 
+            except genai_errors.ClientError as e:
+                GeminiService._record_attempt(router, call_type, model_name, time.perf_counter() - start, e)
+                attempt_span.set(outcome="error", code=e.code)
+                attempt_span.finish()
+                if not started and "cached_content" in call_config and e.code != 429:
+                    # Rejected prompt cache: the next attempt sends the prompt inline
+                    get_prompt_cache().invalidate(api_key, model_name)
+                    continue
+                GeminiService._handle_error(km, api_key, e)
+                if started:
+                    return
             except Exception as e:
-                err_msg = str(e).lower()
-                if "429" in err_msg or "resource_exhausted" in err_msg or "quota" in err_msg:
-                    km.mark_failed(api_key, "quota_exhausted")
-                    # Continue to next attempt with a new key
-                else:
-                    logging.error(f"Unexpected Gemini Error: {e}")
-                    # For non-quota errors, we might still want to try another key
-                    km.mark_failed(api_key, "general_failure")
-        
-        return None
+                GeminiService._record_attempt(router, call_type, model_name, time.perf_counter() - start, e)
+                attempt_span.set(outcome="error", code=getattr(e, "code", None))
+                attempt_span.finish()
+                GeminiService._handle_error(km, api_key, e)
+                if started:
+                    return
+            finally:
+                llm.release()
 
     @staticmethod
-    def generate_response(user_input, history=None):
-        if history is None:
-            history = []
+    def _transcript(history, summary=None):
+        """Rolling summary plus the most recent turns, within PROMPT_HISTORY_TOKEN_BUDGET."""
+        config = current_app.config
+        return build_transcript(
+            history, summary,
+            budget=config.get("PROMPT_HISTORY_TOKEN_BUDGET", 1200),
+            message_budget=config.get("PROMPT_MESSAGE_TOKEN_CAP", 250),
+        )
 
-        model_name = "gemini-1.5-flash"
-        
-        prompt = f"{GeminiService.SYSTEM_PROMPT}\n\n"
-        for msg in history[-8:]:
-            role = "User" if msg["role"] != "ai" else "Echo"
-            prompt += f"{role}: {msg['content']}\n"
+    @staticmethod
+    def _build_reflection_prompt(user_input, history, summary=None):
+        """Conversation transcript only; SYSTEM_PROMPT travels as the system instruction."""
+        if history and history[-1]["role"] != "ai" and history[-1]["content"] == user_input:
+            history = history[:-1] # the current message is saved before history is read
+        prompt = GeminiService._transcript(history, summary)
         prompt += f"User: {user_input}\nEcho:"
+        return prompt
 
-        config = {
-            "temperature": 0.7,
-            "max_output_tokens": 800,
-            "response_mime_type": "application/json"
-        }
+    REFLECTION_CONFIG = {
+        "temperature": 0.7,
+        "max_output_tokens": 800,
+        "response_mime_type": "application/json"
+    }
 
-        result_text = GeminiService._call_gemini(model_name, prompt, config)
+    @staticmethod
+    def _parse_json(call_type, result_text):
+        """Decodes a JSON reply; None (counted as a JSON error) when it is missing or malformed."""
         if result_text:
             try:
                 return json.loads(result_text)
             except:
+                GEMINI_JSON_ERRORS.inc(call_type=call_type)
                 return None
         return None
 
     @staticmethod
-    def analyze_patterns(user_input, history, existing_patterns):
-        model_name = "gemini-1.5-flash"
+    def generate_response(user_input, history=None, summary=None):
+        if history is None:
+            history = []
+
+        prompt = GeminiService._build_reflection_prompt(user_input, history, summary)
+        result_text = GeminiService._call_gemini("reflection", prompt, GeminiService.REFLECTION_CONFIG, system_prompt=True)
+        return GeminiService._parse_json("reflection", result_text)
+
+    @staticmethod
+    def stream_response(user_input, history=None, summary=None):
+        """
+        Streams a reflection as (field, text) deltas for the
+        "reflection" / "insight" / "follow_up" fields, in generation order.
+        """
+        if history is None:
+            history = []
+
+        prompt = GeminiService._build_reflection_prompt(user_input, history, summary)
+        parser = JSONFieldStreamParser(["reflection", "insight", "follow_up"])
+        for chunk in GeminiService._stream_gemini("reflection", prompt, GeminiService.REFLECTION_CONFIG, system_prompt=True):
+            for field, text in parser.feed(chunk):
+                yield field, text
+
+    COMBINED_SCHEMA = {
+        "type": "OBJECT",
+        "properties": {
+            "reflection": {"type": "STRING"},
+            "insight": {"type": "STRING"},
+            "follow_up": {"type": "STRING"},
+            "patterns_detected": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "name": {"type": "STRING"},
+                        "type": {"type": "STRING", "enum": ["emotional", "cognitive", "behavioral"]},
+                        "confidence": {"type": "NUMBER"},
+                        "weight": {"type": "NUMBER"},
+                        "reasoning": {"type": "STRING"}
+                    },
+                    "required": ["name", "type", "confidence", "weight"]
+                }
+            }
+        },
+        "required": ["reflection", "follow_up", "patterns_detected"]
+    }
+
+    @staticmethod
+    def _combined_request(user_input, history, existing_patterns, summary=None):
+        """Prompt and config of the combined reflection + pattern analysis call."""
+        prompt = GeminiService._build_reflection_prompt(user_input, history, summary)
+        prompt += f"""
+
+[Pattern analysis - not shown to the user]
+Besides your reply, act as an expert psychological pattern detector: list in "patterns_detected" ANY
+recurring emotional, cognitive, or behavioral patterns in this session (empty list if none is strong).
+"confidence" and "weight" are 0.0 to 1.0. Existing Patterns: {existing_patterns}
+"""
+
+        config = {
+            "temperature": 0.7,
+            "max_output_tokens": 1200,
+            "response_mime_type": "application/json",
+            "response_schema": GeminiService.COMBINED_SCHEMA
+        }
+        return prompt, config
+
+    @staticmethod
+    def _parse_combined(result_text):
+        data = GeminiService._parse_json("reflection", result_text)
+        if isinstance(data, dict) and data.get("reflection"):
+            return data
+        return None
+
+    @staticmethod
+    def reflect_and_analyze(user_input, history, existing_patterns, summary=None):
+        """
+        Single structured-output call returning the reflection fields plus
+        "patterns_detected" (same shape as analyze_patterns). None on failure.
+        """
+        prompt, config = GeminiService._combined_request(user_input, history, existing_patterns, summary)
+        result_text = GeminiService._call_gemini("reflection", prompt, config, system_prompt=True)
+        return GeminiService._parse_combined(result_text)
+
+    @staticmethod
+    def _analysis_request(user_input, history, existing_patterns, summary=None):
+        """Prompt and config of the per-message pattern analysis call."""
+        if history and history[-1]["role"] != "ai" and history[-1]["content"] == user_input:
+            history = history[:-1]
+        transcript = GeminiService._transcript(history, summary) or "(none)\n"
         prompt = f"""You are an expert psychological pattern detector. 
         Analyze the following user session and existing patterns to identify ANY recurring emotional, cognitive, or behavioral patterns.
         
         Current User Input: {user_input}
-        Recent History: {history}
+        Recent History:
+{transcript}
         Existing Patterns: {existing_patterns}
         
         Output JSON ONLY:
@@ -118,18 +431,90 @@ You must respond in JSON format with the following keys:
             "temperature": 0.3,
             "response_mime_type": "application/json"
         }
+        return prompt, config
 
-        result_text = GeminiService._call_gemini(model_name, prompt, config)
-        if result_text and "NO_PATTERN_DETECTED" not in result_text:
-            try:
-                return json.loads(result_text)
-            except:
-                return None
-        return None
+    @staticmethod
+    def _parse_analysis(result_text):
+        if result_text and "NO_PATTERN_DETECTED" in result_text:
+            return {"patterns_detected": []}
+        return GeminiService._parse_json("analysis", result_text)
+
+    @staticmethod
+    def analyze_patterns(user_input, history, existing_patterns, summary=None):
+        prompt, config = GeminiService._analysis_request(user_input, history, existing_patterns, summary)
+        return GeminiService._parse_analysis(GeminiService._call_gemini("analysis", prompt, config))
+
+    @staticmethod
+    def analyze_pattern_batch(messages, existing_patterns, summary=None):
+        """
+        Pattern analysis over several new messages at once (PATTERN_ANALYSIS_MODE='batched').
+        Same result shape as analyze_patterns; None on failure.
+        """
+        config = current_app.config
+        transcript = build_transcript(
+            messages, summary,
+            budget=config.get("PATTERN_BATCH_TOKEN_BUDGET", 2500),
+            message_budget=config.get("PROMPT_MESSAGE_TOKEN_CAP", 250),
+        )
+        prompt = f"""You are an expert psychological pattern detector.
+Below are the user's messages since their last analysis (with Echo's replies for context).
+Identify emotional, cognitive, or behavioral patterns that recur across these messages or
+continue one of the existing patterns. Judge the user's words, not Echo's.
+
+Existing Patterns: {existing_patterns}
+
+{transcript}
+Output JSON ONLY:
+{{
+    "patterns_detected": [
+        {{
+            "name": "Short name (reuse the existing name for a pattern that continues)",
+            "type": "emotional" | "cognitive" | "behavioral",
+            "confidence": 0.0 to 1.0,
+            "weight": 0.0 to 1.0,
+            "reasoning": "..."
+        }}
+    ]
+}}
+If no strong patterns, return "NO_PATTERN_DETECTED".
+"""
+
+        result_text = GeminiService._call_gemini("analysis", prompt, {"temperature": 0.3, "response_mime_type": "application/json"})
+        return GeminiService._parse_analysis(result_text)
+
+    SUMMARY_PROMPT = """Maintain a running summary of a conversation between a user and Echo, an empathetic reflection companion.
+Update the previous summary with the new messages. Keep what matters for continuing the conversation:
+the user's situation, recurring feelings and themes, and anything they asked Echo to remember.
+Drop pleasantries and Echo's wording. Write plain prose in the third person, at most {max_words} words.
+
+Previous summary: {previous}
+
+New messages:
+{messages}
+Updated summary:"""
+
+    @staticmethod
+    def summarize_conversation(previous_summary, messages):
+        """
+        Folds `messages` into the running summary (plain text), or None on failure.
+        Messages enter whole up to SUMMARY_INPUT_TOKEN_BUDGET, so the call itself stays bounded.
+        """
+        config = current_app.config
+        messages_text = build_transcript(
+            messages,
+            budget=config.get("SUMMARY_INPUT_TOKEN_BUDGET", 3000),
+            message_budget=config.get("PROMPT_MESSAGE_TOKEN_CAP", 250),
+        )
+        prompt = GeminiService.SUMMARY_PROMPT.format(
+            max_words=config.get("SUMMARY_MAX_WORDS", 150),
+            previous=previous_summary or "(none yet)",
+            messages=messages_text,
+        )
+        result_text = GeminiService._call_gemini("summary", prompt, {"temperature": 0.3, "max_output_tokens": 400})
+        return result_text.strip() if result_text and result_text.strip() else None
 
     @staticmethod
     def generate_learning_topic(pattern_name, pattern_type, difficulty="beginner"):
-        model_name = "gemini-1.5-flash"
         prompt = f"""You are a compassionate guide. Generate a learning topic for: "{pattern_name}" ({pattern_type}).
         JSON Output ONLY:
         {{
@@ -143,11 +528,317 @@ You must respond in JSON format with the following keys:
             "response_mime_type": "application/json"
         }
 
-        result_text = GeminiService._call_gemini(model_name, prompt, config)
-        if result_text:
+        result_text = GeminiService._call_gemini("topic", prompt, config)
+        return GeminiService._parse_json("topic", result_text)
+
+
+    # --- Async variants for the ASGI app (see app/asgi.py) ---
+
+    @staticmethod
+    async def _aattempt(km, api_key, model_name, contents, config, estimated_tokens, system_prompt=False):
+        """_attempt on the key's async client (client.aio)."""
+        try:
+            client = get_client_pool().get(api_key)
+            call_config = config
+            if system_prompt:
+                call_config = {**config, **GeminiService._system_prompt_config(api_key, model_name)}
             try:
-                return json.loads(result_text)
-            except:
+                response = await client.aio.models.generate_content(
+                    model=model_name,
+                    contents=contents,
+                    config=call_config
+                )
+            except genai_errors.ClientError as e:
+                if "cached_content" not in call_config or e.code == 429:
+                    raise
+                get_prompt_cache().invalidate(api_key, model_name)
+                response = await client.aio.models.generate_content(
+                    model=model_name,
+                    contents=contents,
+                    config={**config, "system_instruction": GeminiService.SYSTEM_PROMPT}
+                )
+        except Exception as e:
+            # Key state lives in SQLite: keep it off the event loop
+            await asyncio.to_thread(GeminiService._handle_error, km, api_key, e)
+            raise
+
+        settle = km.record_success if response.text else km.record_usage
+        await asyncio.to_thread(settle, api_key, estimated_tokens, GeminiService._usage_tokens(response))
+        return response.text
+
+    @staticmethod
+    async def _acall_gemini(call_type, contents, config, retry_count=3, system_prompt=False):
+        """
+        _call_gemini on the event loop: waiting for a key or a reply doesn't hold a thread.
+        Same retries, key rotation and model routing; hedging is not applied.
+        """
+        km = get_key_manager()
+        router = get_model_router()
+        llm = get_llm_executor()
+        models = router.candidates(call_type)
+        estimated_tokens = GeminiService._estimate_tokens(contents)
+
+        for attempt in range(retry_count):
+            model_name = models[attempt % len(models)]
+            if cancelled():
+                return None
+            if attempt:
+                GEMINI_RETRIES.inc(call_type=call_type)
+            with span("gemini.key_wait"):
+                api_key = await km.aget_key(estimated_tokens)
+            if not api_key:
+                logging.error("No active API keys available for this request.")
+                return None
+
+            try:
+                await llm.aacquire()
+            except LLMBusyError:
                 return None
+            with span("gemini.attempt", call_type=call_type, model=model_name, key=mask_key(api_key), attempt=attempt) as s:
+                start = time.perf_counter()
+                try:
+                    result = await GeminiService._aattempt(
+                        km, api_key, model_name, contents, config, estimated_tokens, system_prompt)
+                except Exception as e:
+                    s.set(outcome="error", code=getattr(e, "code", None))
+                    GeminiService._record_attempt(router, call_type, model_name, time.perf_counter() - start, e)
+                    # Continue to next attempt with a new key
+                    continue
+                finally:
+                    llm.release()
+                s.set(outcome="ok" if result else "empty")
+                GeminiService._record_attempt(router, call_type, model_name, time.perf_counter() - start)
+            return result or None
+
         return None
 
+    @staticmethod
+    async def _astream_gemini(call_type, contents, config, retry_count=3, system_prompt=False):
+        """Async generator version of _stream_gemini."""
+        km = get_key_manager()
+        router = get_model_router()
+        llm = get_llm_executor()
+        models = router.candidates(call_type)
+        estimated_tokens = GeminiService._estimate_tokens(contents)
+
+        for attempt in range(retry_count):
+            model_name = models[attempt % len(models)]
+            if cancelled():
+                return
+            if attempt:
+                GEMINI_RETRIES.inc(call_type=call_type)
+            with span("gemini.key_wait"):
+                api_key = await km.aget_key(estimated_tokens)
+            if not api_key:
+                logging.error("No active API keys available for this request.")
+                return
+            try:
+                await llm.aacquire()
+            except LLMBusyError:
+                return
+            start = time.perf_counter()
+            attempt_span = open_span(
+                "gemini.stream_attempt", call_type=call_type, model=model_name, key=mask_key(api_key), attempt=attempt)
+
+            started = False
+            call_config = config
+            try:
+                client = get_client_pool().get(api_key)
+                if system_prompt:
+                    call_config = {**config, **GeminiService._system_prompt_config(api_key, model_name)}
+                usage_tokens = None
+                async for chunk in await client.aio.models.generate_content_stream(
+                    model=model_name,
+                    contents=contents,
+                    config=call_config
+                ):
+                    usage_tokens = GeminiService._usage_tokens(chunk) or usage_tokens
+                    if chunk.text:
+                        if not started:
+                            attempt_span.set(first_chunk_ms=round((time.perf_counter() - start) * 1000, 2))
+                        started = True
+                        yield chunk.text
+                await asyncio.to_thread(km.record_success, api_key, estimated_tokens, usage_tokens)
+                GeminiService._record_attempt(router, call_type, model_name, time.perf_counter() - start)
+                attempt_span.set(outcome="ok")
+                attempt_span.finish()
+                return
+
+            except genai_errors.ClientError as e:
+                GeminiService._record_attempt(router, call_type, model_name, time.perf_counter() - start, e)
+                attempt_span.set(outcome="error", code=e.code)
+                attempt_span.finish()
+                if not started and "cached_content" in call_config and e.code != 429:
+                    get_prompt_cache().invalidate(api_key, model_name)
+                    continue
+                await asyncio.to_thread(GeminiService._handle_error, km, api_key, e)
+                if started:
+                    return
+            except Exception as e:
+                GeminiService._record_attempt(router, call_type, model_name, time.perf_counter() - start, e)
+                attempt_span.set(outcome="error", code=getattr(e, "code", None))
+                attempt_span.finish()
+                await asyncio.to_thread(GeminiService._handle_error, km, api_key, e)
+                if started:
+                    return
+            finally:
+                llm.release()
+
+    @staticmethod
+    async def agenerate_response(user_input, history=None, summary=None):
+        prompt = GeminiService._build_reflection_prompt(user_input, history or [], summary)
+        result_text = await GeminiService._acall_gemini("reflection", prompt, GeminiService.REFLECTION_CONFIG, system_prompt=True)
+        return GeminiService._parse_json("reflection", result_text)
+
+    @staticmethod
+    async def astream_response(user_input, history=None, summary=None):
+        prompt = GeminiService._build_reflection_prompt(user_input, history or [], summary)
+        parser = JSONFieldStreamParser(["reflection", "insight", "follow_up"])
+        async for chunk in GeminiService._astream_gemini("reflection", prompt, GeminiService.REFLECTION_CONFIG, system_prompt=True):
+            for field, text in parser.feed(chunk):
+                yield field, text
+
+    @staticmethod
+    async def aanalyze_patterns(user_input, history, existing_patterns, summary=None):
+        prompt, config = GeminiService._analysis_request(user_input, history, existing_patterns, summary)
+        return GeminiService._parse_analysis(await GeminiService._acall_gemini("analysis", prompt, config))
+
+    @staticmethod
+    async def areflect_and_analyze(user_input, history, existing_patterns, summary=None):
+        prompt, config = GeminiService._combined_request(user_input, history, existing_patterns, summary)
+        result_text = await GeminiService._acall_gemini("reflection", prompt, config, system_prompt=True)
+        return GeminiService._parse_combined(result_text)
+
+class JSONFieldStreamParser:
+    """
+    Incrementally extracts top-level string fields from a JSON object that arrives
+    in arbitrary chunks, so text can be shown before the object is complete.
+    """
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, fields):
+        self.fields = set(fields)
+        self.values = {}
+        self._state = "start"
+        self._key = ""
+        self._escape = None # None, "" (after backslash) or partial \uXXXX digits
+        self._high = None # high surrogate from a \uD8xx escape, waiting for its low half
+        self._depth = 0
+
+    def feed(self, chunk):
+        """Consumes a chunk and returns a list of (field, decoded_text) deltas."""
+        deltas = []
+        out = []
+
+        def flush():
+            if out and self._key in self.fields:
+                text = "".join(out)
+                self.values[self._key] = self.values.get(self._key, "") + text
+                deltas.append((self._key, text))
+            out.clear()
+
+        for ch in chunk:
+            state = self._state
+            if state == "start":
+                if ch == "{":
+                    self._state = "seek_key"
+            elif state == "seek_key":
+                if ch == '"':
+                    self._key = ""
+                    self._state = "key"
+                elif ch == "}":
+                    self._state = "end"
+            elif state == "key":
+                if self._escape is not None:
+                    self._key += ch
+                    self._escape = None
+                elif ch == "\\":
+                    self._escape = ""
+                elif ch == '"':
+                    self._state = "seek_colon"
+                else:
+                    self._key += ch
+            elif state == "seek_colon":
+                if ch == ":":
+                    self._state = "seek_value"
+            elif state == "seek_value":
+                if ch == '"':
+                    self._state = "string"
+                elif not ch.isspace():
+                    # Non-string value (null, number, nested): skip it
+                    self._depth = 1 if ch in "[{" else 0
+                    self._state = "skip"
+            elif state == "string":
+                if self._escape is not None:
+                    self._escape = self._decode_escape(ch, out)
+                elif ch == "\\":
+                    self._escape = ""
+                elif ch == '"':
+                    self._unpaired(out)
+                    flush()
+                    self._state = "seek_key"
+                else:
+                    self._unpaired(out)
+                    out.append(ch)
+            elif state == "skip_string":
+                if self._escape is not None:
+                    self._escape = None
+                elif ch == "\\":
+                    self._escape = ""
+                elif ch == '"':
+                    self._state = "skip"
+            elif state == "skip":
+                if ch == '"':
+                    self._state = "skip_string"
+                elif ch in "[{":
+                    self._depth += 1
+                elif ch in "]}":
+                    if self._depth == 0:
+                        self._state = "end"
+                    self._depth -= 1
+                elif ch == "," and self._depth == 0:
+                    self._state = "seek_key"
+
+        if self._state == "string":
+            flush()
+        return deltas
+
+    def _unpaired(self, out):
+        """A high surrogate not followed by a low one can't be encoded: it becomes U+FFFD."""
+        if self._high is not None:
+            out.append("\ufffd")
+            self._high = None
+
+    def _decode_escape(self, ch, out):
+        """Handles one character after a backslash. Returns the new escape state."""
+        if self._escape == "":
+            if ch == "u":
+                return "u"
+            self._unpaired(out)
+            out.append(self._ESCAPES.get(ch, ch))
+            return None
+
+        # Inside \uXXXX
+        digits = self._escape[1:] + ch
+        if len(digits) < 4:
+            return "u" + digits
+        try:
+            code = int(digits, 16)
+        except ValueError:
+            self._unpaired(out)
+            return None
+        if 0xD800 <= code <= 0xDBFF:
+            # First half of a non-BMP character (e.g. an ASCII-escaped emoji); the
+            # second half may only arrive with the next chunk
+            self._unpaired(out)
+            self._high = code
+        elif 0xDC00 <= code <= 0xDFFF:
+            if self._high is None:
+                out.append("\ufffd")
+            else:
+                out.append(chr(0x10000 + ((self._high - 0xD800) << 10) + (code - 0xDC00)))
+                self._high = None
+        else:
+            self._unpaired(out)
+            out.append(chr(code))
+        return None
@@ -0,0 +1,97 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+# Word prefixes that signal emotional or cognitive content worth analyzing
+EMOTION_CUES = (
+    "feel", "felt", "anx", "sad", "angr", "anger", "mad", "scar", "afraid", "fear", "worr",
+    "stress", "overwhelm", "lonel", "alone", "hurt", "guilt", "shame", "asham", "tired",
+    "exhaust", "hate", "cry", "upset", "frustrat", "depress", "panic", "nervous", "jealous",
+    "hopeless", "helpless", "numb", "empty", "lost", "stuck", "regret", "embarrass",
+    "always", "never", "should", "can't", "cant", "fail", "worthless", "annoy", "disappoint",
+)
+
+def _words(text):
+    return re.findall(r"[a-z']+", (text or "").lower())
+
+class AnalysisGate:
+    """
+    Cheap local check that decides whether a message is worth an LLM pattern
+    analysis, so "ok" and "thanks" don't cost an analyze_patterns call.
+
+    A message is skipped when it is:
+      - too_short: fewer than `min_words` words and no emotion cue,
+      - repeat: nearly the same words as one of the user's recent messages,
+      - too_soon: within `min_interval` seconds of the user's last analysis
+        and without an emotion cue.
+    Counters per outcome are kept for tuning the thresholds against recall.
+    """
+    def __init__(self, min_words=4, novelty_threshold=0.8, min_interval=30, max_users=10000):
+        self.min_words = min_words
+        self.novelty_threshold = novelty_threshold
+        self.min_interval = min_interval
+        self.max_users = max_users
+
+        self._last_analysis = OrderedDict() # user_id -> time of the last analysis
+        self._lock = threading.Lock()
+        self.counts = {"analyzed": 0, "too_short": 0, "repeat": 0, "too_soon": 0}
+
+    @staticmethod
+    def _similarity(a, b):
+        a, b = set(a), set(b)
+        return len(a & b) / len(a | b) if a and b else 0.0
+
+    def _reason_to_skip(self, user_id, text, history):
+        words = _words(text)
+        has_cue = any(w.startswith(EMOTION_CUES) for w in words)
+
+        if len(words) < self.min_words and not has_cue:
+            return "too_short"
+
+        # history ends with the message being checked
+        previous = [m["content"] for m in history[:-1] if m["role"] == "user"]
+        if any(self._similarity(words, _words(p)) >= self.novelty_threshold for p in previous):
+            return "repeat"
+
+        last = self._last_analysis.get(user_id)
+        if not has_cue and last is not None and time.time() - last < self.min_interval:
+            return "too_soon"
+        return None
+
+    def should_analyze(self, user_id, text, history):
+        """Returns (True, "analyzed") and records the analysis, or (False, reason)."""
+        with self._lock:
+            reason = self._reason_to_skip(user_id, text, history)
+            if reason is None:
+                reason = "analyzed"
+                self._last_analysis[user_id] = time.time()
+                self._last_analysis.move_to_end(user_id)
+                while len(self._last_analysis) > self.max_users:
+                    self._last_analysis.popitem(last=False)
+            self.counts[reason] += 1
+            return reason == "analyzed", reason
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+_gate = None
+_gate_lock = threading.Lock()
+
+def get_analysis_gate():
+    """Returns the process-wide analysis gate, or None when every message is analyzed."""
+    global _gate
+    if not current_app.config.get("ANALYSIS_GATE_ENABLED", True):
+        return None
+    if _gate is None:
+        with _gate_lock:
+            if _gate is None:
+                config = current_app.config
+                _gate = AnalysisGate(
+                    min_words=config.get("ANALYSIS_GATE_MIN_WORDS", 4),
+                    novelty_threshold=config.get("ANALYSIS_GATE_NOVELTY_THRESHOLD", 0.8),
+                    min_interval=config.get("ANALYSIS_GATE_MIN_INTERVAL", 30),
+                )
+    return _gate
@@ -0,0 +1,181 @@
+import asyncio
+import io
+import json
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from flask import Response, jsonify, request
+from app.routes import get_user_id
+from app.services import ReflectionService
+
+class AsgiApp:
+    """
+    ASGI front for the Flask app (see asgi.py at the project root).
+
+    /api/reflect and /api/reflect/stream run natively on the event loop: the
+    Gemini call uses the SDK's async client and SQLite work goes through
+    run_db, so a waiting reflection holds no thread and one process can keep
+    hundreds in flight. Every other route is handed to the unchanged Flask
+    (WSGI) app on a thread pool. Native routes still go through Flask's
+    request context, session cookie and before/after_request hooks.
+    """
+    def __init__(self, flask_app, wsgi_workers=None):
+        self.logger = logging.getLogger("AsgiApp")
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(
+            max_workers=wsgi_workers or flask_app.config.get("ASGI_WSGI_WORKERS", 16), thread_name_prefix="asgi-wsgi"
+        )
+        self.routes = {
+            ("POST", "/api/reflect"): self.reflect,
+            ("POST", "/api/reflect/stream"): self.reflect_stream,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        body = await self._read_body(receive)
+        environ = self._environ(scope, body)
+        handler = self.routes.get((scope["method"], scope["path"]))
+        if handler is None:
+            await self._call_wsgi(environ, send)
+            return
+        with self.flask_app.request_context(environ):
+            try:
+                response = self.flask_app.preprocess_request() # before_request hooks (metrics, tracing)
+                if response is None:
+                    response = await handler(send)
+                    if response is None:
+                        return # streamed
+                response = self.flask_app.process_response(self.flask_app.make_response(response))
+            except Exception as e:
+                self.logger.exception(f"Error handling {scope['path']}: {e}")
+                response = self.flask_app.make_response((jsonify({"error": "Internal server error"}), 500))
+            await self._send_response(send, response)
+
+    # --- Native routes (same behaviour as their Flask counterparts in app/routes.py) ---
+
+    @staticmethod
+    def _feeling():
+        data = request.get_json(silent=True) or {}
+        return data.get('feeling', '')
+
+    async def reflect(self, send):
+        user_id = get_user_id()
+        user_feeling = self._feeling()
+        if not user_feeling:
+            return jsonify({"error": "No feeling provided"}), 400
+        return jsonify(await ReflectionService.aget_reflection_response(user_id, user_feeling))
+
+    async def reflect_stream(self, send):
+        user_id = get_user_id()
+        user_feeling = self._feeling()
+        if not user_feeling:
+            return jsonify({"error": "No feeling provided"}), 400
+
+        # Headers (and the session cookie) go out before the first event
+        response = Response(
+            mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        response = self.flask_app.process_response(response)
+        await send({"type": "http.response.start", "status": response.status_code, "headers": self._headers(response)})
+        try:
+            async for event, payload in ReflectionService.astream_reflection_response(user_id, user_feeling):
+                chunk = f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+                await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        except Exception as e:
+            # The status line is gone already; end the stream and let the client retry
+            self.logger.exception(f"Reflection stream failed: {e}")
+        await send({"type": "http.response.body", "body": b""})
+        return None
+
+    # --- Plumbing ---
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_body(receive):
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        return body
+
+    @staticmethod
+    def _environ(scope, body):
+        """A WSGI environ for the ASGI request (PEP 3333 / ASGI spec mapping)."""
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client")
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0] if client else "",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_LENGTH":
+                continue
+            key = name if name == "CONTENT_TYPE" else f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    @staticmethod
+    def _headers(response):
+        return [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in response.headers.items()]
+
+    async def _send_response(self, send, response):
+        await send({"type": "http.response.start", "status": response.status_code, "headers": self._headers(response)})
+        await send({"type": "http.response.body", "body": response.get_data()})
+
+    async def _call_wsgi(self, environ, send):
+        """Runs the Flask app on the thread pool and relays its (buffered) response."""
+        def run():
+            started = {}
+
+            def start_response(status, headers, exc_info=None):
+                started["status"] = int(status.split(" ", 1)[0])
+                started["headers"] = headers
+
+            result = self.flask_app(environ, start_response)
+            try:
+                body = b"".join(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            return started["status"], started["headers"], body
+
+        status, headers, body = await asyncio.get_running_loop().run_in_executor(self.executor, run)
+        await send({
+            "type": "http.response.start", "status": status,
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        })
+        await send({"type": "http.response.body", "body": body})
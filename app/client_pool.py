@@ -0,0 +1,77 @@
+import logging
+import threading
+from google import genai
+from flask import current_app
+from app.key_manager import mask_key
+
+class GeminiClientPool:
+    """
+    Keeps one long-lived genai.Client per API key.
+    Each client owns an httpx connection pool, so reusing it keeps TCP/TLS
+    (and HTTP/2, when available) connections warm between calls.
+    httpx clients are thread-safe, so a client is shared by all threads.
+    """
+    def __init__(self, factory=None, http2=False):
+        self.logger = logging.getLogger("GeminiClientPool")
+        self.http2 = http2 and self._http2_available()
+        self.factory = factory or self._default_factory
+
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _http2_available():
+        try:
+            import h2 # noqa: F401 - optional dependency of httpx
+            return True
+        except ImportError:
+            logging.getLogger("GeminiClientPool").warning(
+                "HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1 keep-alive."
+            )
+            return False
+
+    def _default_factory(self, api_key):
+        http_options = {"client_args": {"http2": True}} if self.http2 else None
+        return genai.Client(api_key=api_key, http_options=http_options)
+
+    def get(self, api_key):
+        """Returns the shared client for a key, creating it on first use."""
+        client = self._clients.get(api_key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(api_key)
+                if client is None:
+                    client = self.factory(api_key)
+                    self._clients[api_key] = client
+        return client
+
+    def evict(self, api_key):
+        """Drops (and closes) the client for a key, e.g. when the key is disabled."""
+        with self._lock:
+            client = self._clients.pop(api_key, None)
+        if client is not None:
+            self.logger.info(f"Evicted client for key {mask_key(api_key)}.")
+            close = getattr(client, "close", None)
+            if close:
+                try:
+                    close()
+                except Exception as e:
+                    self.logger.warning(f"Error closing client: {e}")
+
+    def clear(self):
+        for api_key in list(self._clients):
+            self.evict(api_key)
+
+    def __len__(self):
+        return len(self._clients)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_client_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = GeminiClientPool(http2=current_app.config.get("GEMINI_HTTP2", True))
+    return _pool
@@ -1,132 +1,400 @@
+import asyncio
+import contextvars
 import sqlite3
 import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from flask import current_app, g
+from app.history_cache import get_history_cache
+from app.migrations import run_migrations
+from app.metrics import timed_db
+from app.pattern_index import get_pattern_index
+from app.tracing import traced
+
+# Per-connection tuning (journal_mode=WAL is set once by the migration runner)
+PRAGMAS = (
+    'PRAGMA synchronous = NORMAL', # safe with WAL; fsync only at checkpoints
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000', # 16 MB page cache
+    'PRAGMA mmap_size = 268435456', # 256 MB memory-mapped reads
+)
+
+def apply_pragmas(conn, busy_timeout=5):
+    """Applies PRAGMAS; busy_timeout (seconds) should match the timeout the connection was opened with."""
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    conn.execute(f'PRAGMA busy_timeout = {int(busy_timeout * 1000)}')
+    return conn
+
+class ConnectionPool:
+    """
+    Keeps one long-lived connection per thread for a database file, so pragmas
+    and the prepared-statement cache are set up once instead of per request.
+    Connections of threads that have exited are reclaimed; beyond `max_size`,
+    callers get a temporary connection that is closed on release.
+    """
+    def __init__(self, db_path, max_size=32, health_check_interval=30, statement_cache=512):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.statement_cache = statement_cache
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {} # thread ident -> connection
+        self._temporary = set()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=self.statement_cache,
+            check_same_thread=False # only so reclaimed connections can be closed by another thread
+        )
+        conn.row_factory = sqlite3.Row
+        return apply_pragmas(conn)
+
+    def _healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _reclaim(self):
+        """Closes connections owned by threads that no longer exist. Caller holds the lock."""
+        alive = {t.ident for t in threading.enumerate()}
+        for ident in [i for i in self._connections if i not in alive]:
+            try:
+                self._connections.pop(ident).close()
+            except sqlite3.Error:
+                pass
+
+    def acquire(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            now = time.monotonic()
+            if now - self._local.checked_at < self.health_check_interval:
+                return conn
+            if self._healthy(conn):
+                self._local.checked_at = now
+                return conn
+            self._discard(conn)
+
+        with self._lock:
+            if len(self._connections) >= self.max_size:
+                self._reclaim()
+            if len(self._connections) >= self.max_size:
+                conn = self._connect()
+                self._temporary.add(id(conn))
+                return conn
+            conn = self._connect()
+            self._connections[threading.get_ident()] = conn
+
+        self._local.conn = conn
+        self._local.checked_at = time.monotonic()
+        return conn
+
+    def release(self, conn):
+        """Returns a connection after a request; nothing is left in a transaction."""
+        if id(conn) in self._temporary:
+            self._temporary.discard(id(conn))
+            conn.close()
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._connections.pop(threading.get_ident(), None)
+        self._local.conn = None
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def __len__(self):
+        return len(self._connections)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path=None):
+    """Returns the connection pool for db_path (default: the app's DATABASE_PATH)."""
+    db_path = db_path or current_app.config['DATABASE_PATH']
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path, max_size=current_app.config.get('DB_POOL_MAX_SIZE', 32))
+                _pools[db_path] = pool
+    return pool
 
 def get_db():
-    """Connects to the database and ensures it is closed after the request."""
+    """Returns this thread's pooled connection for the duration of the request."""
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE_PATH'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().acquire()
     return g.db
 
 def close_db(e=None):
-    """Closes the database connection."""
+    """Hands the connection back to the pool."""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
 
 def init_db(app):
-    """Initializes the database schema."""
-    with app.app_context():
+    """Brings the database schema up to date (see app/migrations.py)."""
+    run_migrations(app.config['DATABASE_PATH'])
+
+def get_write_buffer():
+    """The app's group-commit writer (app/write_buffer.py), or None when writes go direct."""
+    return current_app.extensions.get('write_buffer')
+
+# --- Async access (ASGI mode) ---
+_async_executor = None
+_async_executor_lock = threading.Lock()
+
+def _get_async_executor():
+    global _async_executor
+    if _async_executor is None:
+        with _async_executor_lock:
+            if _async_executor is None:
+                _async_executor = ThreadPoolExecutor(
+                    max_workers=current_app.config.get('ASYNC_DB_WORKERS', 16), thread_name_prefix="db-async"
+                )
+    return _async_executor
+
+async def run_db(fn, *args, **kwargs):
+    """
+    Awaits a blocking function that touches SQLite (any of the functions below,
+    or a service step made of them) without blocking the event loop. It runs on
+    a thread pool inside its own app context, so it uses that thread's pooled
+    connection; contextvars (e.g. the current trace) are carried over.
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            return fn(*args, **kwargs)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_async_executor(), contextvars.copy_context().run, run)
+
+# --- Per-user data versions (for ETags) ---
+# Bumped in the same transaction as every write to a user's patterns or topics,
+# so any process (request worker or job worker) sees the change and an
+# unchanged panel can be answered with 304 after a single primary-key lookup.
+
+def get_data_version(user_id):
+    """Returns an opaque token that changes whenever the user's patterns or topics change."""
+    row = get_db().execute('SELECT version FROM user_data_versions WHERE user_id = ?', (user_id,)).fetchone()
+    return str(row[0] if row else 0)
+
+def _bump_data_version(db, user_id):
+    db.execute(
+        '''INSERT INTO user_data_versions (user_id, version) VALUES (?, 1)
+           ON CONFLICT(user_id) DO UPDATE SET version = version + 1''',
+        (user_id,)
+    )
+
+def _write(op, wait=True, user_id=None):
+    """
+    Runs op(conn) as a write. With the write buffer running it is batched into
+    a shared transaction; wait=False returns a Future instead of blocking.
+    Without it, op runs on this thread's connection and commits immediately.
+    Pass user_id to bump that user's data version in the same transaction.
+    """
+    if user_id is not None:
+        user_op = op
+
+        def op(db):
+            result = user_op(db)
+            _bump_data_version(db, user_id)
+            return result
+
+    buffer = get_write_buffer()
+    if buffer is None:
         db = get_db()
-        # Create Messages Table
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT, -- For anonymous session isolation
-                role TEXT NOT NULL, -- 'user' or 'ai'
-                content TEXT NOT NULL,
-                context_type TEXT,  -- e.g., 'feeling_checkup', 'general_chat'
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        # Create Patterns Table
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS patterns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL, 
-                pattern_name TEXT NOT NULL,
-                pattern_type TEXT NOT NULL, -- 'emotional', 'cognitive', 'behavioral'
-                confidence_score REAL,
-                weight REAL DEFAULT 0.0, -- Impact/Significance score (0-1)
-                occurrences_count INTEGER DEFAULT 1,
-                first_detected TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_detected TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'new' -- 'new', 'acknowledged', 'working_on_it', 'explored'
-            )
-        ''')
-        # Create Learning Topics Table
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS learning_topics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                pattern_id INTEGER,
-                topic_title TEXT NOT NULL,
-                topic_content TEXT NOT NULL,
-                interactive_hint TEXT,
-                completion_status TEXT DEFAULT 'unread', -- 'unread', 'in_progress', 'completed'
-                difficulty_level TEXT DEFAULT 'beginner', -- 'beginner', 'intermediate', 'advanced'
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_accessed TIMESTAMP,
-                FOREIGN KEY(pattern_id) REFERENCES patterns(id)
-            )
-        ''')
-        # Create User Activity Table (Optional extension)
-        db.execute('''
-            CREATE TABLE IF NOT EXISTS user_activity (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                activity_type TEXT NOT NULL,
-                detail TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        result = op(db)
         db.commit()
+        return result
 
-def save_message(user_id, role, content, context_type='general'):
-    """Saves a message to the database."""
-    db = get_db()
-    db.execute(
+    future = buffer.submit(op)
+    if not wait:
+        return future
+    return future.result(current_app.config.get('WRITE_BUFFER_TIMEOUT', 30))
+
+@timed_db
+@traced
+def save_message(user_id, role, content, context_type='general', wait=True):
+    """Saves a message to the database (and the user's cached history once committed)."""
+    result = _write(lambda db: db.execute(
         'INSERT INTO messages (user_id, role, content, context_type) VALUES (?, ?, ?, ?)',
         (user_id, role, content, context_type)
-    )
-    db.commit()
+    ).lastrowid, wait)
 
-def get_recent_history(user_id, limit=10):
-    """Retrieves the most recent chat messages for a user."""
+    cache = get_history_cache()
+    if cache is not None:
+        if not isinstance(result, Future):
+            cache.append(user_id, result, role, content)
+        else:
+            result.add_done_callback(
+                lambda f: cache.invalidate(user_id) if f.exception() else cache.append(user_id, f.result(), role, content)
+            )
+    return result
+
+def _load_recent_history(user_id, limit):
     db = get_db()
     cursor = db.execute(
-        'SELECT role, content FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+        'SELECT id, role, content FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?',
         (user_id, limit)
     )
     rows = cursor.fetchall()
     # Reverse to return chronologically (Oldest -> Newest)
     return [dict(row) for row in reversed(rows)]
 
+def _recent_message_ids(user_id, limit):
+    """Ids of the user's newest messages, newest first (served from idx_messages_user_id alone)."""
+    return [row[0] for row in get_db().execute(
+        'SELECT id FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?', (user_id, limit)
+    )]
+
+@timed_db
+@traced
+def get_recent_history(user_id, limit=10):
+    """Retrieves the most recent chat messages for a user (from the history cache when possible)."""
+    cache = get_history_cache()
+    if cache is None:
+        return [{"role": m["role"], "content": m["content"]} for m in _load_recent_history(user_id, limit)]
+    return cache.get(
+        user_id, limit, lambda n: _load_recent_history(user_id, n), lambda n: _recent_message_ids(user_id, n))
+
+# --- Conversation summaries (see ReflectionService.update_summary in app/services.py) ---
+
+@timed_db
+@traced
+def get_conversation_summary(user_id):
+    """Returns {"summary", "covered_message_id"} for the user, or None before the first summary."""
+    row = get_db().execute(
+        'SELECT summary, covered_message_id FROM conversation_summaries WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+@timed_db
+@traced
+def save_conversation_summary(user_id, summary, covered_message_id, wait=True):
+    """Stores a new summary unless one covering later messages was saved meanwhile."""
+    return _write(lambda db: db.execute(
+        '''INSERT INTO conversation_summaries (user_id, summary, covered_message_id, updated_at)
+           VALUES (?, ?, ?, ?)
+           ON CONFLICT(user_id) DO UPDATE SET
+               summary = excluded.summary,
+               covered_message_id = excluded.covered_message_id,
+               updated_at = excluded.updated_at
+           WHERE excluded.covered_message_id > conversation_summaries.covered_message_id''',
+        (user_id, summary, covered_message_id, time.time())
+    ).rowcount, wait)
+
+@timed_db
+@traced
+def count_messages_since(user_id, after_id):
+    """Number of the user's messages with an id above after_id."""
+    return get_db().execute(
+        'SELECT COUNT(*) FROM messages WHERE user_id = ? AND id > ?', (user_id, after_id)
+    ).fetchone()[0]
+
+@timed_db
+@traced
+def get_messages_since(user_id, after_id, limit, newest=False):
+    """
+    The user's first (or, with newest=True, last) `limit` messages with an id
+    above after_id, oldest first, with their ids.
+    """
+    rows = get_db().execute(
+        f'SELECT id, role, content FROM messages WHERE user_id = ? AND id > ? ORDER BY id {"DESC" if newest else "ASC"} LIMIT ?',
+        (user_id, after_id, limit)
+    ).fetchall()
+    rows = [dict(row) for row in rows]
+    return rows[::-1] if newest else rows
+
+# --- Batched pattern analysis watermarks ---
+
+@timed_db
+@traced
+def get_pattern_watermark(user_id):
+    """Id of the last message covered by the user's batched pattern analysis (0 before the first)."""
+    row = get_db().execute(
+        'SELECT analyzed_message_id FROM pattern_watermarks WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return row[0] if row else 0
+
+@timed_db
+@traced
+def save_pattern_watermark(user_id, message_id):
+    """Moves the watermark forward. Returns False if another analysis already got further."""
+    return _write(lambda db: db.execute(
+        '''INSERT INTO pattern_watermarks (user_id, analyzed_message_id, updated_at) VALUES (?, ?, ?)
+           ON CONFLICT(user_id) DO UPDATE SET
+               analyzed_message_id = excluded.analyzed_message_id,
+               updated_at = excluded.updated_at
+           WHERE excluded.analyzed_message_id > pattern_watermarks.analyzed_message_id''',
+        (user_id, message_id, time.time())
+    ).rowcount > 0)
+
+@timed_db
+@traced
+def count_unanalyzed_messages(user_id, after_id):
+    """(count, Unix time of the oldest) of the user's own messages with an id above after_id."""
+    row = get_db().execute(
+        '''SELECT COUNT(*), CAST(strftime('%s', MIN(timestamp)) AS REAL)
+           FROM messages WHERE user_id = ? AND id > ? AND role = 'user' ''',
+        (user_id, after_id)
+    ).fetchone()
+    return row[0], row[1]
+
 # --- Pattern Helper Functions ---
 
+@timed_db
+@traced
 def add_pattern(pattern_name, pattern_type, confidence_score, weight=0.0, user_id=None):
-    """Adds a new pattern or updates an equivalent existing one."""
-    db = get_db()
-    
-    # Check if a similar pattern applies (simple name check for now)
-    cursor = db.execute(
-        'SELECT id, occurrences_count FROM patterns WHERE pattern_name = ? AND user_id = ?',
-        (pattern_name, user_id)
-    )
-    existing = cursor.fetchone()
-    
-    if existing:
-        new_count = existing['occurrences_count'] + 1
-        db.execute(
-            '''UPDATE patterns 
-               SET occurrences_count = ?, last_detected = CURRENT_TIMESTAMP, confidence_score = ?, weight = ?
-               WHERE id = ?''',
-            (new_count, confidence_score, weight, existing['id'])
-        )
-        db.commit()
-        return existing['id'], False # False = not new
-    else:
-        cursor = db.execute(
-            '''INSERT INTO patterns (user_id, pattern_name, pattern_type, confidence_score, weight) 
-               VALUES (?, ?, ?, ?, ?)''',
+    """
+    Adds a new pattern or updates an equivalent existing one (single atomic upsert).
+    Near-duplicate names are mapped onto the user's existing pattern first (see app/pattern_index.py).
+    """
+    index = get_pattern_index()
+    if index is not None:
+        db = get_db()
+        # Cheap change check, so patterns stored by other processes are seen
+        version = tuple(db.execute('SELECT COUNT(*), MAX(id) FROM patterns WHERE user_id = ?', (user_id,)).fetchone())
+        pattern_name = index.resolve(user_id, pattern_name, pattern_type, version, lambda: db.execute(
+            'SELECT pattern_name, pattern_type FROM patterns WHERE user_id = ? ORDER BY id', (user_id,)
+        ).fetchall())
+
+    def op(db):
+        row = db.execute(
+        '''INSERT INTO patterns (user_id, pattern_name, pattern_type, confidence_score, weight)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(user_id, pattern_name) DO UPDATE SET
+               occurrences_count = occurrences_count + 1,
+               last_detected = CURRENT_TIMESTAMP,
+               confidence_score = excluded.confidence_score,
+               weight = excluded.weight
+           RETURNING id, occurrences_count''',
             (user_id, pattern_name, pattern_type, confidence_score, weight)
-        )
-        db.commit()
-        return cursor.lastrowid, True # True = new
+        ).fetchone()
+        return row['id'], row['occurrences_count'] == 1 # True = new
+    result = _write(op, user_id=user_id)
+    if index is not None:
+        index.add(user_id, pattern_name, pattern_type, *result)
+    return result
 
+@timed_db
+@traced
 def get_patterns(user_id, filter_type=None):
     """Retrieves patterns for a user."""
     db = get_db()
@@ -142,25 +410,27 @@ def get_patterns(user_id, filter_type=None):
     cursor = db.execute(query, params)
     return [dict(row) for row in cursor.fetchall()]
 
-def update_pattern_status(user_id, pattern_id, status):
+@timed_db
+@traced
+def update_pattern_status(user_id, pattern_id, status, wait=True):
     """Updates the status of a pattern."""
-    db = get_db()
-    db.execute(
+    return _write(lambda db: db.execute(
         'UPDATE patterns SET status = ? WHERE id = ? AND user_id = ?',
         (status, pattern_id, user_id)
-    )
-    db.commit()
+    ).rowcount, wait, user_id)
 
-def save_learning_topic(user_id, pattern_id, topic_title, topic_content, interactive_hint, difficulty='beginner'):
+@timed_db
+@traced
+def save_learning_topic(user_id, pattern_id, topic_title, topic_content, interactive_hint, difficulty='beginner', wait=True):
     """Saves an AI-generated learning topic."""
-    db = get_db()
-    db.execute(
+    return _write(lambda db: db.execute(
         '''INSERT INTO learning_topics (user_id, pattern_id, topic_title, topic_content, interactive_hint, difficulty_level)
            VALUES (?, ?, ?, ?, ?, ?)''',
         (user_id, pattern_id, topic_title, topic_content, interactive_hint, difficulty)
-    )
-    db.commit()
+    ).lastrowid, wait, user_id)
 
+@timed_db
+@traced
 def get_learning_topic(user_id, pattern_id):
     """Retrieves the learning topic for a pattern."""
     db = get_db()
@@ -171,6 +441,39 @@ def get_learning_topic(user_id, pattern_id):
     row = cursor.fetchone()
     return dict(row) if row else None
 
+TOPIC_COLUMNS = (
+    'id', 'user_id', 'pattern_id', 'topic_title', 'topic_content', 'interactive_hint',
+    'completion_status', 'difficulty_level', 'created_at', 'last_accessed'
+)
+
+@timed_db
+@traced
+def get_patterns_with_topics(user_id):
+    """Retrieves a user's patterns, each with its learning topic (or None), in one query."""
+    db = get_db()
+    topic_columns = ', '.join(f't.{c} AS topic_{c}' for c in TOPIC_COLUMNS)
+    cursor = db.execute(
+        f'''SELECT p.*, {topic_columns}
+           FROM patterns p
+           LEFT JOIN learning_topics t ON t.id = (
+               SELECT MIN(id) FROM learning_topics WHERE user_id = p.user_id AND pattern_id = p.id
+           )
+           WHERE p.user_id = ?
+           ORDER BY p.last_detected DESC''',
+        (user_id,)
+    )
+    results = []
+    for row in cursor.fetchall():
+        row = dict(row)
+        topic = {c: row.pop(f'topic_{c}') for c in TOPIC_COLUMNS}
+        results.append({
+            "pattern": row,
+            "topic": topic if topic['id'] is not None else None
+        })
+    return results
+
+@timed_db
+@traced
 def get_all_learning_topics(user_id):
     """Retrieves all learning topics for a user."""
     db = get_db()
@@ -184,12 +487,12 @@ def get_all_learning_topics(user_id):
     )
     return [dict(row) for row in cursor.fetchall()]
 
-def update_topic_progress(user_id, topic_id, status):
+@timed_db
+@traced
+def update_topic_progress(user_id, topic_id, status, wait=True):
     """Updates the completion status of a topic."""
-    db = get_db()
-    db.execute(
+    return _write(lambda db: db.execute(
         'UPDATE learning_topics SET completion_status = ?, last_accessed = CURRENT_TIMESTAMP WHERE id = ? AND user_id = ?',
         (status, topic_id, user_id)
-    )
-    db.commit()
+    ).rowcount, wait, user_id)
 
@@ -0,0 +1,272 @@
+import asyncio
+import datetime
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+from google.genai import errors as genai_errors
+
+# Patterns the fake analysis picks from (deterministically, by message)
+FAKE_PATTERNS = (
+    ("Avoidance Coping", "behavioral"), ("Catastrophizing", "cognitive"), ("People Pleasing", "behavioral"),
+    ("Self-Criticism", "cognitive"), ("Emotional Suppression", "emotional"), ("Rumination", "cognitive"),
+    ("Fear of Rejection", "emotional"), ("Perfectionism", "cognitive"), ("Social Withdrawal", "behavioral"),
+)
+
+class FakeGeminiBackend:
+    """
+    Deterministic stand-in for the Gemini API, for benchmarks and tests.
+    Plug it in through the client pool factory:
+
+        app.client_pool._pool = GeminiClientPool(factory=FakeGeminiBackend(...).client)
+
+    Latency is log-normal around `latency_ms` (spread `latency_sigma`).
+    With probability `burst_rate` per call, a key starts a burst of
+    `burst_length` 429 responses (carrying a RetryInfo delay of
+    `retry_delay` seconds). `malformed_rate` of replies are truncated JSON.
+    `error_rate` of calls fail with a 503. `model_profiles` overrides
+    latency_ms / latency_sigma / error_rate per model name, e.g. to make the
+    primary model slow in a routing test.
+    Cached content (client.caches) is tracked per key: `counts` records how
+    many caches were created and whether each call carried the system prompt
+    inline or as a cached_content reference, and a call naming a cache that
+    doesn't exist or has expired fails with a 404. `min_cache_tokens` rejects
+    smaller cached content with a 400, like the API's minimum size.
+    The reply kind (reflection / combined / analysis / learning topic) is
+    inferred from the prompt and config, like the real prompts ask for.
+    """
+    def __init__(self, latency_ms=300, latency_sigma=0.4, burst_rate=0.0, burst_length=5,
+                 retry_delay=1, malformed_rate=0.0, error_rate=0.0, model_profiles=None,
+                 stream_chunk_chars=24, min_cache_tokens=0, seed=0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.burst_rate = burst_rate
+        self.burst_length = burst_length
+        self.retry_delay = retry_delay
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.model_profiles = model_profiles or {}
+        self.stream_chunk_chars = stream_chunk_chars
+        self.min_cache_tokens = min_cache_tokens
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._bursts = {} # api_key -> remaining 429s
+        self._cache_ids = itertools.count(1)
+        self._caches = {} # name -> (api_key, expires_at)
+        self.counts = {
+            "calls": 0, "rate_limited": 0, "server_errors": 0, "malformed": 0,
+            "caches_created": 0, "caches_updated": 0, "prompt_inline": 0, "prompt_cached": 0,
+        }
+        self.calls_by_model = {}
+
+    def client(self, api_key):
+        """Client factory for GeminiClientPool."""
+        return FakeGeminiClient(self, api_key)
+
+    def _draw(self):
+        with self._lock:
+            return self._random.random(), self._random.gauss(0, 1)
+
+    def _profile(self, model, name):
+        return self.model_profiles.get(model, {}).get(name, getattr(self, name))
+
+    def _latency(self, model):
+        latency_ms = self._profile(model, "latency_ms")
+        if latency_ms <= 0:
+            return 0.0
+        _, z = self._draw()
+        return latency_ms / 1000 * math.exp(self._profile(model, "latency_sigma") * z)
+
+    def _check_errors(self, model):
+        roll, _ = self._draw()
+        if roll < self._profile(model, "error_rate"):
+            with self._lock:
+                self.counts["server_errors"] += 1
+            raise genai_errors.ServerError(503, {"error": {
+                "code": 503, "message": "The model is overloaded (fake).", "status": "UNAVAILABLE",
+            }})
+
+    def _check_quota(self, api_key, model):
+        """Raises a 429 while the key is inside a burst."""
+        roll, _ = self._draw()
+        with self._lock:
+            self.counts["calls"] += 1
+            self.calls_by_model[model] = self.calls_by_model.get(model, 0) + 1
+            remaining = self._bursts.get(api_key, 0)
+            if remaining == 0 and roll < self.burst_rate:
+                remaining = self.burst_length
+            if remaining:
+                self._bursts[api_key] = remaining - 1
+                self.counts["rate_limited"] += 1
+                raise genai_errors.ClientError(429, {"error": {
+                    "code": 429,
+                    "message": "Resource has been exhausted (fake).",
+                    "status": "RESOURCE_EXHAUSTED",
+                    "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{self.retry_delay}s"}],
+                }})
+
+    def _check_prompt(self, api_key, config):
+        """Counts how the system prompt was sent; a reference to a missing or expired cache is a 404."""
+        config = config or {}
+        name = config.get("cached_content")
+        with self._lock:
+            if name is None:
+                if config.get("system_instruction"):
+                    self.counts["prompt_inline"] += 1
+                return
+            owner, expires_at = self._caches.get(name, (None, 0))
+            if owner != api_key or expires_at <= time.time():
+                raise genai_errors.ClientError(404, {"error": {
+                    "code": 404, "message": f"CachedContent not found (fake): {name}", "status": "NOT_FOUND",
+                }})
+            self.counts["prompt_cached"] += 1
+
+    @staticmethod
+    def _pick(text, n, salt=""):
+        return zlib.crc32(f"{salt}{text}".encode()) % n
+
+    def reply(self, contents, config):
+        """The text the model would return for this prompt (JSON, except for summaries)."""
+        prompt = str(contents)
+        config = config or {}
+        if "running summary" in prompt:
+            return "The user has been talking about feeling overwhelmed at work and unsure how to slow down."
+        if "learning topic" in prompt:
+            name = prompt.split('"')[1] if '"' in prompt else "this pattern"
+            payload = {
+                "title": f"Understanding {name}",
+                "content": f"{name} is a common way the mind tries to keep us safe. " * 3,
+                "interactive_hint": "Notice the next time it shows up, without judging it.",
+            }
+        elif "pattern detector" in prompt and not config.get("response_schema"):
+            payload = {"patterns_detected": self._patterns(prompt)}
+        else:
+            payload = {
+                "reflection": "It makes sense that this feels heavy; you're carrying a lot right now.",
+                "insight": "Feelings like this often point to something that matters to you.",
+                "follow_up": "What part of this has been sitting with you the most?",
+            }
+            if config.get("response_schema"):
+                payload["patterns_detected"] = self._patterns(prompt)
+        return json.dumps(payload)
+
+    def _patterns(self, prompt):
+        if self._pick(prompt, 3, "none") == 0:
+            return []
+        name, pattern_type = FAKE_PATTERNS[self._pick(prompt, len(FAKE_PATTERNS))]
+        score = 0.5 + self._pick(prompt, 50, "score") / 100
+        return [{"name": name, "type": pattern_type, "confidence": score, "weight": score, "reasoning": "fake"}]
+
+    def _maybe_malform(self, text):
+        roll, _ = self._draw()
+        if roll < self.malformed_rate:
+            with self._lock:
+                self.counts["malformed"] += 1
+            return text[:len(text) // 2]
+        return text
+
+    def generate(self, api_key, model, contents, config):
+        self._check_quota(api_key, model)
+        self._check_prompt(api_key, config)
+        time.sleep(self._latency(model))
+        self._check_errors(model)
+        text = self._maybe_malform(self.reply(contents, config))
+        return _response(text, contents)
+
+    def generate_stream(self, api_key, model, contents, config):
+        self._check_quota(api_key, model)
+        self._check_prompt(api_key, config)
+        text = self._maybe_malform(self.reply(contents, config))
+        chunks = [text[i:i + self.stream_chunk_chars] for i in range(0, len(text), self.stream_chunk_chars)]
+        latency = self._latency(model)
+        time.sleep(latency * 0.3) # time to first token
+        self._check_errors(model)
+        for chunk in chunks:
+            time.sleep(latency * 0.7 / len(chunks))
+            yield _response(chunk, contents)
+
+    async def agenerate(self, api_key, model, contents, config):
+        self._check_quota(api_key, model)
+        self._check_prompt(api_key, config)
+        await asyncio.sleep(self._latency(model))
+        self._check_errors(model)
+        text = self._maybe_malform(self.reply(contents, config))
+        return _response(text, contents)
+
+    async def agenerate_stream(self, api_key, model, contents, config):
+        self._check_quota(api_key, model)
+        self._check_prompt(api_key, config)
+        text = self._maybe_malform(self.reply(contents, config))
+        chunks = [text[i:i + self.stream_chunk_chars] for i in range(0, len(text), self.stream_chunk_chars)]
+        latency = self._latency(model)
+        await asyncio.sleep(latency * 0.3)
+        self._check_errors(model)
+        for chunk in chunks:
+            await asyncio.sleep(latency * 0.7 / len(chunks))
+            yield _response(chunk, contents)
+
+    def create_cache(self, api_key, config):
+        config = config or {}
+        if len(str(config.get("system_instruction", ""))) // 4 < self.min_cache_tokens:
+            raise genai_errors.ClientError(400, {"error": {
+                "code": 400, "message": "Cached content is too small (fake).", "status": "INVALID_ARGUMENT",
+            }})
+        name = f"cachedContents/fake-{next(self._cache_ids)}"
+        with self._lock:
+            self.counts["caches_created"] += 1
+        return self._keep_cache(api_key, name, config)
+
+    def update_cache(self, api_key, name, config):
+        with self._lock:
+            if self._caches.get(name, (None, 0))[0] != api_key:
+                raise genai_errors.ClientError(404, {"error": {
+                    "code": 404, "message": f"CachedContent not found (fake): {name}", "status": "NOT_FOUND",
+                }})
+            self.counts["caches_updated"] += 1
+        return self._keep_cache(api_key, name, config)
+
+    def _keep_cache(self, api_key, name, config):
+        ttl = int(str((config or {}).get("ttl", "3600s")).rstrip("s"))
+        expire_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl)
+        with self._lock:
+            self._caches[name] = (api_key, expire_time.timestamp())
+        return SimpleNamespace(name=name, expire_time=expire_time)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, "calls_by_model": dict(self.calls_by_model)}
+
+def _response(text, contents):
+    tokens = len(str(contents)) // 4 + len(text) // 4
+    return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(total_token_count=tokens))
+
+class FakeGeminiClient:
+    """The subset of genai.Client (and its .aio async client) that GeminiService uses."""
+    def __init__(self, backend, api_key):
+        self.models = SimpleNamespace(
+            generate_content=lambda model, contents, config=None: backend.generate(api_key, model, contents, config),
+            generate_content_stream=lambda model, contents, config=None: backend.generate_stream(api_key, model, contents, config),
+        )
+        self.caches = SimpleNamespace(
+            create=lambda model, config=None: backend.create_cache(api_key, config),
+            update=lambda name, config=None: backend.update_cache(api_key, name, config),
+        )
+
+        async def generate_content(model, contents, config=None):
+            return await backend.agenerate(api_key, model, contents, config)
+
+        async def generate_content_stream(model, contents, config=None):
+            return backend.agenerate_stream(api_key, model, contents, config)
+
+        # client.aio: the async client used in ASGI mode
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_content=generate_content, generate_content_stream=generate_content_stream),
+        )
+
+    def close(self):
+        pass
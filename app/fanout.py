@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+from flask import current_app
+
+# (cancel event, deadline) of the fan-out task the current code runs in, if any
+_task_scope = contextvars.ContextVar("fanout_task", default=None)
+
+class LLMBusyError(RuntimeError):
+    """No in-flight slot freed up within the wait limit."""
+
+def cancelled():
+    """True when the fan-out task running this code was cancelled or is past its deadline."""
+    scope = _task_scope.get()
+    if scope is None:
+        return False
+    event, deadline = scope
+    return event.is_set() or (deadline is not None and time.monotonic() > deadline)
+
+class FanoutTask:
+    """A call running on the LLM executor. result() waits at most until the task's deadline."""
+    def __init__(self, future, event, deadline):
+        self.future = future
+        self.event = event
+        self.deadline = deadline
+
+    def cancel(self):
+        """Drops the task if it hasn't started; otherwise it stops before its next Gemini attempt."""
+        self.event.set()
+        self.future.cancel()
+
+    def result(self):
+        """The call's result; None if it failed, was cancelled or ran out of time (the task is cancelled then)."""
+        timeout = None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+        try:
+            return self.future.result(timeout=timeout)
+        except (TimeoutError, CancelledError):
+            self.cancel()
+            return None
+        except Exception as e:
+            logging.getLogger("LLMExecutor").warning(f"Fan-out call failed: {e}")
+            return None
+
+class LLMExecutor:
+    """
+    Shared, bounded thread pool for running a request's independent Gemini
+    calls side by side (e.g. pattern analysis next to the reply), and the
+    per-process cap on in-flight Gemini calls.
+
+    Every Gemini attempt takes a slot (see GeminiService._call_gemini); when
+    all `max_in_flight` are taken, callers wait up to `slot_wait` seconds and
+    then fail with LLMBusyError instead of piling up on the API. Submitted
+    calls carry a cancel flag and deadline that _call_gemini checks before
+    each attempt, so cancelling or timing out a task stops its retries.
+    """
+    def __init__(self, workers=16, max_in_flight=256, slot_wait=10):
+        self.logger = logging.getLogger("LLMExecutor")
+        self.max_in_flight = max_in_flight
+        self.slot_wait = slot_wait
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-fanout")
+
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        """Runs fn on the pool with the caller's contextvars (app context, trace). Returns a FanoutTask."""
+        event = threading.Event()
+        deadline = time.monotonic() + timeout if timeout else None
+        context = contextvars.copy_context()
+
+        def run():
+            _task_scope.set((event, deadline))
+            if cancelled():
+                raise CancelledError()
+            return fn(*args, **kwargs)
+
+        return FanoutTask(self.executor.submit(context.run, run), event, deadline)
+
+    def _wait_limit(self):
+        scope = _task_scope.get()
+        if scope is None or scope[1] is None:
+            return self.slot_wait
+        return max(0.0, min(self.slot_wait, scope[1] - time.monotonic()))
+
+    def _busy(self):
+        with self._lock:
+            self.rejected += 1
+        self.logger.warning(f"All {self.max_in_flight} Gemini call slots busy; giving up on this call.")
+        return LLMBusyError("Too many Gemini calls in flight")
+
+    def _acquired(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def acquire(self):
+        """Takes an in-flight slot, waiting up to `slot_wait` (or the task's deadline). Raises LLMBusyError."""
+        if not self._slots.acquire(timeout=self._wait_limit()):
+            raise self._busy()
+        self._acquired()
+
+    async def aacquire(self):
+        """acquire() for the event loop: polls instead of blocking the loop while the cap is reached."""
+        give_up = time.monotonic() + self._wait_limit()
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= give_up:
+                raise self._busy()
+            await asyncio.sleep(0.01)
+        self._acquired()
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Holds one in-flight slot for the duration of a Gemini call."""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextlib.asynccontextmanager
+    async def aslot(self):
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight, "rejected": self.rejected}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_llm_executor():
+    """Returns the process-wide LLM executor."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                config = current_app.config
+                _executor = LLMExecutor(
+                    workers=config.get("LLM_FANOUT_WORKERS", 16),
+                    max_in_flight=config.get("LLM_MAX_IN_FLIGHT", 256),
+                    slot_wait=config.get("LLM_SLOT_WAIT_MAX", 10),
+                )
+    return _executor
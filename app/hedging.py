@@ -0,0 +1,131 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import current_app
+from app.latency import LatencyHistogram
+
+class RequestHedger:
+    """
+    Fires a duplicate Gemini call on a second key when the first one is slower
+    than a learned latency percentile, and returns whichever finishes first.
+
+    Python threads can't be interrupted, so "cancelling" the loser means it is
+    dropped if it hasn't started yet, or its result is discarded when it ends
+    (its key health and usage are still recorded).
+
+    Once hedging is active, every call runs on the pool (the caller must be free
+    to return whichever attempt wins), so `workers` has to cover the process's
+    concurrent Gemini calls plus their hedges; see get_hedger.
+    """
+    def __init__(self, percentile=0.95, max_rate=0.1, min_samples=20, workers=16, rate_window=60):
+        self.logger = logging.getLogger("RequestHedger")
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.rate_window = rate_window
+
+        self.latency = LatencyHistogram()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gemini-hedge")
+
+        self._calls = deque()
+        self._hedges = deque()
+        self._lock = threading.Lock()
+
+    def threshold(self):
+        """Seconds after which a call is hedged, or None while still learning."""
+        if len(self.latency) < self.min_samples:
+            return None
+        return self.latency.percentile(self.percentile)
+
+    def _trim(self, now):
+        for q in (self._calls, self._hedges):
+            while q and q[0] < now - self.rate_window:
+                q.popleft()
+
+    def _record_call(self):
+        with self._lock:
+            now = time.time()
+            self._trim(now)
+            self._calls.append(now)
+
+    def _try_reserve_hedge(self):
+        """Caps hedges at `max_rate` of the calls seen in the rate window."""
+        with self._lock:
+            now = time.time()
+            self._trim(now)
+            if len(self._hedges) + 1 > self.max_rate * len(self._calls):
+                return False
+            self._hedges.append(now)
+            return True
+
+    def _timed(self, call, api_key, started=None):
+        if started is not None:
+            started.set()
+        start = time.perf_counter()
+        result = call(api_key)
+        self.latency.observe(time.perf_counter() - start)
+        return result
+
+    def _submit(self, call, api_key, started=None):
+        # Carry the app context (and anything else in contextvars) into the worker thread
+        return self.executor.submit(contextvars.copy_context().run, self._timed, call, api_key, started)
+
+    def run(self, call, api_key, get_alternate_key):
+        """
+        Runs call(api_key), hedging with call(get_alternate_key()) if it is slow.
+        Raises the primary's exception if every attempt fails.
+        """
+        self._record_call()
+        threshold = self.threshold()
+        if threshold is None:
+            # Still learning: nothing to hedge, so the call runs on the caller's thread
+            return self._timed(call, api_key)
+
+        started = threading.Event()
+        primary = self._submit(call, api_key, started)
+        # The hedge delay counts from when the call starts, not from when it was queued
+        started.wait()
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._try_reserve_hedge():
+            return primary.result()
+
+        alternate_key = get_alternate_key()
+        if not alternate_key:
+            return primary.result()
+
+        self.logger.info(f"Hedging Gemini call after {threshold:.2f}s.")
+        pending = {primary, self._submit(call, alternate_key)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+        return primary.result()
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+def get_hedger():
+    """Returns the process-wide hedger, or None when hedging is disabled."""
+    global _hedger
+    if not current_app.config.get("GEMINI_HEDGE_ENABLED", False):
+        return None
+    if _hedger is None:
+        with _hedger_lock:
+            if _hedger is None:
+                config = current_app.config
+                max_rate = config.get("GEMINI_HEDGE_MAX_RATE", 0.1)
+                # Enough workers for every call the in-flight cap admits, plus their hedges
+                workers = config.get("GEMINI_HEDGE_WORKERS") or int(config.get("LLM_MAX_IN_FLIGHT", 256) * (1 + max_rate)) + 1
+                _hedger = RequestHedger(
+                    percentile=config.get("GEMINI_HEDGE_PERCENTILE", 0.95),
+                    max_rate=max_rate,
+                    min_samples=config.get("GEMINI_HEDGE_MIN_SAMPLES", 20),
+                    workers=workers,
+                )
+    return _hedger
@@ -0,0 +1,135 @@
+import threading
+from collections import OrderedDict, deque
+from flask import current_app
+
+class HistoryCache:
+    """
+    In-process cache of each user's most recent messages, so a reflection
+    doesn't re-read the message it just wrote.
+
+    Every cached user has a ring of the last `ring_size` messages. A user is
+    only cached once their ring has been loaded from the database; after that,
+    save_message appends to it (write-through). Users are evicted least
+    recently used first when there are more than `max_users`, or when the
+    cached message text exceeds `max_bytes`.
+
+    Other worker processes write to the same table, so a hit is checked
+    against the ids of the user's newest messages (an index-only read) and the
+    ring is reloaded when they differ.
+    """
+    def __init__(self, ring_size=20, max_users=1000, max_bytes=8 * 1024 * 1024):
+        self.ring_size = ring_size
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+
+        self._rings = OrderedDict() # user_id -> deque of {"id", "role", "content"}
+        self._bytes = 0
+        self._uncached_writes = 0 # lets a miss tell whether a write raced its load
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    @staticmethod
+    def _size(message):
+        return len(message["content"]) + len(message["role"])
+
+    def _evict(self):
+        """Drops least recently used users until within limits. Caller holds the lock."""
+        while self._rings and (len(self._rings) > self.max_users or self._bytes > self.max_bytes):
+            _, ring = self._rings.popitem(last=False)
+            self._bytes -= sum(self._size(m) for m in ring)
+
+    @staticmethod
+    def _public(messages):
+        return [{"role": m["role"], "content": m["content"]} for m in messages]
+
+    def get(self, user_id, limit, load, recent_ids):
+        """
+        Returns the user's last `limit` messages (oldest first). load(n) reads
+        the last n messages ({"id", "role", "content"}, oldest first) from the
+        database; recent_ids(n) reads just the ids of the last n, newest first.
+        """
+        if limit > self.ring_size:
+            return self._public(load(limit))
+
+        with self._lock:
+            ring = self._rings.get(user_id)
+            cached = list(ring)[-limit:] if ring is not None else None
+        if cached is not None:
+            if [m["id"] for m in reversed(cached)] == list(recent_ids(limit)):
+                with self._lock:
+                    if user_id in self._rings:
+                        self._rings.move_to_end(user_id)
+                    self.hits += 1
+                return self._public(cached)
+            self.invalidate(user_id) # another process wrote (or deleted) messages
+            with self._lock:
+                self.stale += 1
+
+        with self._lock:
+            self.misses += 1
+            writes_before = self._uncached_writes
+
+        messages = load(self.ring_size)
+        with self._lock:
+            # Skip filling if a write landed during the load (it may be missing from
+            # `messages`) or a concurrent miss filled the ring already
+            if writes_before == self._uncached_writes and user_id not in self._rings:
+                ring = deque({"id": m["id"], "role": m["role"], "content": m["content"]} for m in messages)
+                self._rings[user_id] = ring
+                self._bytes += sum(self._size(m) for m in ring)
+                self._evict()
+        return self._public(messages[-limit:])
+
+    def append(self, user_id, message_id, role, content):
+        """Write-through from save_message, after the commit; users that aren't cached are left alone."""
+        message = {"id": message_id, "role": role, "content": content}
+        with self._lock:
+            ring = self._rings.get(user_id)
+            if ring is None:
+                self._uncached_writes += 1
+                return
+            if ring and ring[-1]["id"] >= message_id:
+                return # a reload after the commit already has it
+            if len(ring) >= self.ring_size:
+                self._bytes -= self._size(ring.popleft())
+            ring.append(message)
+            self._bytes += self._size(message)
+            self._rings.move_to_end(user_id)
+            self._evict()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            ring = self._rings.pop(user_id, None)
+            if ring is not None:
+                self._bytes -= sum(self._size(m) for m in ring)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "users": len(self._rings),
+                "bytes": self._bytes,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_history_cache():
+    """Returns the process-wide history cache, or None when disabled."""
+    global _cache
+    if not current_app.config.get("HISTORY_CACHE_ENABLED", True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = current_app.config
+                _cache = HistoryCache(
+                    ring_size=config.get("HISTORY_CACHE_SIZE", 20),
+                    max_users=config.get("HISTORY_CACHE_MAX_USERS", 1000),
+                    max_bytes=config.get("HISTORY_CACHE_MAX_BYTES", 8 * 1024 * 1024),
+                )
+    return _cache
@@ -0,0 +1,269 @@
+import atexit
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from app.db import apply_pragmas
+from app.tracing import trace
+
+class JobQueue:
+    """
+    Durable background job queue backed by the `jobs` table.
+    Jobs are claimed with a lease, so a job whose worker died is picked up
+    again once the lease expires (at-least-once delivery).
+    """
+    # Status constants
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("JobQueue")
+
+        self.db_path = app.config['DATABASE_PATH']
+        self.num_workers = app.config.get('JOB_WORKERS', 2)
+        self.max_attempts = app.config.get('JOB_MAX_ATTEMPTS', 5)
+        self.backoff_base = app.config.get('JOB_RETRY_BACKOFF', 2)
+        self.lease_seconds = app.config.get('JOB_LEASE_SECONDS', 120)
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', 1.0)
+        self.retention = app.config.get('JOB_RETENTION', 7 * 24 * 3600)
+        self.sweep_interval = app.config.get('JOB_SWEEP_INTERVAL', 3600)
+
+        self.handlers = {}
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._sweep_lock = threading.Lock()
+        self._next_sweep = 0
+
+    def _conn(self):
+        """One autocommit connection per thread; transactions are explicit."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            apply_pragmas(conn, busy_timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def register(self, job_type, handler):
+        """Registers a handler: handler(payload) -> JSON-serializable result."""
+        self.handlers[job_type] = handler
+
+    def enqueue(self, job_type, payload, user_id=None, delay=0, unique=False):
+        """
+        Persists a job and wakes a worker. Returns the job id. With unique=True
+        nothing is added while a job of the same type for the same user is
+        still queued or running; that job's id is returned instead.
+        """
+        conn = self._conn()
+        values = (job_type, user_id, json.dumps(payload), self.QUEUED, time.time() + delay)
+        cursor = None
+        if unique:
+            # One statement, so two processes can't both see "none pending" and insert
+            cursor = conn.execute(
+                '''INSERT INTO jobs (job_type, user_id, payload, status, run_after)
+                   SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS (
+                       SELECT 1 FROM jobs WHERE status IN (?, ?) AND job_type = ? AND user_id IS ?)''',
+                values + (self.QUEUED, self.RUNNING, job_type, user_id)
+            )
+            if not cursor.rowcount:
+                row = conn.execute(
+                    'SELECT id FROM jobs WHERE status IN (?, ?) AND job_type = ? AND user_id IS ? LIMIT 1',
+                    (self.QUEUED, self.RUNNING, job_type, user_id)
+                ).fetchone()
+                if row:
+                    return row['id']
+                cursor = None # it finished in between
+        if cursor is None:
+            cursor = conn.execute(
+                '''INSERT INTO jobs (job_type, user_id, payload, status, run_after)
+                   VALUES (?, ?, ?, ?, ?)''',
+                values
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+        return cursor.lastrowid
+
+    def get_job(self, job_id, user_id=None):
+        """Returns the public view of a job (status + result)."""
+        row = self._conn().execute(
+            'SELECT id, job_type, status, attempts, result FROM jobs WHERE id = ? AND user_id IS ?',
+            (job_id, user_id)
+        ).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def _claim(self):
+        """Atomically leases the next runnable job, or returns None."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                '''SELECT * FROM jobs
+                   WHERE (status = ? AND run_after <= ?) OR (status = ? AND locked_until <= ?)
+                   ORDER BY run_after LIMIT 1''',
+                (self.QUEUED, now, self.RUNNING, now)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, attempts = attempts + 1, locked_until = ? WHERE id = ?',
+                    (self.RUNNING, now + self.lease_seconds, row['id'])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if not row:
+            return None
+        job = dict(row)
+        job['attempts'] += 1
+        return job
+
+    def _complete(self, job, result):
+        self._conn().execute(
+            'UPDATE jobs SET status = ?, result = ?, last_error = NULL, locked_until = NULL WHERE id = ?',
+            (self.DONE, json.dumps(result), job['id'])
+        )
+
+    def _fail(self, job, error):
+        if job['attempts'] >= self.max_attempts:
+            self.logger.error(f"Job {job['id']} ({job['job_type']}) failed permanently: {error}")
+            self._conn().execute(
+                'UPDATE jobs SET status = ?, last_error = ?, locked_until = NULL WHERE id = ?',
+                (self.FAILED, str(error), job['id'])
+            )
+            return
+
+        # Exponential backoff with jitter
+        delay = self.backoff_base * (2 ** (job['attempts'] - 1))
+        delay += random.uniform(0, delay / 2)
+        self.logger.warning(
+            f"Job {job['id']} ({job['job_type']}) attempt {job['attempts']} failed: {error}. Retrying in {delay:.1f}s."
+        )
+        self._conn().execute(
+            'UPDATE jobs SET status = ?, run_after = ?, last_error = ?, locked_until = NULL WHERE id = ?',
+            (self.QUEUED, time.time() + delay, str(error), job['id'])
+        )
+
+    def run_job(self, job):
+        """Runs a single claimed job inside an app context."""
+        handler = self.handlers.get(job['job_type'])
+        if handler is None:
+            self._fail(job, f"No handler for job type '{job['job_type']}'")
+            return
+        try:
+            with self.app.app_context(), trace(f"job.{job['job_type']}", job_id=job['id']):
+                result = handler(json.loads(job['payload']))
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self._complete(job, result)
+
+    def run_pending(self):
+        """Drains all currently runnable jobs on the calling thread. Returns the count."""
+        count = 0
+        while True:
+            job = self._claim()
+            if not job:
+                return count
+            self.run_job(job)
+            count += 1
+
+    def purge_finished(self, older_than=None, batch_size=500):
+        """
+        Deletes done and failed jobs last scheduled more than `older_than`
+        seconds ago (default: JOB_RETENTION), in small batches so the write
+        lock is never held for long. Returns the number of rows deleted.
+        """
+        cutoff = time.time() - (self.retention if older_than is None else older_than)
+        deleted = 0
+        while True:
+            cursor = self._conn().execute(
+                '''DELETE FROM jobs WHERE id IN (
+                       SELECT id FROM jobs WHERE status IN (?, ?) AND run_after < ? LIMIT ?)''',
+                (self.DONE, self.FAILED, cutoff, batch_size)
+            )
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
+
+    def _maybe_sweep(self):
+        """Runs purge_finished() on one idle worker every `sweep_interval` seconds."""
+        if not self.retention or time.time() < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = time.time() + self.sweep_interval
+            deleted = self.purge_finished()
+            if deleted:
+                self.logger.info(f"Purged {deleted} finished jobs.")
+        except sqlite3.Error as e:
+            self.logger.error(f"Job purge failed: {e}")
+        finally:
+            self._sweep_lock.release()
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                self.logger.error(f"Job claim failed: {e}")
+                job = None
+
+            if job:
+                self.run_job(job)
+                continue
+
+            self._maybe_sweep()
+
+            with self._wakeup:
+                self._wakeup.wait(self.poll_interval)
+
+    def start(self):
+        for i in range(self.num_workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        self.logger.info(f"Started {self.num_workers} job workers.")
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+_queue = None
+
+def init_jobs(app):
+    """Creates the process-wide job queue, registers handlers and starts workers."""
+    global _queue
+    if not app.config.get('BACKGROUND_JOBS_ENABLED', True):
+        return None
+
+    from app.services import ReflectionService
+    queue = JobQueue(app)
+    queue.register('analyze_patterns', ReflectionService.run_pattern_job)
+    queue.register('apply_patterns', ReflectionService.run_apply_patterns_job)
+    queue.register('analyze_batch', ReflectionService.run_batch_job)
+    queue.register('generate_learning_topic', ReflectionService.run_topic_job)
+    queue.register('update_summary', ReflectionService.run_summary_job)
+    queue.start()
+    atexit.register(queue.stop)
+
+    _queue = queue
+    return queue
+
+def get_job_queue():
+    """Returns the running job queue, or None when jobs run inline."""
+    return _queue
@@ -1,15 +1,164 @@
+import asyncio
+import hashlib
 import logging
+import sqlite3
+import threading
 import time
 from flask import current_app
+from app.db import apply_pragmas
+from app.migrations import run_migrations
+from app.metrics import KEY_WAIT_SECONDS
 
 # Masking helper for logs
 def mask_key(key):
     if not key: return "None"
     return f"{key[:6]}...{key[-4:]}"
 
+def key_id(key):
+    """Stable, non-secret identifier for a key (the raw key is never stored)."""
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+class KeyStateStore:
+    """
+    Key health shared by every worker process through a small SQLite table.
+    All selection happens inside BEGIN IMMEDIATE, so the file lock serializes
+    workers and a cooldown set by one process is seen by all others.
+
+    The tables come from the app's migrations (app/migrations.py); a separate
+    KEY_STATE_PATH file is migrated the same way, its other tables unused.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        run_migrations(db_path) # a no-op when the app has migrated this file already
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            apply_pragmas(conn, busy_timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn)
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def register(self, key_ids):
+        """
+        Syncs the table with the configured keys. Cooldowns survive restarts;
+        disabled keys get another chance when a process starts.
+        """
+        def sync(conn):
+            for position, kid in enumerate(key_ids):
+                conn.execute(
+                    '''INSERT INTO api_key_state (key_id, position) VALUES (?, ?)
+                       ON CONFLICT(key_id) DO UPDATE SET position = excluded.position,
+                       status = CASE WHEN status = 'disabled' THEN 'active' ELSE status END''',
+                    (kid, position)
+                )
+            placeholders = ",".join("?" * len(key_ids))
+            conn.execute(f'DELETE FROM api_key_state WHERE key_id NOT IN ({placeholders})', key_ids)
+        self._transaction(sync)
+
+    @staticmethod
+    def _refill(tokens, capacity, elapsed):
+        """Token bucket refill: `capacity` tokens per 60 seconds."""
+        if tokens is None:
+            return capacity
+        return min(capacity, tokens + elapsed * capacity / 60.0)
+
+    def acquire(self, now, tokens=0, rpm=None, tpm=None, exclude=None, only=None):
+        """
+        Picks the next usable key at or after the shared cursor (wrapping around)
+        that has request (rpm) and token (tpm) budget, charges it and advances the cursor.
+        Returns ((key_id, was_cooling_down), None), or (None, seconds_until_budget)
+        when no key can serve the call now (seconds is None if none ever will).
+        `exclude` skips one key_id (used to pick a different key for a hedged call);
+        `only` charges that key_id alone and leaves the cursor where it is.
+        """
+        def pick(conn):
+            cursor = conn.execute('SELECT next_position FROM api_key_cursor WHERE id = 0').fetchone()[0]
+            rows = conn.execute(
+                '''SELECT * FROM api_key_state
+                   WHERE status != 'disabled' AND cooldown_until <= ? AND key_id IS NOT ? AND (? IS NULL OR key_id = ?)
+                   ORDER BY position < ?, position''',
+                (now, exclude, only, only, cursor)
+            ).fetchall()
+
+            need = min(tokens, tpm) if tpm else 0
+            waits = []
+            for row in rows:
+                elapsed = now - row['refilled_at']
+                rpm_tokens = self._refill(row['rpm_tokens'], rpm, elapsed) if rpm else None
+                tpm_tokens = self._refill(row['tpm_tokens'], tpm, elapsed) if tpm else None
+
+                if (rpm_tokens is None or rpm_tokens >= 1) and (tpm_tokens is None or tpm_tokens >= need):
+                    conn.execute(
+                        '''UPDATE api_key_state
+                           SET status = 'active', cooldown_until = 0, rpm_tokens = ?, tpm_tokens = ?, refilled_at = ?
+                           WHERE key_id = ?''',
+                        (rpm_tokens - 1 if rpm else None, tpm_tokens - need if tpm else None, now, row['key_id'])
+                    )
+                    if only is None:
+                        conn.execute('UPDATE api_key_cursor SET next_position = ? WHERE id = 0', (row['position'] + 1,))
+                    return (row['key_id'], row['status'] != 'active'), None
+
+                wait = 0
+                if rpm_tokens is not None and rpm_tokens < 1:
+                    wait = max(wait, (1 - rpm_tokens) * 60.0 / rpm)
+                if tpm_tokens is not None and tpm_tokens < need:
+                    wait = max(wait, (need - tpm_tokens) * 60.0 / tpm)
+                waits.append(wait)
+
+            next_cooldown = conn.execute(
+                "SELECT MIN(cooldown_until) FROM api_key_state WHERE status = 'cooling_down' AND cooldown_until > ?",
+                (now,)
+            ).fetchone()[0]
+            if next_cooldown:
+                waits.append(next_cooldown - now)
+            return None, (min(waits) if waits else None)
+        return self._transaction(pick)
+
+    def adjust_tokens(self, kid, delta):
+        """Refunds (positive) or charges (negative) TPM budget after actual usage is known."""
+        self._conn().execute(
+            'UPDATE api_key_state SET tpm_tokens = tpm_tokens + ? WHERE key_id = ? AND tpm_tokens IS NOT NULL',
+            (delta, kid)
+        )
+
+    def set_status(self, kid, status, cooldown_until=0):
+        self._conn().execute(
+            'UPDATE api_key_state SET status = ?, cooldown_until = ? WHERE key_id = ?',
+            (status, cooldown_until, kid)
+        )
+
+    def clear_cooldown(self, kid):
+        conn = self._conn()
+        # Checked with a plain read first: nearly always there is nothing to clear, and a no-op UPDATE still takes the write lock
+        if conn.execute("SELECT 1 FROM api_key_state WHERE key_id = ? AND status = 'cooling_down'", (kid,)).fetchone():
+            conn.execute(
+                "UPDATE api_key_state SET status = 'active', cooldown_until = 0 WHERE key_id = ? AND status = 'cooling_down'",
+                (kid,)
+            )
+
+    def snapshot(self):
+        """Returns {key_id: {status, cooldown_until}} for all keys."""
+        rows = self._conn().execute('SELECT key_id, status, cooldown_until FROM api_key_state').fetchall()
+        return {r['key_id']: {"status": r['status'], "cooldown_until": r['cooldown_until']} for r in rows}
+
 class APIKeyManager:
     _instance = None
-    
+    _instance_lock = threading.Lock()
+
     # Status constants
     ACTIVE = "active"
     COOLING_DOWN = "cooling_down"
@@ -17,77 +166,156 @@ class APIKeyManager:
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(APIKeyManager, cls).__new__(cls)
-            cls._instance._initialized = False
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(APIKeyManager, cls).__new__(cls)
+                    instance._initialized = False
+                    instance._init_lock = threading.Lock()
+                    cls._instance = instance
         return cls._instance
 
     def __init__(self):
         if self._initialized: return
-        
-        logging.basicConfig(level=logging.INFO)
-        self.logger = logging.getLogger("APIKeyManager")
+        with self._init_lock:
+            if self._initialized: return
+
+            logging.basicConfig(level=logging.INFO)
+            self.logger = logging.getLogger("APIKeyManager")
+
+            self.keys = {} # key_id -> raw key
+            self.cooldown_duration = current_app.config.get("GEMINI_KEY_COOLDOWN", 300) # used when the server gives no retry delay
+            self.rpm_limit = current_app.config.get("GEMINI_RPM_PER_KEY")
+            self.tpm_limit = current_app.config.get("GEMINI_TPM_PER_KEY")
+            self.max_wait = current_app.config.get("GEMINI_KEY_WAIT_MAX", 5)
+            self._lock = threading.Lock()
 
-        self.keys = [] # List of dicts: {key, status, cooldown_until}
-        self.current_index = 0
-        self.cooldown_duration = 300 # 5 minutes default
-        
-        self._initialize_keys()
-        self._initialized = True
+            self.store = KeyStateStore(
+                current_app.config.get("KEY_STATE_PATH") or current_app.config["DATABASE_PATH"]
+            )
+            self._initialize_keys()
+            self._initialized = True
 
     def _initialize_keys(self):
         config_keys = current_app.config.get("GOOGLE_API_KEYS", [])
         for k in config_keys:
-            self.keys.append({
-                "key": k,
-                "status": self.ACTIVE,
-                "cooldown_until": 0
-            })
+            self.keys[key_id(k)] = k
+        self.store.register(list(self.keys))
         self.logger.info(f"Initialized with {len(self.keys)} API keys.")
 
-    def get_key(self):
-        """Returns the next available healthy key using Round-Robin."""
+    def _try_acquire(self, estimated_tokens, exclude_id, only_id=None):
+        """One pass over the keys (a SQLite transaction): (picked, retry_in) as KeyStateStore.acquire returns."""
+        with self._lock:
+            return self.store.acquire(
+                time.time(), estimated_tokens, self.rpm_limit, self.tpm_limit, exclude=exclude_id, only=only_id)
+
+    def _acquire_steps(self, estimated_tokens, exclude, only=None):
+        """
+        Key selection shared by get_key and aget_key, as a generator the caller
+        drives: it yields ("try", args), answered by sending back
+        _try_acquire(*args), or ("sleep", seconds), and returns the key (or None).
+        The callers decide where the SQLite work and the waiting happen.
+        """
         if not self.keys:
             self.logger.error("No API keys available.")
             return None
 
-        # Check all keys starting from current index
-        num_keys = len(self.keys)
-        for i in range(num_keys):
-            idx = (self.current_index + i) % num_keys
-            key_info = self.keys[idx]
-            
-            # Check if key is out of cooldown
-            if key_info["status"] == self.COOLING_DOWN:
-                if time.time() >= key_info["cooldown_until"]:
-                    key_info["status"] = self.ACTIVE
-                    self.logger.info(f"Key {mask_key(key_info['key'])} is back from cooldown.")
-
-            if key_info["status"] == self.ACTIVE:
-                self.current_index = (idx + 1) % num_keys # Update for next call
-                return key_info["key"]
-
-        self.logger.warning("All keys are currently in cooldown or disabled.")
-        return None
-
-    def mark_failed(self, key, error_type="rate_limit"):
-        """Marks a key as cooling down due to failure."""
-        for key_info in self.keys:
-            if key_info["key"] == key:
-                key_info["status"] = self.COOLING_DOWN
-                key_info["cooldown_until"] = time.time() + self.cooldown_duration
-                self.logger.warning(
-                    f"Key {mask_key(key)} failed ({error_type}). cooldown for {self.cooldown_duration}s."
-                )
+        exclude_id = key_id(exclude) if exclude else None
+        only_id = key_id(only) if only else None
+        start = time.perf_counter()
+        deadline = time.time() + (0 if exclude or only else self.max_wait)
+        while True:
+            picked, retry_in = yield "try", (estimated_tokens, exclude_id, only_id)
+            if picked:
                 break
+            if retry_in is None or time.time() + retry_in > deadline:
+                if not (exclude or only):
+                    KEY_WAIT_SECONDS.observe(time.perf_counter() - start)
+                    self.logger.warning("All keys are currently in cooldown, out of budget or disabled.")
+                return None
+            yield "sleep", retry_in
+        if not (exclude or only):
+            KEY_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+        kid, was_cooling = picked
+        key = self.keys[kid]
+        if was_cooling:
+            self.logger.info(f"Key {mask_key(key)} is back from cooldown.")
+        return key
+
+    def get_key(self, estimated_tokens=0, exclude=None, only=None):
+        """
+        Returns the next healthy key with rate-limit budget, using Round-Robin shared across workers.
+        Waits up to `max_wait` seconds for budget to refill before giving up.
+        With `exclude`, returns a different key immediately or None (no waiting).
+        With `only`, charges that key if it is healthy and has budget now, else returns None
+        (for calls tied to one key, such as creating its prompt cache).
+        """
+        steps = self._acquire_steps(estimated_tokens, exclude, only)
+        answer = None
+        try:
+            while True:
+                action, arg = steps.send(answer)
+                answer = self._try_acquire(*arg) if action == "try" else time.sleep(arg)
+        except StopIteration as done:
+            return done.value
+
+    async def aget_key(self, estimated_tokens=0, exclude=None):
+        """get_key for the event loop (ASGI mode): the SQLite work runs on a thread and waiting doesn't block the loop."""
+        steps = self._acquire_steps(estimated_tokens, exclude)
+        answer = None
+        try:
+            while True:
+                action, arg = steps.send(answer)
+                if action == "try":
+                    answer = await asyncio.to_thread(self._try_acquire, *arg)
+                else:
+                    answer = await asyncio.sleep(arg)
+        except StopIteration as done:
+            return done.value
+
+    def record_usage(self, key, estimated_tokens, actual_tokens):
+        """Corrects the TPM bucket once the real token count of a call is known."""
+        if self.tpm_limit and actual_tokens is not None:
+            self.store.adjust_tokens(key_id(key), estimated_tokens - actual_tokens)
+
+    def mark_failed(self, key, error_type="rate_limit", retry_after=None):
+        """Marks a key as cooling down due to failure, for the server's retry delay when known."""
+        duration = retry_after if retry_after is not None else self.cooldown_duration
+        self.store.set_status(key_id(key), self.COOLING_DOWN, time.time() + duration)
+        self.logger.warning(
+            f"Key {mask_key(key)} failed ({error_type}). cooldown for {duration:.0f}s."
+        )
+
+    def disable_key(self, key, reason="invalid"):
+        """Permanently takes a key out of rotation (e.g. revoked or invalid)."""
+        self.store.set_status(key_id(key), self.DISABLED)
+        self.logger.error(f"Key {mask_key(key)} disabled ({reason}).")
+
+        # Drop its pooled client so the connection isn't kept alive
+        from app.client_pool import get_client_pool
+        get_client_pool().evict(key)
 
     def mark_success(self, key):
-        """Optionally reset status or update metrics on success."""
-        for key_info in self.keys:
-            if key_info["key"] == key:
-                if key_info["status"] == self.COOLING_DOWN:
-                    key_info["status"] = self.ACTIVE
-                    key_info["cooldown_until"] = 0
-                break
+        """Clears an early-expired cooldown once the key works again."""
+        self.store.clear_cooldown(key_id(key))
+
+    def record_success(self, key, estimated_tokens, actual_tokens):
+        """record_usage and mark_success after a call that returned text (one step, so async callers hop threads once)."""
+        self.record_usage(key, estimated_tokens, actual_tokens)
+        self.mark_success(key)
+
+    def key_statuses(self):
+        """Returns {masked_key: status} as seen by all workers."""
+        snapshot = self.store.snapshot()
+        now = time.time()
+        statuses = {}
+        for kid, key in self.keys.items():
+            state = snapshot.get(kid, {"status": self.ACTIVE, "cooldown_until": 0})
+            status = state["status"]
+            if status == self.COOLING_DOWN and state["cooldown_until"] <= now:
+                status = self.ACTIVE
+            statuses[mask_key(key)] = status
+        return statuses
 
 # Helper function to get instance
 def get_key_manager():
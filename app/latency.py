@@ -0,0 +1,44 @@
+import bisect
+import math
+import threading
+from collections import deque
+
+class LatencyHistogram:
+    """
+    Rolling latency histogram over the most recent `window` samples.
+    Buckets are log-spaced, so percentiles cost O(buckets) regardless of the
+    window size and are accurate to about one bucket width (~12%).
+    """
+    def __init__(self, window=500, min_seconds=0.005, max_seconds=120.0, buckets_per_decade=20):
+        decades = math.log10(max_seconds / min_seconds)
+        n = int(math.ceil(decades * buckets_per_decade))
+        self.bounds = [min_seconds * 10 ** (i / buckets_per_decade) for i in range(n + 1)]
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.window = window
+        self._samples = deque()
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        idx = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            if len(self._samples) >= self.window:
+                self.counts[self._samples.popleft()] -= 1
+            self._samples.append(idx)
+            self.counts[idx] += 1
+
+    def percentile(self, p):
+        """Returns the latency (seconds) at quantile p (0-1), or None without samples."""
+        with self._lock:
+            total = len(self._samples)
+            if not total:
+                return None
+            rank = max(1, int(math.ceil(p * total)))
+            seen = 0
+            for idx, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return self.bounds[min(idx, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def __len__(self):
+        return len(self._samples)
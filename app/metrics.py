@@ -0,0 +1,383 @@
+import atexit
+import bisect
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # not on Windows: dead processes' files are dropped instead of archived
+    fcntl = None
+
+ARCHIVE_FILE = "archive.json" # counters and histograms of processes that have exited
+
+# Latency buckets (seconds): HTTP and Gemini calls, and the much faster database functions
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+class _Metric:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {} # label values tuple -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def family(self):
+        with self._lock:
+            samples = [[list(k), v if not isinstance(v, list) else list(v)] for k, v in self._values.items()]
+        return {"type": self.type, "help": self.help, "labelnames": list(self.labelnames), "samples": samples}
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Histogram(_Metric):
+    """Fixed buckets; a sample is [count per bucket..., +Inf count, sum]."""
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = [0] * (len(self.buckets) + 2)
+            sample[idx] += 1
+            sample[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def family(self):
+        family = super().family()
+        family["buckets"] = list(self.buckets)
+        return family
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Registry:
+    """
+    Holds this process's metrics and renders them in the Prometheus text format.
+
+    Collectors are called at scrape time and return families in the same shape
+    as Metric.family(). With a multiprocess directory, each process writes its
+    families (and those of its "sum" collectors) to <dir>/<pid>.json, and a
+    scrape adds up the counters and histograms of all processes; gauges get a
+    `pid` label instead, since adding up point-in-time values across workers
+    isn't meaningful. A scrape that finds the file of an exited process folds
+    its counters and histograms into <dir>/archive.json, so totals don't go
+    backwards, and deletes it. "live" collectors (e.g. key status, which
+    already comes from the shared key store) are only taken from the process
+    answering the scrape.
+    """
+    def __init__(self):
+        self.logger = logging.getLogger("metrics")
+        self.metrics = []
+        self.collectors = [] # (fn, aggregate) with aggregate "sum" or "live"
+        self.multiproc_dir = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn, aggregate="sum"):
+        self.collectors.append((fn, aggregate))
+
+    def _collect(self, aggregate):
+        families = {}
+        for fn, kind in self.collectors:
+            if kind != aggregate:
+                continue
+            try:
+                families.update(fn())
+            except Exception as e:
+                self.logger.warning(f"Metrics collector {getattr(fn, '__name__', fn)} failed: {e}")
+        return families
+
+    def snapshot(self):
+        families = {m.name: m.family() for m in self.metrics}
+        families.update(self._collect("sum"))
+        return families
+
+    def flush(self):
+        """Writes this process's snapshot for other processes' scrapes (multiprocess mode)."""
+        if not self.multiproc_dir:
+            return
+        path = os.path.join(self.multiproc_dir, f"{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _merge(into, families):
+        for name, family in families.items():
+            target = into.setdefault(name, {**family, "samples": []})
+            merged = {tuple(labels): value for labels, value in target["samples"]}
+            for labels, value in family["samples"]:
+                labels = tuple(labels)
+                if labels not in merged:
+                    merged[labels] = value
+                elif isinstance(value, list):
+                    merged[labels] = [a + b for a, b in zip(merged[labels], value)]
+                else:
+                    merged[labels] += value
+            target["samples"] = [[list(k), v] for k, v in merged.items()]
+
+    @staticmethod
+    def _per_pid(families, pid):
+        """Labels each gauge sample with the process it came from."""
+        labelled = {}
+        for name, family in families.items():
+            if family["type"] == "gauge":
+                family = {**family, "labelnames": family["labelnames"] + ["pid"],
+                          "samples": [[labels + [str(pid)], value] for labels, value in family["samples"]]}
+            labelled[name] = family
+        return labelled
+
+    @staticmethod
+    def _pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass # exists, owned by someone else
+        return True
+
+    def _retire(self, path):
+        """Folds an exited process's counters and histograms into the archive and removes its file."""
+        if fcntl is None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return
+        with open(os.path.join(self.multiproc_dir, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX) # so two scrapes never archive the same file twice
+            try:
+                with open(path) as f:
+                    families = json.load(f)
+            except FileNotFoundError:
+                return # already archived by another process
+            except ValueError:
+                families = {}
+            archive_path = os.path.join(self.multiproc_dir, ARCHIVE_FILE)
+            archive = {}
+            try:
+                with open(archive_path) as f:
+                    archive = json.load(f)
+            except (OSError, ValueError):
+                pass
+            self._merge(archive, {name: fam for name, fam in families.items() if fam["type"] != "gauge"})
+            tmp = f"{archive_path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(archive, f)
+            os.replace(tmp, archive_path)
+            os.remove(path)
+
+    def collect(self):
+        """All families to expose: this process's, or every process's when in multiprocess mode."""
+        families = {}
+        if self.multiproc_dir:
+            self.flush()
+            for path in glob.glob(os.path.join(self.multiproc_dir, "[0-9]*.json")):
+                pid = os.path.basename(path)[:-len(".json")]
+                if pid.isdigit() and not self._pid_alive(int(pid)):
+                    try:
+                        self._retire(path)
+                    except (OSError, ValueError) as e:
+                        self.logger.warning(f"Could not archive metrics of exited process {pid}: {e}")
+            for path in glob.glob(os.path.join(self.multiproc_dir, "*.json")):
+                name = os.path.basename(path)[:-len(".json")]
+                try:
+                    with open(path) as f:
+                        loaded = json.load(f)
+                except (OSError, ValueError):
+                    continue # a process is mid-write or gone
+                self._merge(families, self._per_pid(loaded, name) if name.isdigit() else loaded)
+        else:
+            self._merge(families, self.snapshot())
+        families.update(self._collect("live"))
+        return families
+
+    def render(self):
+        lines = []
+        for name, family in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            labelnames = family["labelnames"]
+            for labels, value in family["samples"]:
+                pairs = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, labels)]
+                if family["type"] != "histogram":
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(family["buckets"]) + ["+Inf"], value[:-1]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    le_pair = f'le="{le}"'
+                    lines.append(f"{name}_bucket{_labels(pairs + [le_pair])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(pairs):
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def family(name, help, samples, labelnames=(), type="gauge"):
+    """Builds a family for a collector: samples is {label values tuple: value}."""
+    return {name: {
+        "type": type, "help": help, "labelnames": list(labelnames),
+        "samples": [[list(k), v] for k, v in samples.items()],
+    }}
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "insideout_http_request_seconds", "End-to-end request latency by route.", ("endpoint", "method", "status")))
+GEMINI_CALL_SECONDS = REGISTRY.register(Histogram(
+    "insideout_gemini_call_seconds", "Gemini call latency by call type and model.", ("call_type", "model", "outcome")))
+GEMINI_RETRIES = REGISTRY.register(Counter(
+    "insideout_gemini_retries_total", "Gemini call attempts after the first, by call type.", ("call_type",)))
+GEMINI_RATE_LIMITED = REGISTRY.register(Counter(
+    "insideout_gemini_rate_limited_total", "Gemini calls rejected with 429."))
+GEMINI_JSON_ERRORS = REGISTRY.register(Counter(
+    "insideout_gemini_json_errors_total", "Gemini replies that were not valid JSON, by call type.", ("call_type",)))
+KEY_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "insideout_key_wait_seconds", "Time spent in APIKeyManager.get_key waiting for a key with budget."))
+DB_SECONDS = REGISTRY.register(Histogram(
+    "insideout_db_seconds", "app.db function latency.", ("function",), buckets=DB_BUCKETS))
+
+def timed_db(fn):
+    """Decorator: records an app.db function's latency in DB_SECONDS."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - start, function=fn.__name__)
+    return wrapper
+
+def _cache_families():
+    from app.analysis_gate import get_analysis_gate
+    from app.history_cache import get_history_cache
+    from app.seed_cache import get_seed_cache
+    from app.topic_cache import get_topic_cache
+
+    families = {}
+    topics = get_topic_cache().stats()
+    families.update(family(
+        "insideout_topic_cache_lookups_total", "Learning topic cache lookups by result.",
+        {("memory_hit",): topics["hits_memory"], ("db_hit",): topics["hits_db"], ("miss",): topics["misses"]},
+        ("result",), type="counter"))
+    for name, cache in (("history", get_history_cache()), ("seed", get_seed_cache())):
+        if cache is not None:
+            stats = cache.stats()
+            families.update(family(
+                f"insideout_{name}_cache_lookups_total", f"{name.capitalize()} cache lookups by result.",
+                {("hit",): stats["hits"], ("miss",): stats["misses"]}, ("result",), type="counter"))
+    gate = get_analysis_gate()
+    if gate is not None:
+        families.update(family(
+            "insideout_analysis_gate_decisions_total", "Pattern analysis gate decisions by outcome.",
+            {(outcome,): count for outcome, count in gate.stats().items()}, ("outcome",), type="counter"))
+    return families
+
+def _llm_families():
+    from app.fanout import get_llm_executor
+    stats = get_llm_executor().stats()
+    families = family("insideout_llm_in_flight", "Gemini calls in flight.", {(): stats["in_flight"]})
+    families.update(family(
+        "insideout_llm_rejected_total", "Gemini calls given up because every in-flight slot stayed busy.",
+        {(): stats["rejected"]}, type="counter"))
+    return families
+
+def _key_families():
+    from app.key_manager import get_key_manager
+    counts = {"active": 0, "cooling_down": 0, "disabled": 0}
+    for status in get_key_manager().key_statuses().values():
+        counts[status] = counts.get(status, 0) + 1
+    return family("insideout_api_keys", "API keys by status.", {(s,): n for s, n in counts.items()}, ("status",))
+
+def init_metrics(app):
+    """Times every request, registers the collectors and, in multiprocess mode, flushes periodically."""
+    if not app.config.get("METRICS_ENABLED", True):
+        return None
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+    def in_app_context(fn):
+        def wrapper():
+            with app.app_context():
+                return fn()
+        wrapper.__name__ = fn.__name__
+        return wrapper
+
+    if not REGISTRY.collectors:
+        REGISTRY.add_collector(in_app_context(_cache_families), aggregate="sum")
+        REGISTRY.add_collector(in_app_context(_llm_families), aggregate="sum")
+        REGISTRY.add_collector(in_app_context(_key_families), aggregate="live")
+
+    multiproc_dir = app.config.get("METRICS_MULTIPROC_DIR")
+    if multiproc_dir and REGISTRY.multiproc_dir is None:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        REGISTRY.multiproc_dir = multiproc_dir
+        interval = app.config.get("METRICS_FLUSH_INTERVAL", 10)
+
+        def flusher():
+            while True:
+                time.sleep(interval)
+                try:
+                    REGISTRY.flush()
+                except OSError as e:
+                    REGISTRY.logger.warning(f"Metrics flush failed: {e}")
+
+        threading.Thread(target=flusher, name="metrics-flusher", daemon=True).start()
+        atexit.register(REGISTRY.flush)
+    return REGISTRY
@@ -0,0 +1,232 @@
+import logging
+import sqlite3
+
+# Each migration runs once, in order, inside its own transaction.
+# The applied version is stored in SQLite's PRAGMA user_version.
+
+def _baseline(conn):
+    """Tables as they existed before versioned migrations (idempotent for old databases)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT, -- For anonymous session isolation
+            role TEXT NOT NULL, -- 'user' or 'ai'
+            content TEXT NOT NULL,
+            context_type TEXT,  -- e.g., 'feeling_checkup', 'general_chat'
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Very old databases predate anonymous sessions
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(messages)')]
+    if 'user_id' not in columns:
+        conn.execute('ALTER TABLE messages ADD COLUMN user_id TEXT')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS patterns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            pattern_name TEXT NOT NULL,
+            pattern_type TEXT NOT NULL, -- 'emotional', 'cognitive', 'behavioral'
+            confidence_score REAL,
+            weight REAL DEFAULT 0.0, -- Impact/Significance score (0-1)
+            occurrences_count INTEGER DEFAULT 1,
+            first_detected TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_detected TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'new' -- 'new', 'acknowledged', 'working_on_it', 'explored'
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS learning_topics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            pattern_id INTEGER,
+            topic_title TEXT NOT NULL,
+            topic_content TEXT NOT NULL,
+            interactive_hint TEXT,
+            completion_status TEXT DEFAULT 'unread', -- 'unread', 'in_progress', 'completed'
+            difficulty_level TEXT DEFAULT 'beginner', -- 'beginner', 'intermediate', 'advanced'
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_accessed TIMESTAMP,
+            FOREIGN KEY(pattern_id) REFERENCES patterns(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_activity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            activity_type TEXT NOT NULL,
+            detail TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Background work queue (see app/jobs.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_type TEXT NOT NULL,
+            user_id TEXT,
+            payload TEXT NOT NULL, -- JSON
+            status TEXT DEFAULT 'queued', -- 'queued', 'running', 'done', 'failed'
+            attempts INTEGER DEFAULT 0,
+            run_after REAL NOT NULL, -- Unix time
+            locked_until REAL, -- Lease expiry while running
+            last_error TEXT,
+            result TEXT, -- JSON
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs(status, run_after)')
+    # Cross-user learning topic cache (see app/topic_cache.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS topic_cache (
+            cache_key TEXT PRIMARY KEY, -- normalized 'name|type|difficulty'
+            payload TEXT NOT NULL, -- JSON topic
+            created_at REAL NOT NULL, -- Unix time, for TTL
+            last_accessed REAL NOT NULL -- Unix time, for LRU eviction
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_topic_cache_last_accessed ON topic_cache(last_accessed)')
+
+def _per_user_indexes(conn):
+    """Every per-user query was a full table scan."""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages(user_id, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_patterns_user_last_detected ON patterns(user_id, last_detected)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_learning_topics_user_pattern ON learning_topics(user_id, pattern_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_learning_topics_user_created ON learning_topics(user_id, created_at)')
+
+def _unique_pattern_names(conn):
+    """Merges duplicate (user_id, pattern_name) rows, then enforces uniqueness for upserts."""
+    keepers = 'SELECT MIN(id) FROM patterns GROUP BY user_id, pattern_name'
+    conn.execute(f'''
+        UPDATE patterns SET
+            occurrences_count = (SELECT SUM(p.occurrences_count) FROM patterns p
+                                 WHERE p.user_id = patterns.user_id AND p.pattern_name = patterns.pattern_name),
+            first_detected = (SELECT MIN(p.first_detected) FROM patterns p
+                              WHERE p.user_id = patterns.user_id AND p.pattern_name = patterns.pattern_name),
+            last_detected = (SELECT MAX(p.last_detected) FROM patterns p
+                             WHERE p.user_id = patterns.user_id AND p.pattern_name = patterns.pattern_name)
+        WHERE id IN ({keepers} HAVING COUNT(*) > 1)
+    ''')
+    conn.execute(f'''
+        UPDATE learning_topics SET pattern_id = (
+            SELECT MIN(keep.id) FROM patterns dup
+            JOIN patterns keep ON keep.user_id = dup.user_id AND keep.pattern_name = dup.pattern_name
+            WHERE dup.id = learning_topics.pattern_id
+        )
+        WHERE pattern_id IN (SELECT id FROM patterns WHERE id NOT IN ({keepers}))
+    ''')
+    conn.execute(f'DELETE FROM patterns WHERE id NOT IN ({keepers})')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_patterns_user_name ON patterns(user_id, pattern_name)')
+
+def _seed_responses(conn):
+    """First-turn reply variants for short stock feelings (see app/seed_cache.py)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS seed_responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seed_key TEXT NOT NULL, -- normalized feeling, e.g. 'anxious'
+            payload TEXT NOT NULL, -- JSON reflection
+            created_at REAL NOT NULL, -- Unix time, for TTL
+            last_accessed REAL NOT NULL -- Unix time, for LRU eviction
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_seed_responses_key ON seed_responses(seed_key, created_at)')
+
+def _conversation_summaries(conn):
+    """Rolling per-user conversation summary used in prompts (see ReflectionService.update_summary in app/services.py)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            covered_message_id INTEGER NOT NULL, -- last messages.id folded into the summary
+            updated_at REAL NOT NULL -- Unix time
+        )
+    ''')
+
+def _pattern_watermarks(conn):
+    """Last message each user's batched pattern analysis has covered (PATTERN_ANALYSIS_MODE='batched')."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pattern_watermarks (
+            user_id TEXT PRIMARY KEY,
+            analyzed_message_id INTEGER NOT NULL,
+            updated_at REAL NOT NULL -- Unix time
+        )
+    ''')
+
+def _user_data_versions(conn):
+    """Per-user version of patterns/topics, bumped in each write's transaction (ETags, see app/db.py)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_data_versions (
+            user_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+
+def _api_key_state(conn):
+    """
+    Key health and the shared round-robin cursor (see KeyStateStore in
+    app/key_manager.py), which used to create its own tables on startup.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS api_key_state (
+            key_id TEXT PRIMARY KEY, -- sha256 prefix of the key
+            position INTEGER NOT NULL, -- Round-robin order
+            status TEXT NOT NULL DEFAULT 'active', -- 'active', 'cooling_down', 'disabled'
+            cooldown_until REAL NOT NULL DEFAULT 0,
+            rpm_tokens REAL, -- Token buckets; NULL = full
+            tpm_tokens REAL,
+            refilled_at REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    # Tables created before the per-key token buckets lack their columns
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(api_key_state)')]
+    if 'rpm_tokens' not in columns:
+        conn.execute('ALTER TABLE api_key_state ADD COLUMN rpm_tokens REAL')
+        conn.execute('ALTER TABLE api_key_state ADD COLUMN tpm_tokens REAL')
+        conn.execute('ALTER TABLE api_key_state ADD COLUMN refilled_at REAL NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_api_key_state_position ON api_key_state(position)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS api_key_cursor (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            next_position INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO api_key_cursor (id, next_position) VALUES (0, 0)')
+
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "per-user indexes", _per_user_indexes),
+    (3, "unique pattern names per user", _unique_pattern_names),
+    (4, "seed response cache", _seed_responses),
+    (5, "conversation summaries", _conversation_summaries),
+    (6, "pattern analysis watermarks", _pattern_watermarks),
+    (7, "user data versions", _user_data_versions),
+    (8, "api key state", _api_key_state),
+]
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def run_migrations(db_path):
+    """Brings the database at db_path up to the latest version. Safe to run from several processes."""
+    logger = logging.getLogger("migrations")
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        # WAL persists in the database file: readers no longer block the writer
+        conn.execute('PRAGMA journal_mode=WAL')
+
+        for version, name, migrate in MIGRATIONS:
+            if current_version(conn) >= version:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Re-check under the write lock in case another process just migrated
+                if current_version(conn) < version:
+                    migrate(conn)
+                    conn.execute(f'PRAGMA user_version = {version}')
+                    logger.info(f"Applied migration {version}: {name}")
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return current_version(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from collections import deque
+from flask import current_app
+from app.latency import LatencyHistogram
+
+class _ModelStats:
+    """Rolling latency and outcomes of one model for one call type."""
+    def __init__(self, window):
+        self.latency = LatencyHistogram(window=window)
+        self.outcomes = deque(maxlen=window) # True = success
+        self.down_until = 0.0
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+class ModelRouter:
+    """
+    Picks the Gemini model for each call type from an ordered list in Config
+    (GEMINI_MODEL_ROUTES), e.g. reflection -> [flash, flash-8b].
+
+    Latency and errors are tracked per (call type, model). Once a model has
+    `min_samples` calls and its p95 or error rate is over the call type's
+    budget (GEMINI_MODEL_BUDGETS), it is skipped for `cooldown` seconds; it is
+    then tried again with fresh statistics. If every model is over budget,
+    the first one is used anyway.
+    """
+    def __init__(self, routes, budgets=None, window=100, min_samples=20, cooldown=120):
+        self.logger = logging.getLogger("ModelRouter")
+        self.routes = routes
+        self.budgets = budgets or {}
+        self.window = window
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+
+        self._stats = {} # (call_type, model) -> _ModelStats
+        self._lock = threading.Lock()
+
+    def _model_stats(self, call_type, model):
+        stats = self._stats.get((call_type, model))
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault((call_type, model), _ModelStats(self.window))
+        return stats
+
+    def primary(self, call_type):
+        return self.routes[call_type][0]
+
+    def candidates(self, call_type):
+        """The call type's models in the order to try them: healthy ones first."""
+        now = time.time()
+        models = self.routes[call_type]
+        healthy = [m for m in models if self._model_stats(call_type, m).down_until <= now]
+        return healthy + [m for m in models if m not in healthy]
+
+    def record(self, call_type, model, seconds, ok):
+        """Records one call; takes the model out of rotation when it goes over budget."""
+        stats = self._model_stats(call_type, model)
+        stats.outcomes.append(ok)
+        if ok:
+            stats.latency.observe(seconds)
+
+        if len(stats.outcomes) < self.min_samples or stats.down_until > time.time():
+            return
+        budget = self.budgets.get(call_type, {})
+        p95 = stats.latency.percentile(0.95)
+        error_rate = stats.error_rate()
+        slow = budget.get("p95") is not None and p95 is not None and p95 > budget["p95"]
+        failing = budget.get("error_rate") is not None and error_rate > budget["error_rate"]
+        if not (slow or failing) or len(self.routes[call_type]) < 2:
+            return
+
+        self.logger.warning(
+            f"Model {model} over budget for {call_type} (p95 {p95 or 0:.2f}s, errors {error_rate:.0%}); "
+            f"routing to fallbacks for {self.cooldown}s."
+        )
+        with self._lock:
+            fresh = _ModelStats(self.window) # re-learn from scratch after the cooldown
+            fresh.down_until = time.time() + self.cooldown
+            self._stats[(call_type, model)] = fresh
+
+    def snapshot(self):
+        """{call_type: {model: {p95, error_rate, samples, down}}} for monitoring."""
+        now = time.time()
+        with self._lock:
+            items = list(self._stats.items())
+        result = {}
+        for (call_type, model), stats in items:
+            result.setdefault(call_type, {})[model] = {
+                "p95": stats.latency.percentile(0.95),
+                "error_rate": round(stats.error_rate(), 3),
+                "samples": len(stats.outcomes),
+                "down": stats.down_until > now,
+            }
+        return result
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_model_router():
+    """Returns the process-wide model router."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                from app.ai_service import GeminiService
+                config = current_app.config
+                default = [GeminiService.REFLECTION_MODEL]
+                routes = {call_type: default for call_type in ("reflection", "analysis", "topic", "summary")}
+                routes.update(config.get("GEMINI_MODEL_ROUTES") or {})
+                _router = ModelRouter(
+                    routes,
+                    budgets=config.get("GEMINI_MODEL_BUDGETS"),
+                    min_samples=config.get("GEMINI_MODEL_MIN_SAMPLES", 20),
+                    cooldown=config.get("GEMINI_MODEL_COOLDOWN", 120),
+                )
+    return _router
@@ -0,0 +1,203 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from flask import current_app
+
+try:
+    import numpy as np
+except ImportError: # optional: pure-Python cosine below
+    np = None
+
+def _features(pattern_name, dim):
+    """
+    Hashed character trigrams plus word stems of a normalized name, as a unit vector
+    ({index: weight}). 'Avoidant Coping' and 'Avoidance Coping' share most of both.
+    """
+    words = re.sub(r"[^\w\s]", " ", str(pattern_name or "").lower()).split()
+    counts = {}
+    for word in words:
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            key = zlib.crc32(padded[i:i + 3].encode()) % dim
+            counts[key] = counts.get(key, 0) + 1.0
+        if len(word) >= 3:
+            key = zlib.crc32(f"#{word[:5]}".encode()) % dim # crude stem: avoidance/avoidant -> avoid
+            counts[key] = counts.get(key, 0) + 2.0
+    norm = sum(w * w for w in counts.values()) ** 0.5
+    return {k: w / norm for k, w in counts.items()} if norm else {}
+
+class _UserIndex:
+    """One user's pattern names and their vectors."""
+    def __init__(self, dim, version=None):
+        self.dim = dim
+        self.version = version # (row count, max id) of the user's patterns when loaded
+        self.names = []
+        self.types = []
+        self.known = set()
+        self.vectors = np.zeros((16, dim), dtype=np.float32) if np is not None else []
+
+    def add(self, name, pattern_type):
+        if name in self.known:
+            return
+        features = _features(name, self.dim)
+        if np is not None:
+            if len(self.names) == len(self.vectors):
+                self.vectors = np.vstack([self.vectors, np.zeros_like(self.vectors)])
+            row = self.vectors[len(self.names)]
+            row[list(features)] = list(features.values())
+        else:
+            self.vectors.append(features)
+        self.names.append(name)
+        self.types.append(pattern_type)
+        self.known.add(name)
+
+    def best(self, name, pattern_type):
+        """Returns (similarity, name) of the closest pattern of the same type, or (0.0, None)."""
+        features = _features(name, self.dim)
+        if not features or not self.names:
+            return 0.0, None
+
+        if np is not None:
+            query = np.zeros(self.dim, dtype=np.float32)
+            query[list(features)] = list(features.values())
+            scores = self.vectors[:len(self.names)] @ query
+            scores[np.array(self.types) != pattern_type] = -1.0
+            i = int(scores.argmax())
+            return float(scores[i]), self.names[i]
+
+        best = (0.0, None)
+        for i, vector in enumerate(self.vectors):
+            if self.types[i] != pattern_type:
+                continue
+            score = sum(w * vector.get(k, 0.0) for k, w in features.items())
+            if score > best[0]:
+                best = (score, self.names[i])
+        return best
+
+class PatternIndex:
+    """
+    Per-user similarity index over pattern names, so near-duplicates the model
+    produces ('Avoidance Coping', 'Avoidant Coping') are stored as one pattern.
+
+    Names are compared by cosine similarity of hashed character trigrams and
+    word stems (vectorized with NumPy when it is installed), only against
+    patterns of the same type. Each user's index is loaded from the database on
+    first use and kept in an LRU of `max_users` users; it is reloaded when the
+    user's (pattern count, max id) no longer matches, e.g. after another worker
+    process stored a pattern or the backfill merged some.
+    """
+    def __init__(self, threshold=0.7, dim=1024, max_users=1000):
+        self.threshold = threshold
+        self.dim = dim
+        self.max_users = max_users
+
+        self._users = OrderedDict() # user_id -> _UserIndex
+        self._lock = threading.Lock()
+        self.merged = 0
+
+    def _user(self, user_id, version, load):
+        """Caller holds the lock."""
+        index = self._users.get(user_id)
+        if index is None or index.version != version:
+            index = _UserIndex(self.dim, version)
+            for name, pattern_type in load():
+                index.add(name, pattern_type)
+            self._users[user_id] = index
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(user_id)
+        return index
+
+    def resolve(self, user_id, pattern_name, pattern_type, version, load):
+        """
+        Returns the existing name pattern_name should be stored under, or
+        pattern_name itself if nothing is similar enough. version is the user's
+        current (pattern count, max id); load() returns the user's
+        (pattern_name, pattern_type) rows.
+        """
+        with self._lock:
+            index = self._user(user_id, version, load)
+            if pattern_name in index.known:
+                return pattern_name
+            score, match = index.best(pattern_name, pattern_type)
+            if match is not None and score >= self.threshold:
+                self.merged += 1
+                return match
+            return pattern_name
+
+    def add(self, user_id, pattern_name, pattern_type, pattern_id, is_new):
+        """Records a stored name (no-op for users that aren't loaded)."""
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                return
+            index.add(pattern_name, pattern_type)
+            if is_new and index.version is not None:
+                count, max_id = index.version
+                index.version = (count + 1, max(max_id or 0, pattern_id))
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+def merge_duplicate_patterns(conn, threshold=0.7, dry_run=False):
+    """
+    Backfill: merges each user's near-duplicate patterns into the oldest one,
+    summing occurrences and re-pointing (or dropping duplicate) learning topics.
+    Returns a list of (user_id, duplicate_name, kept_name).
+    """
+    merges = []
+    users = [row[0] for row in conn.execute('SELECT DISTINCT user_id FROM patterns')]
+    for user_id in users:
+        index = _UserIndex(1024)
+        kept = {} # name -> id
+        rows = conn.execute(
+            'SELECT id, pattern_name, pattern_type FROM patterns WHERE user_id = ? ORDER BY id', (user_id,)
+        ).fetchall()
+        for pattern_id, name, pattern_type in rows:
+            score, match = index.best(name, pattern_type)
+            if match is None or score < threshold:
+                index.add(name, pattern_type)
+                kept[name] = pattern_id
+                continue
+
+            merges.append((user_id, name, match))
+            if dry_run:
+                continue
+            keep_id = kept[match]
+            conn.execute(
+                '''UPDATE patterns SET
+                       occurrences_count = occurrences_count + (SELECT occurrences_count FROM patterns WHERE id = :dup),
+                       first_detected = MIN(first_detected, (SELECT first_detected FROM patterns WHERE id = :dup)),
+                       last_detected = MAX(last_detected, (SELECT last_detected FROM patterns WHERE id = :dup))
+                   WHERE id = :keep''',
+                {"dup": pattern_id, "keep": keep_id}
+            )
+            if conn.execute('SELECT 1 FROM learning_topics WHERE pattern_id = ?', (keep_id,)).fetchone():
+                conn.execute('DELETE FROM learning_topics WHERE pattern_id = ?', (pattern_id,))
+            else:
+                conn.execute('UPDATE learning_topics SET pattern_id = ? WHERE pattern_id = ?', (keep_id, pattern_id))
+            conn.execute('DELETE FROM patterns WHERE id = ?', (pattern_id,))
+    return merges
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_pattern_index():
+    """Returns the process-wide pattern index, or None when deduplication is off."""
+    global _index
+    if not current_app.config.get("PATTERN_DEDUP_ENABLED", True):
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                config = current_app.config
+                _index = PatternIndex(
+                    threshold=config.get("PATTERN_DEDUP_THRESHOLD", 0.7),
+                    max_users=config.get("PATTERN_INDEX_MAX_USERS", 1000),
+                )
+    return _index
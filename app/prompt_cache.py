@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from flask import current_app
+from google.genai import errors as genai_errors
+from app.key_manager import key_id, mask_key
+from app.prompt_context import estimate_tokens
+
+class SystemPromptCache:
+    """
+    Keeps the Echo system prompt in the API's cached-content store so it is
+    uploaded once per cache lifetime instead of on every turn.
+
+    Cached content belongs to the key's project and to one model, so there is
+    one entry per (key, model). Only the background refresher (see
+    init_prompt_cache) calls the API: it creates entries and renews them before
+    they expire, each call charged to that key's RPM/TPM budget. Requests just
+    read the entries and send the prompt as a plain system_instruction when
+    there is no live one; a failed creation is retried after `retry_after`.
+    """
+    def __init__(self, system_instruction, ttl=3600, refresh_margin=300, retry_after=600):
+        self.logger = logging.getLogger("SystemPromptCache")
+        self.system_instruction = system_instruction
+        self.tokens = estimate_tokens(system_instruction)
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+
+        self._entries = {} # (key_id, model) -> {"name": str, "expires_at": float}
+        self._failed_until = {} # (key_id, model) -> time before which creation isn't retried
+
+    def _fallback(self):
+        return {"system_instruction": self.system_instruction}
+
+    @staticmethod
+    def _expiry(cached, default):
+        expire_time = getattr(cached, "expire_time", None)
+        return expire_time.timestamp() if expire_time else default
+
+    def config_for(self, api_key, model):
+        """Returns the config fields that carry the system prompt for this key/model. Never calls the API."""
+        entry = self._entries.get((key_id(api_key), model))
+        if entry and entry["expires_at"] > time.time():
+            return {"cached_content": entry["name"]}
+        return self._fallback()
+
+    def _due(self, slot, now):
+        """True when the entry is missing or close to expiry and creation isn't backing off."""
+        entry = self._entries.get(slot)
+        if entry and entry["expires_at"] - now > self.refresh_margin:
+            return False
+        return self._failed_until.get(slot, 0) <= now
+
+    def _refresh(self, km, slot, api_key, model, client):
+        """Extends a live cache's TTL, or creates a new one. Returns the entry or None."""
+        from app.ai_service import GeminiService
+
+        now = time.time()
+        entry = self._entries.get(slot)
+        try:
+            if entry and entry["expires_at"] > now:
+                cached = client.caches.update(name=entry["name"], config={"ttl": f"{self.ttl}s"})
+            else:
+                cached = client.caches.create(
+                    model=model,
+                    config={
+                        "system_instruction": self.system_instruction,
+                        "display_name": "echo-system-prompt",
+                        "ttl": f"{self.ttl}s",
+                    }
+                )
+                self.logger.info(f"Created prompt cache for key {mask_key(api_key)} / {model}.")
+        except Exception as e:
+            self.logger.warning(f"Prompt cache unavailable for key {mask_key(api_key)} / {model}: {e}")
+            if isinstance(e, genai_errors.APIError) and e.code == 429:
+                km.mark_failed(api_key, "quota_exhausted", retry_after=GeminiService._retry_delay(e))
+            self._entries.pop(slot, None)
+            self._failed_until[slot] = now + self.retry_after
+            return None
+
+        km.record_usage(api_key, self.tokens, GeminiService._usage_tokens(cached))
+        entry = {"name": cached.name, "expires_at": self._expiry(cached, now + self.ttl)}
+        self._entries[slot] = entry
+        return entry
+
+    def invalidate(self, api_key, model):
+        """Forgets a cache that the API rejected; the refresher recreates it (after backoff)."""
+        slot = (key_id(api_key), model)
+        self._entries.pop(slot, None)
+        self._failed_until[slot] = time.time() + self.retry_after
+
+    def warm(self, api_keys, model, pool, km):
+        """
+        Creates (or renews) the entry of every key that is due. Each call first
+        takes a request from that key's budget; a key without budget right now
+        is skipped until the next round.
+        """
+        now = time.time()
+        for api_key in api_keys:
+            slot = (key_id(api_key), model)
+            if not self._due(slot, now) or km.get_key(self.tokens, only=api_key) is None:
+                continue
+            try:
+                self._refresh(km, slot, api_key, model, pool.get(api_key))
+            except Exception as e:
+                self.logger.warning(f"Prompt cache warm-up failed for key {mask_key(api_key)}: {e}")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_prompt_cache():
+    """
+    Returns the process-wide system prompt cache, or None when disabled or when
+    the prompt is below GEMINI_PROMPT_CACHE_MIN_TOKENS (the API rejects smaller
+    cached content, so every creation would fail).
+    """
+    global _cache
+    config = current_app.config
+    if not config.get("GEMINI_PROMPT_CACHE_ENABLED", False):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from app.ai_service import GeminiService
+                _cache = SystemPromptCache(
+                    GeminiService.SYSTEM_PROMPT,
+                    ttl=config.get("GEMINI_PROMPT_CACHE_TTL", 3600),
+                    refresh_margin=config.get("GEMINI_PROMPT_CACHE_REFRESH_MARGIN", 300),
+                )
+    if _cache.tokens < config.get("GEMINI_PROMPT_CACHE_MIN_TOKENS", 32768):
+        return None
+    return _cache
+
+def init_prompt_cache(app):
+    """Warms the cache for all keys in the background and keeps it refreshed."""
+    if not app.config.get("GOOGLE_API_KEYS"):
+        return
+    with app.app_context():
+        cache = get_prompt_cache()
+    if cache is None:
+        if app.config.get("GEMINI_PROMPT_CACHE_ENABLED", False):
+            from app.ai_service import GeminiService
+            logging.getLogger("SystemPromptCache").info(
+                f"System prompt is ~{estimate_tokens(GeminiService.SYSTEM_PROMPT)} tokens, "
+                "below GEMINI_PROMPT_CACHE_MIN_TOKENS; not caching it.")
+        return
+
+    def refresher():
+        from app.client_pool import get_client_pool
+        from app.key_manager import get_key_manager
+        from app.model_router import get_model_router
+        with app.app_context():
+            while True:
+                model = get_model_router().primary("reflection")
+                cache.warm(app.config["GOOGLE_API_KEYS"], model, get_client_pool(), get_key_manager())
+                time.sleep(max(cache.refresh_margin / 2, 30))
+
+    threading.Thread(target=refresher, name="prompt-cache-refresher", daemon=True).start()
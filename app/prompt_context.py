@@ -0,0 +1,55 @@
+import re
+
+# Words and individual punctuation marks, roughly how the tokenizer splits text
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+def _piece_tokens(piece):
+    if piece[0].isalnum() or piece[0] == "_":
+        return max(1, (len(piece) + 3) // 4)
+    return 1
+
+def estimate_tokens(text):
+    """
+    Local token estimate for prompt budgeting, no API call. Counts a word as one
+    token per ~4 characters and each punctuation mark as one; errs on the high side
+    of Gemini's tokenizer for English chat text.
+    """
+    return sum(_piece_tokens(piece) for piece in _PIECES.findall(text or ""))
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts text at a word boundary so it fits max_tokens, marking the cut with an ellipsis."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    used = 0
+    for match in _PIECES.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > max_tokens - 1: # leave room for the ellipsis
+            return text[:match.start()].rstrip() + "…"
+    return text
+
+def build_transcript(history, summary=None, budget=1200, message_budget=250):
+    """
+    Conversation context for a prompt: the user's rolling summary (see
+    ReflectionService.update_summary) followed by as many of the most recent
+    messages as fit in `budget` estimated tokens. Each message is capped at
+    `message_budget` tokens so one long reply can't crowd out the rest; the
+    summary gets at most half the budget.
+    """
+    parts = []
+    remaining = budget
+    if summary:
+        summary = truncate_to_tokens(summary, budget // 2)
+        parts.append(f"Summary of the conversation so far: {summary}\n")
+        remaining -= estimate_tokens(parts[0])
+
+    lines = []
+    for msg in reversed(history):
+        role = "User" if msg["role"] != "ai" else "Echo"
+        line = f"{role}: {truncate_to_tokens(msg['content'], message_budget)}\n"
+        cost = estimate_tokens(line)
+        if cost > remaining:
+            break
+        lines.append(line)
+        remaining -= cost
+    parts.extend(reversed(lines))
+    return "".join(parts)
@@ -1,6 +1,11 @@
-from flask import Blueprint, render_template, request, jsonify, session
+from flask import Blueprint, render_template, request, jsonify, session, Response, stream_with_context, current_app
 from app.services import ReflectionService, ContentService, DiscoveryService, LearningHubService
-from app.db import get_recent_history, get_all_learning_topics, update_topic_progress
+from app.db import get_recent_history, get_all_learning_topics, update_topic_progress, get_data_version
+from app.jobs import get_job_queue
+from app.metrics import REGISTRY
+from app.tracing import get_tracer
+import hashlib
+import json
 import uuid
 
 main = Blueprint('main', __name__)
@@ -11,6 +16,21 @@ def get_user_id():
         session['user_id'] = str(uuid.uuid4())
     return session['user_id']
 
+def conditional_json(user_id, load):
+    """
+    Serves load() as JSON with an ETag derived from the user's data version.
+    A matching If-None-Match gets a 304 without calling load (no database access).
+    """
+    user_tag = hashlib.sha256(user_id.encode()).hexdigest()[:12]
+    etag = f"{user_tag}-{get_data_version(user_id)}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(load())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' # always revalidate
+    return response
+
 @main.route('/')
 def index():
     """Renders the landing page."""
@@ -40,8 +60,7 @@ def discoveries():
 def api_discoveries():
     """API endpoint to get all user discoveries (patterns + topics)."""
     user_id = get_user_id()
-    data = DiscoveryService.get_user_discoveries(user_id=user_id)
-    return jsonify(data)
+    return conditional_json(user_id, lambda: DiscoveryService.get_user_discoveries(user_id=user_id))
 
 @main.route('/api/patterns/<int:pattern_id>/ack', methods=['PATCH'])
 def api_ack_pattern(pattern_id):
@@ -67,6 +86,35 @@ def api_reflect():
     response = ReflectionService.get_reflection_response(user_id, user_feeling)
     return jsonify(response)
 
+@main.route('/api/reflect/stream', methods=['POST'])
+def api_reflect_stream():
+    """Streaming AI reflection over Server-Sent Events."""
+    user_id = get_user_id()
+    data = request.get_json()
+    user_feeling = data.get('feeling', '')
+    if not user_feeling:
+        return jsonify({"error": "No feeling provided"}), 400
+
+    def generate():
+        for event, payload in ReflectionService.stream_reflection_response(user_id, user_feeling):
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@main.route('/api/jobs/<int:job_id>')
+def api_job_status(job_id):
+    """Returns the status (and result once done) of a background job."""
+    user_id = get_user_id()
+    queue = get_job_queue()
+    job = queue.get_job(job_id, user_id=user_id) if queue else None
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
 @main.route('/api/history')
 def api_history():
     """Returns recent chat history."""
@@ -91,8 +139,7 @@ def learning_hub():
 def api_learning_topics():
     """API endpoint to get all learning topics for user."""
     user_id = get_user_id()
-    topics = get_all_learning_topics(user_id=user_id)
-    return jsonify(topics)
+    return conditional_json(user_id, lambda: get_all_learning_topics(user_id=user_id))
 
 @main.route('/api/learning-topics/<int:topic_id>/progress', methods=['PATCH'])
 def api_update_topic_progress(topic_id):
@@ -105,3 +152,34 @@ def api_update_topic_progress(topic_id):
     
     update_topic_progress(user_id, topic_id, status)
     return jsonify({"success": True})
+
+def local_only(allowed=()):
+    """The debug and metrics endpoints answer loopback requests (and `allowed` addresses) only."""
+    return request.remote_addr in ('127.0.0.1', '::1', *allowed)
+
+@main.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint, for loopback and METRICS_ALLOWED_IPS (it names keys and worker pids)."""
+    if not current_app.config.get('METRICS_ENABLED', True):
+        return jsonify({"error": "Metrics are disabled"}), 404
+    if not local_only(current_app.config.get('METRICS_ALLOWED_IPS', ())):
+        return jsonify({"error": "Not found"}), 404
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@main.route('/debug/traces')
+def debug_traces():
+    """Recent slow request/job traces (newest first)."""
+    tracer = get_tracer()
+    if not tracer or not local_only():
+        return jsonify({"error": "Not found"}), 404
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({"threshold_seconds": tracer.slow_threshold, **tracer.stats(), "traces": tracer.recent(limit)})
+
+@main.route('/debug/traces/<trace_id>')
+def debug_trace(trace_id):
+    """The full span tree of one slow trace."""
+    tracer = get_tracer()
+    trace = tracer.get(trace_id) if tracer and local_only() else None
+    if not trace:
+        return jsonify({"error": "Trace not found"}), 404
+    return jsonify(trace)
@@ -0,0 +1,150 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from app.db import _write, get_db
+
+# Feelings offered on /feeling and the most common first messages; warmed by warm_seed_cache.py
+STOCK_SEEDS = (
+    "anxious", "sad", "overwhelmed", "stressed", "tired", "angry", "lonely", "frustrated",
+    "scared", "confused", "numb", "lost", "happy", "excited", "calm", "hopeful", "okay",
+)
+
+_LEAD_INS = re.compile(r"^(?:i'?m |i am |i feel |feeling |i'?m feeling |i am feeling )+")
+
+def normalize_seed(text):
+    """"I'm feeling Anxious." -> 'anxious'"""
+    text = re.sub(r"[^\w\s']", "", str(text or "").lower())
+    text = " ".join(text.split())
+    return _LEAD_INS.sub("", text + " ").strip()
+
+class SeedResponseCache:
+    """
+    Pre-generated first-turn replies for short stock feelings ("anxious",
+    "I'm feeling sad"). Only used when the message is the user's first, so the
+    reply can't depend on history. Each feeling keeps up to `variants` replies
+    and a random one is served, for variety.
+
+    Replies live in the `seed_responses` table (shared by all workers and the
+    warm-up CLI) with a TTL and an LRU cap; each process keeps the variant
+    lists it has read for `memory_ttl` seconds. Hits refresh `last_accessed`
+    through the write buffer, at most once per key every `touch_interval`
+    seconds, since the LRU cap doesn't need finer recency than that.
+    """
+    def __init__(self, ttl=7 * 24 * 3600, variants=5, max_words=3, memory_size=128, memory_ttl=300, max_rows=2000, touch_interval=60):
+        self.ttl = ttl
+        self.variants = variants
+        self.max_words = max_words
+        self.memory_size = memory_size
+        self.memory_ttl = memory_ttl
+        self.max_rows = max_rows
+        self.touch_interval = touch_interval
+
+        self._memory = OrderedDict() # seed_key -> (replies, loaded_at)
+        self._touched = {} # seed_key -> when this process last refreshed last_accessed
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def first_turn_key(self, feeling_text, history):
+        """Returns the cache key for a cacheable first message, else None. history includes the message."""
+        if len(history) > 1:
+            return None
+        key = normalize_seed(feeling_text)
+        if not key or len(key.split()) > self.max_words:
+            return None
+        return key
+
+    def _load(self, seed_key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(seed_key)
+            if entry and now - entry[1] < self.memory_ttl:
+                self._memory.move_to_end(seed_key)
+                return entry[0]
+
+        rows = get_db().execute(
+            'SELECT payload FROM seed_responses WHERE seed_key = ? AND created_at > ?',
+            (seed_key, now - self.ttl)
+        ).fetchall()
+        replies = [json.loads(row['payload']) for row in rows]
+        with self._lock:
+            self._memory[seed_key] = (replies, now)
+            self._memory.move_to_end(seed_key)
+            while len(self._memory) > self.memory_size:
+                evicted, _ = self._memory.popitem(last=False)
+                self._touched.pop(evicted, None)
+        return replies
+
+    def get(self, seed_key):
+        """Returns a random cached reply for the feeling, or None."""
+        replies = self._load(seed_key)
+        with self._lock:
+            if not replies:
+                self.misses += 1
+                return None
+            self.hits += 1
+            now = time.time()
+            touch = now - self._touched.get(seed_key, 0) >= self.touch_interval
+            if touch:
+                self._touched[seed_key] = now
+        if touch:
+            _write(lambda db: db.execute(
+                'UPDATE seed_responses SET last_accessed = ? WHERE seed_key = ?', (now, seed_key)
+            ), wait=False)
+        return dict(random.choice(replies))
+
+    def variant_count(self, seed_key):
+        return len(self._load(seed_key))
+
+    def put(self, seed_key, reply, wait=True):
+        """Adds a reply variant; the oldest variants beyond `variants` are dropped."""
+        now = time.time()
+
+        def op(db):
+            db.execute(
+                'INSERT INTO seed_responses (seed_key, payload, created_at, last_accessed) VALUES (?, ?, ?, ?)',
+                (seed_key, json.dumps(reply), now, now)
+            )
+            db.execute(
+                '''DELETE FROM seed_responses WHERE seed_key = ? AND id NOT IN (
+                       SELECT id FROM seed_responses WHERE seed_key = ? ORDER BY created_at DESC LIMIT ?)''',
+                (seed_key, seed_key, self.variants)
+            )
+            # Evict expired rows, then the least recently used beyond the size cap
+            db.execute('DELETE FROM seed_responses WHERE created_at <= ?', (now - self.ttl,))
+            db.execute(
+                '''DELETE FROM seed_responses WHERE id IN (
+                       SELECT id FROM seed_responses ORDER BY last_accessed DESC LIMIT -1 OFFSET ?)''',
+                (self.max_rows,)
+            )
+        _write(op, wait=wait)
+        with self._lock:
+            self._memory.pop(seed_key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_seed_cache():
+    """Returns the process-wide seed response cache, or None when disabled."""
+    global _cache
+    if not current_app.config.get("SEED_CACHE_ENABLED", True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = current_app.config
+                _cache = SeedResponseCache(
+                    ttl=config.get("SEED_CACHE_TTL", 7 * 24 * 3600),
+                    variants=config.get("SEED_CACHE_VARIANTS", 5),
+                    max_words=config.get("SEED_CACHE_MAX_WORDS", 3),
+                    max_rows=config.get("SEED_CACHE_MAX_ROWS", 2000),
+                )
+    return _cache
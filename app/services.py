@@ -1,5 +1,23 @@
-from app.db import save_message, get_recent_history, add_pattern, get_patterns, save_learning_topic, get_learning_topic, update_pattern_status
+from flask import current_app
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from app.db import save_message, get_recent_history, add_pattern, get_patterns, save_learning_topic, get_learning_topic, update_pattern_status, get_patterns_with_topics, run_db
+from app.db import get_conversation_summary, save_conversation_summary, count_messages_since, get_messages_since
+from app.db import get_pattern_watermark, save_pattern_watermark, count_unanalyzed_messages
 from app.ai_service import GeminiService
+from app.analysis_gate import get_analysis_gate
+from app.fanout import get_llm_executor
+from app.jobs import get_job_queue
+from app.seed_cache import get_seed_cache
+from app.topic_cache import get_topic_cache
+from app.tracing import span, traced
+
+# Users whose summary update is running on the LLM executor (no job queue), so a reply
+# that arrives meanwhile doesn't start a second one
+_summaries_running = set()
+_summaries_lock = threading.Lock()
 
 class ReflectionService:
     @staticmethod
@@ -7,22 +25,270 @@ class ReflectionService:
         """
         Generates a reflection response using Gemini.
         Orchestrates DB saving and AI generation.
+        Pattern detection is queued as a background job when the job queue is running.
         """
         # 1. Save User Message
         save_message(user_id=user_id, role='user', content=feeling_text)
 
-        # 2. Get Context (History)
+        # 2. Get Context (History, plus the rolling summary of older turns)
         history = get_recent_history(user_id=user_id, limit=8) 
+        summary = ReflectionService._conversation_summary(user_id)
 
         # 3. Generate Response (AI) - Returns dict: {reflection, insight, follow_up}
-        ai_data = GeminiService.generate_response(feeling_text, history)
+        # Short first messages ("anxious") are answered from pre-generated replies
+        seed_key, ai_data = ReflectionService._seed_lookup(feeling_text, history)
+        from_seed_cache = ai_data is not None
+
+        detected = None
+        if not ai_data and current_app.config.get("REFLECTION_MODE", "split") == "combined":
+            # One call returns the reflection and patterns_detected together
+            with span("reflection.reflect_and_analyze"):
+                ai_data = GeminiService.reflect_and_analyze(
+                    feeling_text, history, ReflectionService._patterns_summary(user_id), summary
+                )
+            if ai_data:
+                detected = ai_data.get("patterns_detected") or []
+        analysis = None
+        if not ai_data:
+            # Pattern analysis doesn't need the reply, so an inline analysis runs alongside it
+            analysis = ReflectionService._start_analysis(user_id, feeling_text, history, summary)
+            with span("reflection.generate_response"):
+                ai_data = GeminiService.generate_response(feeling_text, history, summary)
         
         if not ai_data:
+            if analysis:
+                analysis.cancel()
             return {
                 "error": "AI service unavailable",
                 "message": "I'm having trouble connecting to my thought process right now. Please check the API key configuration."
             }
+        if seed_key and not from_seed_cache:
+            get_seed_cache().put(seed_key, ReflectionService._reply_fields(ai_data), wait=False)
+
+        return ReflectionService._finish_reflection(user_id, feeling_text, history, ai_data, detected, analysis)
+
+    @staticmethod
+    def stream_reflection_response(user_id, feeling_text):
+        """
+        Streaming variant of get_reflection_response.
+        Yields (event, data) pairs: "delta" events as text arrives, then one
+        "done" event carrying the same payload /api/reflect returns (or "error").
+        """
+        save_message(user_id=user_id, role='user', content=feeling_text)
+        history = get_recent_history(user_id=user_id, limit=8)
+
+        seed_key, cached = ReflectionService._seed_lookup(feeling_text, history)
+        if cached:
+            ai_data = cached
+            for field, text in ReflectionService._reply_fields(cached).items():
+                if text:
+                    yield "delta", {"field": field, "text": text}
+            yield "done", ReflectionService._finish_reflection(user_id, feeling_text, history, ai_data)
+            return
+
+        ai_data = {}
+        summary = ReflectionService._conversation_summary(user_id)
+        analysis = ReflectionService._start_analysis(user_id, feeling_text, history, summary)
+        try:
+            for field, text in GeminiService.stream_response(feeling_text, history, summary):
+                ai_data[field] = ai_data.get(field, "") + text
+                yield "delta", {"field": field, "text": text}
+        except GeneratorExit:
+            # Client went away: don't keep analyzing for it
+            if analysis:
+                analysis.cancel()
+            raise
+
+        if not ai_data.get("reflection"):
+            if analysis:
+                analysis.cancel()
+            yield "error", {
+                "error": "AI service unavailable",
+                "message": "I'm having trouble connecting to my thought process right now. Please check the API key configuration."
+            }
+            return
+        if seed_key:
+            get_seed_cache().put(seed_key, ReflectionService._reply_fields(ai_data), wait=False)
+
+        yield "done", ReflectionService._finish_reflection(user_id, feeling_text, history, ai_data, analysis=analysis)
+
+    # --- Async variants for the ASGI app (see app/asgi.py) ---
+    # SQLite steps run on the DB thread pool (run_db); the model calls (reply and
+    # inline pattern analysis) run on the event loop.
+
+    @staticmethod
+    async def aget_reflection_response(user_id, feeling_text):
+        """get_reflection_response for the event loop."""
+        await run_db(save_message, user_id=user_id, role='user', content=feeling_text)
+        history = await run_db(get_recent_history, user_id=user_id, limit=8)
+
+        seed_key, ai_data = await run_db(ReflectionService._seed_lookup, feeling_text, history)
+        from_seed_cache = ai_data is not None
+        summary = await run_db(ReflectionService._conversation_summary, user_id)
+
+        detected = None
+        if not ai_data and current_app.config.get("REFLECTION_MODE", "split") == "combined":
+            with span("reflection.reflect_and_analyze"):
+                ai_data = await GeminiService.areflect_and_analyze(
+                    feeling_text, history, await run_db(ReflectionService._patterns_summary, user_id), summary
+                )
+            if ai_data:
+                detected = ai_data.get("patterns_detected") or []
+        analysis = None
+        if not ai_data:
+            analysis = await ReflectionService._astart_analysis(user_id, feeling_text, history, summary)
+            with span("reflection.generate_response"):
+                ai_data = await GeminiService.agenerate_response(feeling_text, history, summary)
+
+        if not ai_data:
+            if analysis:
+                analysis.cancel()
+            return {
+                "error": "AI service unavailable",
+                "message": "I'm having trouble connecting to my thought process right now. Please check the API key configuration."
+            }
+        if seed_key and not from_seed_cache:
+            await run_db(get_seed_cache().put, seed_key, ReflectionService._reply_fields(ai_data), wait=False)
+
+        if detected is None:
+            if analysis is None:
+                # Seed-cache reply: analyze now, still on the loop rather than inline in _finish_reflection
+                analysis = await ReflectionService._astart_analysis(user_id, feeling_text, history, summary)
+            detected, analysis = await ReflectionService._aawait_analysis(analysis)
+        return await run_db(ReflectionService._finish_reflection, user_id, feeling_text, history, ai_data, detected, analysis)
+
+    @staticmethod
+    async def astream_reflection_response(user_id, feeling_text):
+        """stream_reflection_response for the event loop (an async generator of the same events)."""
+        await run_db(save_message, user_id=user_id, role='user', content=feeling_text)
+        history = await run_db(get_recent_history, user_id=user_id, limit=8)
+
+        seed_key, cached = await run_db(ReflectionService._seed_lookup, feeling_text, history)
+        summary = await run_db(ReflectionService._conversation_summary, user_id)
+        analysis = await ReflectionService._astart_analysis(user_id, feeling_text, history, summary)
+        if cached:
+            for field, text in ReflectionService._reply_fields(cached).items():
+                if text:
+                    yield "delta", {"field": field, "text": text}
+            detected, analysis = await ReflectionService._aawait_analysis(analysis)
+            yield "done", await run_db(
+                ReflectionService._finish_reflection, user_id, feeling_text, history, cached, detected, analysis
+            )
+            return
+
+        ai_data = {}
+        try:
+            async for field, text in GeminiService.astream_response(feeling_text, history, summary):
+                ai_data[field] = ai_data.get(field, "") + text
+                yield "delta", {"field": field, "text": text}
+        except BaseException:
+            # Client went away (or the stream broke): don't keep analyzing for it
+            if analysis:
+                analysis.cancel()
+            raise
+
+        if not ai_data.get("reflection"):
+            if analysis:
+                analysis.cancel()
+            yield "error", {
+                "error": "AI service unavailable",
+                "message": "I'm having trouble connecting to my thought process right now. Please check the API key configuration."
+            }
+            return
+        if seed_key:
+            await run_db(get_seed_cache().put, seed_key, ReflectionService._reply_fields(ai_data), wait=False)
+
+        detected, analysis = await ReflectionService._aawait_analysis(analysis)
+        yield "done", await run_db(
+            ReflectionService._finish_reflection, user_id, feeling_text, history, ai_data, detected, analysis
+        )
+
+    @staticmethod
+    async def _astart_analysis(user_id, feeling_text, history, summary=None):
+        """
+        _start_analysis for the event loop: the analysis runs as an asyncio task on
+        the async client, so no thread waits for it. Returns the task, False when
+        the analysis gate skips the message, or None when analysis happens elsewhere.
+        """
+        patterns_summary = await run_db(ReflectionService._inline_analysis, user_id, feeling_text, history)
+        if patterns_summary is None or patterns_summary is False:
+            return patterns_summary
+        return asyncio.create_task(asyncio.wait_for(
+            GeminiService.aanalyze_patterns(feeling_text, history, patterns_summary, summary),
+            current_app.config.get("LLM_FANOUT_TIMEOUT", 20)
+        ))
 
+    @staticmethod
+    async def _aawait_analysis(analysis):
+        """Awaits an _astart_analysis task; returns the (detected, analysis) arguments for _finish_reflection."""
+        if not isinstance(analysis, asyncio.Task):
+            return None, analysis
+        with span("reflection.await_analysis"):
+            try:
+                result = await analysis
+            except Exception as e:
+                current_app.logger.warning(f"Pattern analysis failed: {e!r}")
+                result = None
+        if result is None:
+            return None, False # nothing to store, and not worth a second inline attempt
+        return result.get("patterns_detected", []), None
+
+    @staticmethod
+    def _seed_lookup(feeling_text, history):
+        """(seed_key, cached reply) for a cacheable first message; seed_key is None otherwise."""
+        with span("reflection.seed_cache") as s:
+            seed_cache = get_seed_cache()
+            seed_key = seed_cache.first_turn_key(feeling_text, history) if seed_cache else None
+            ai_data = seed_cache.get(seed_key) if seed_key else None
+            s.set(hit=ai_data is not None)
+        return seed_key, ai_data
+
+    @staticmethod
+    def _reply_fields(ai_data):
+        """The part of a reply that can be reused for another user (no detected patterns)."""
+        return {field: ai_data.get(field, "") for field in ("reflection", "insight", "follow_up")}
+
+    @staticmethod
+    def _start_analysis(user_id, feeling_text, history, summary=None):
+        """
+        Starts analyze_patterns on the shared LLM executor when it would
+        otherwise run inline after the reply (no job queue), so both calls are
+        in flight together. Returns the FanoutTask, False when the analysis gate
+        skips this message, or None when nothing is started.
+        """
+        config = current_app.config
+        if not config.get("LLM_FANOUT_ENABLED", True):
+            return None
+        # The existing patterns are read here: the executor thread doesn't touch the database
+        patterns_summary = ReflectionService._inline_analysis(user_id, feeling_text, history)
+        if patterns_summary is None or patterns_summary is False:
+            return patterns_summary
+        return get_llm_executor().submit(
+            GeminiService.analyze_patterns, feeling_text, history, patterns_summary, summary,
+            timeout=config.get("LLM_FANOUT_TIMEOUT", 20)
+        )
+
+    @staticmethod
+    def _inline_analysis(user_id, feeling_text, history):
+        """
+        The existing-patterns summary for a per-message analysis that runs along
+        with the reply (no job queue); False when the analysis gate skips the
+        message, None when analysis happens elsewhere (job queue, batched mode).
+        """
+        if get_job_queue() or ReflectionService._batched_analysis():
+            return None
+        if not ReflectionService._worth_analyzing(user_id, feeling_text, history):
+            return False
+        return ReflectionService._patterns_summary(user_id)
+
+    @staticmethod
+    @traced
+    def _finish_reflection(user_id, feeling_text, history, ai_data, detected=None, analysis=None):
+        """
+        Persists the AI reply, kicks off pattern detection and builds the UI payload.
+        `detected` holds patterns already returned by a combined call (skips analyze_patterns).
+        `analysis` is what _start_analysis returned; its patterns are stored after the reply.
+        """
         reflection = ai_data.get("reflection", "")
         insight = ai_data.get("insight", "")
         follow_up = ai_data.get("follow_up", "")
@@ -32,65 +298,347 @@ class ReflectionService:
         if insight: combined_text += f"\n\n{insight}"
         if follow_up: combined_text += f"\n\n{follow_up}"
         
-        save_message(user_id=user_id, role='ai', content=combined_text)
+        # Nothing below needs this row, so don't wait for its commit
+        saved = save_message(user_id=user_id, role='ai', content=combined_text, wait=False)
+        ReflectionService._maybe_update_summary(user_id, pending=saved)
         
         # 5. Pattern Detection (Secondary Check)
-        existing_patterns = get_patterns(user_id=user_id)
-        patterns_summary = [f"{p['pattern_name']} ({p['status']})" for p in existing_patterns]
-        
-        analysis = GeminiService.analyze_patterns(feeling_text, history, patterns_summary)
-        
-        new_pattern_data = None
-        if analysis and "patterns_detected" in analysis:
-            for p in analysis["patterns_detected"]:
-                pid, is_new = add_pattern(
-                    pattern_name=p["name"],
-                    pattern_type=p["type"],
-                    confidence_score=p.get("confidence", 0),
-                    weight=p.get("weight", 0),
-                    user_id=user_id
-                )
-                
-                if is_new and p.get("confidence", 0) >= 0.7 and p.get("weight", 0) >= 0.7:
-                    topic = GeminiService.generate_learning_topic(p["name"], p["type"])
-                    if topic:
-                        save_learning_topic(
-                            user_id=user_id,
-                            pattern_id=pid,
-                            topic_title=topic["title"],
-                            topic_content=topic["content"],
-                            interactive_hint=topic.get("interactive_hint")
-                        )
-                    
-                    new_pattern_data = {
-                        "id": pid,
-                        "name": p["name"],
-                        "type": p["type"]
-                    }
-                    break 
-
-        # 6. Return formatted structure for UI pacing
-        return {
+        response = {
             "type": "reflection",
             "message": reflection,
             "suggestion": insight if insight else None, 
             "follow_up": follow_up if follow_up else None,
-            "new_pattern": new_pattern_data
+            "new_pattern": None
         }
 
+        if detected is None and ReflectionService._batched_analysis():
+            ReflectionService._maybe_analyze_batch(user_id, response)
+            return response
+        if analysis is False:
+            return response
+        if analysis is not None:
+            with span("reflection.await_analysis"):
+                result = analysis.result()
+            if result is not None:
+                response["new_pattern"] = ReflectionService.apply_patterns(user_id, result.get("patterns_detected", []))
+            return response
+
+        if detected is None and not ReflectionService._worth_analyzing(user_id, feeling_text, history):
+            return response
+
+        queue = get_job_queue()
+        if queue and detected is not None:
+            # Patterns are known already; only the DB writes and topics run in the background
+            if detected:
+                response["pattern_job"] = queue.enqueue(
+                    'apply_patterns', {"user_id": user_id, "patterns": detected}, user_id=user_id
+                )
+        elif queue:
+            # Off the request path: the UI polls the job for a new pattern
+            response["pattern_job"] = queue.enqueue(
+                'analyze_patterns',
+                {"user_id": user_id, "feeling_text": feeling_text, "history": history},
+                user_id=user_id
+            )
+        elif detected is not None:
+            response["new_pattern"] = ReflectionService.apply_patterns(user_id, detected)
+        else:
+            try:
+                response["new_pattern"] = ReflectionService.detect_patterns(user_id, feeling_text, history)
+            except RuntimeError:
+                pass # Pattern detection is best-effort; the reflection itself succeeded
+
+        # 6. Return formatted structure for UI pacing
+        return response
+
+    @staticmethod
+    def _worth_analyzing(user_id, feeling_text, history):
+        """Local low-signal check before spending a pattern analysis call (see app/analysis_gate.py)."""
+        gate = get_analysis_gate()
+        if gate is None:
+            return True
+        analyze, reason = gate.should_analyze(user_id, feeling_text, history)
+        if not analyze:
+            current_app.logger.debug(f"Skipping pattern analysis ({reason})")
+        return analyze
+
+    # --- Batched pattern analysis (PATTERN_ANALYSIS_MODE='batched') ---
+    # Instead of one analyze_patterns call per message, the messages after the user's
+    # watermark are analyzed together once enough have arrived or the oldest has waited long enough.
+
+    @staticmethod
+    def _batched_analysis():
+        return current_app.config.get("PATTERN_ANALYSIS_MODE", "per_message") == "batched"
+
+    @staticmethod
+    def _batch_state(user_id, watermark):
+        """(unanalyzed user messages, whether the oldest of them is past PATTERN_BATCH_MAX_AGE)."""
+        pending, oldest = count_unanalyzed_messages(user_id, watermark)
+        if not pending:
+            return 0, False
+        return pending, time.time() - oldest >= current_app.config.get("PATTERN_BATCH_MAX_AGE", 600)
+
+    @staticmethod
+    def _maybe_analyze_batch(user_id, response):
+        """Runs (or queues) the batch analysis when it is due; otherwise makes sure the age threshold fires."""
+        config = current_app.config
+        batch_size = config.get("PATTERN_BATCH_MESSAGES", 5)
+        pending, overdue = ReflectionService._batch_state(user_id, get_pattern_watermark(user_id))
+        queue = get_job_queue()
+        if queue:
+            if pending == batch_size or overdue:
+                # Queued when the count is reached; past it that job just hasn't run yet
+                response["pattern_job"] = queue.enqueue('analyze_batch', {"user_id": user_id}, user_id=user_id)
+            elif pending == 1:
+                # First message of a new batch: analyze it by the age threshold even if the user goes quiet
+                queue.enqueue('analyze_batch', {"user_id": user_id}, user_id=user_id,
+                              delay=config.get("PATTERN_BATCH_MAX_AGE", 600))
+        elif pending >= batch_size or overdue:
+            try:
+                response["new_pattern"] = ReflectionService.analyze_batch(user_id)
+            except RuntimeError:
+                pass # retried on the next message
+
+    @staticmethod
+    @traced
+    def analyze_batch(user_id, defer_topics=False):
+        """
+        Analyzes the user's messages after the watermark in one call (at most the newest
+        PATTERN_BATCH_MAX; older ones are skipped), stores the patterns and moves the watermark.
+        Returns the first significant new pattern or None, also when the batch isn't due.
+        Raises RuntimeError if the analysis could not be performed at all.
+        """
+        watermark = get_pattern_watermark(user_id)
+        pending, overdue = ReflectionService._batch_state(user_id, watermark)
+        if pending < current_app.config.get("PATTERN_BATCH_MESSAGES", 5) and not overdue:
+            return None
+        messages = get_messages_since(
+            user_id, watermark, current_app.config.get("PATTERN_BATCH_MAX", 30), newest=True
+        )
+
+        analysis = GeminiService.analyze_pattern_batch(
+            messages, ReflectionService._patterns_summary(user_id), ReflectionService._conversation_summary(user_id)
+        )
+        if analysis is None:
+            raise RuntimeError("Pattern analysis unavailable")
+        if not save_pattern_watermark(user_id, messages[-1]["id"]):
+            return None # a concurrent run analyzed these messages already
+        return ReflectionService.apply_patterns(user_id, analysis.get("patterns_detected", []), defer_topics)
+
+    @staticmethod
+    @traced
+    def detect_patterns(user_id, feeling_text, history, defer_topics=False):
+        """
+        Runs pattern analysis and stores the detected patterns.
+        Returns the first significant new pattern (for the UI notification) or None.
+        Raises RuntimeError if the analysis could not be performed at all.
+        """
+        patterns_summary = ReflectionService._patterns_summary(user_id)
+        
+        summary = ReflectionService._conversation_summary(user_id)
+        analysis = GeminiService.analyze_patterns(feeling_text, history, patterns_summary, summary)
+        if analysis is None:
+            raise RuntimeError("Pattern analysis unavailable")
+
+        return ReflectionService.apply_patterns(user_id, analysis.get("patterns_detected", []), defer_topics)
+
+    # --- Rolling conversation summary ---
+    # Prompts carry the stored summary plus the newest messages (see app/prompt_context.py),
+    # so their size no longer grows with how long or wordy the conversation has been.
+
+    @staticmethod
+    def _conversation_summary(user_id):
+        """The user's rolling summary text, or None (none yet, or summaries disabled)."""
+        if not current_app.config.get("SUMMARY_ENABLED", True):
+            return None
+        current = get_conversation_summary(user_id)
+        return current["summary"] if current else None
+
+    @staticmethod
+    def _summary_backlog(user_id, current):
+        """Messages outside the summary that are older than the SUMMARY_KEEP_RECENT newest."""
+        covered = current["covered_message_id"] if current else 0
+        return count_messages_since(user_id, covered) - current_app.config.get("SUMMARY_KEEP_RECENT", 4)
+
+    @staticmethod
+    def _maybe_update_summary(user_id, pending=None):
+        """
+        Folds older messages into the summary once SUMMARY_EVERY_TURNS turns have
+        piled up: as a background job, else next to the request on the LLM executor.
+        `pending` is what save_message returned for the reply just saved; a Future
+        that hasn't resolved yet is a message the count can't see, so it is added.
+        """
+        config = current_app.config
+        if not config.get("SUMMARY_ENABLED", True):
+            return
+        current = get_conversation_summary(user_id)
+        uncommitted = isinstance(pending, Future) and not pending.done()
+        backlog = ReflectionService._summary_backlog(user_id, current)
+        if uncommitted:
+            if pending.done():
+                # Committed while we counted: it may or may not be in the count, so count again
+                backlog = ReflectionService._summary_backlog(user_id, current)
+            else:
+                backlog += 1
+        if backlog < 2 * config.get("SUMMARY_EVERY_TURNS", 2):
+            return
+        if uncommitted:
+            pending.exception() # the summary has to see the row; only these turns wait for it
+
+        queue = get_job_queue()
+        if queue:
+            queue.enqueue('update_summary', {"user_id": user_id}, user_id=user_id, unique=True)
+        elif config.get("LLM_FANOUT_ENABLED", True):
+            with _summaries_lock:
+                if user_id in _summaries_running:
+                    return
+                _summaries_running.add(user_id)
+            # Nobody waits for it; it runs in its own app context, like run_db
+            app = current_app._get_current_object()
+
+            def run():
+                try:
+                    with app.app_context():
+                        ReflectionService.update_summary(user_id)
+                except RuntimeError:
+                    pass # retried once more turns have piled up
+                finally:
+                    with _summaries_lock:
+                        _summaries_running.discard(user_id)
+            get_llm_executor().submit(run)
+        else:
+            try:
+                ReflectionService.update_summary(user_id)
+            except RuntimeError:
+                pass
+
+    @staticmethod
+    @traced
+    def update_summary(user_id):
+        """
+        Folds up to SUMMARY_MAX_FOLD of the oldest unsummarized messages (never the
+        SUMMARY_KEEP_RECENT newest) into the user's summary. Returns the id of the
+        last folded message, or None when there was nothing to fold.
+        Raises RuntimeError if the summary could not be generated.
+        """
+        current = get_conversation_summary(user_id)
+        backlog = ReflectionService._summary_backlog(user_id, current)
+        if backlog <= 0:
+            return None
+        covered = current["covered_message_id"] if current else 0
+        messages = get_messages_since(user_id, covered, min(backlog, current_app.config.get("SUMMARY_MAX_FOLD", 40)))
+
+        summary = GeminiService.summarize_conversation(current["summary"] if current else None, messages)
+        if summary is None:
+            raise RuntimeError("Conversation summary unavailable")
+        save_conversation_summary(user_id, summary, messages[-1]["id"])
+        return messages[-1]["id"]
+
+    @staticmethod
+    def _patterns_summary(user_id):
+        existing_patterns = get_patterns(user_id=user_id)
+        return [f"{p['pattern_name']} ({p['status']})" for p in existing_patterns]
+
+    @staticmethod
+    @traced
+    def apply_patterns(user_id, detected, defer_topics=False):
+        """
+        Stores detected patterns and creates a learning topic for the first significant new one.
+        Returns that pattern (for the UI notification) or None.
+        """
+        new_pattern_data = None
+        for p in detected:
+            pid, is_new = add_pattern(
+                pattern_name=p["name"],
+                pattern_type=p["type"],
+                confidence_score=p.get("confidence", 0),
+                weight=p.get("weight", 0),
+                user_id=user_id
+            )
+            
+            if is_new and p.get("confidence", 0) >= 0.7 and p.get("weight", 0) >= 0.7:
+                queue = get_job_queue()
+                if defer_topics and queue:
+                    queue.enqueue(
+                        'generate_learning_topic',
+                        {"user_id": user_id, "pattern_id": pid, "name": p["name"], "type": p["type"]},
+                        user_id=user_id
+                    )
+                else:
+                    ReflectionService.create_learning_topic(user_id, pid, p["name"], p["type"])
+                
+                new_pattern_data = {
+                    "id": pid,
+                    "name": p["name"],
+                    "type": p["type"]
+                }
+                break 
+
+        return new_pattern_data
+
+    @staticmethod
+    @traced
+    def create_learning_topic(user_id, pattern_id, pattern_name, pattern_type, difficulty="beginner"):
+        """
+        Stores the learning topic for a pattern. Safe to call twice.
+        Topics are shared across users through the topic cache; the model is only asked on a miss.
+        """
+        if get_learning_topic(user_id=user_id, pattern_id=pattern_id):
+            return True
+
+        topic = get_topic_cache().get_or_generate(
+            pattern_name, pattern_type, difficulty,
+            lambda: GeminiService.generate_learning_topic(pattern_name, pattern_type, difficulty)
+        )
+        if not topic:
+            return False
+
+        save_learning_topic(
+            user_id=user_id,
+            pattern_id=pattern_id,
+            topic_title=topic["title"],
+            topic_content=topic["content"],
+            interactive_hint=topic.get("interactive_hint"),
+            difficulty=difficulty
+        )
+        return True
+
+    # --- Background job handlers (see app/jobs.py) ---
+
+    @staticmethod
+    def run_pattern_job(payload):
+        new_pattern = ReflectionService.detect_patterns(
+            payload["user_id"], payload["feeling_text"], payload["history"], defer_topics=True
+        )
+        return {"new_pattern": new_pattern}
+
+    @staticmethod
+    def run_batch_job(payload):
+        return {"new_pattern": ReflectionService.analyze_batch(payload["user_id"], defer_topics=True)}
+
+    @staticmethod
+    def run_apply_patterns_job(payload):
+        new_pattern = ReflectionService.apply_patterns(payload["user_id"], payload["patterns"], defer_topics=True)
+        return {"new_pattern": new_pattern}
+
+    @staticmethod
+    def run_summary_job(payload):
+        return {"covered_message_id": ReflectionService.update_summary(payload["user_id"])}
+
+    @staticmethod
+    def run_topic_job(payload):
+        created = ReflectionService.create_learning_topic(
+            payload["user_id"], payload["pattern_id"], payload["name"], payload["type"]
+        )
+        if not created:
+            raise RuntimeError("Learning topic generation unavailable")
+        return {"pattern_id": payload["pattern_id"]}
+
 class DiscoveryService:
     @staticmethod
     def get_user_discoveries(user_id):
         """Fetches all patterns and their learning topics."""
-        patterns = get_patterns(user_id=user_id)
-        results = []
-        for p in patterns:
-            topic = get_learning_topic(user_id=user_id, pattern_id=p['id'])
-            results.append({
-                "pattern": p,
-                "topic": topic
-            })
-        return results
+        return get_patterns_with_topics(user_id=user_id)
 
     @staticmethod
     def acknowledge_pattern(user_id, pattern_id, status):
@@ -59,24 +59,11 @@ document.addEventListener('DOMContentLoaded', () => {
         const loadingMsg = addMessage('Echo is thinking...', 'ai-message loading');
 
         try {
-            const response = await fetch('/api/reflect', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ feeling: feelingText })
-            });
-
-            if (!response.ok) {
-                throw new Error(`HTTP error: ${response.status}`);
+            if (window.ReadableStream && window.TextDecoder) {
+                await streamAIResponse(feelingText, loadingMsg);
+            } else {
+                await fetchAIResponse(feelingText, loadingMsg);
             }
-
-            const data = await response.json();
-
-            // Remove loading message
-            removeMessage(loadingMsg);
-
-            // Handle response
-            handleAIResponse(data);
-
         } catch (error) {
             console.error('Error:', error);
             removeMessage(loadingMsg);
@@ -84,6 +71,87 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Streams the reply over Server-Sent Events, rendering each field as it arrives
+    async function streamAIResponse(feelingText, loadingMsg) {
+        const response = await fetch('/api/reflect/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ feeling: feelingText })
+        });
+
+        if (!response.ok || !response.body) {
+            throw new Error(`HTTP error: ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const bubbles = {};
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+
+            for (const frame of frames) {
+                let event = 'message';
+                let data = '';
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                if (!data) continue;
+                const payload = JSON.parse(data);
+
+                if (event === 'delta') {
+                    removeMessage(loadingMsg);
+                    let bubble = bubbles[payload.field];
+                    if (!bubble) {
+                        bubble = addMessage('', 'ai-message');
+                        bubble.rawText = '';
+                        bubbles[payload.field] = bubble;
+                    }
+                    bubble.rawText += payload.text;
+                    bubble.firstChild.innerHTML = formatMessage(bubble.rawText);
+                    scrollToBottom();
+                } else if (event === 'done') {
+                    if (payload.new_pattern) {
+                        setTimeout(() => showNotification(payload.new_pattern), 500);
+                    } else if (payload.pattern_job) {
+                        pollPatternJob(payload.pattern_job);
+                    }
+                } else if (event === 'error') {
+                    removeMessage(loadingMsg);
+                    addMessage(payload.message, 'ai-message');
+                }
+            }
+        }
+    }
+
+    // Non-streaming fallback: waits for the whole reply, then paces it out
+    async function fetchAIResponse(feelingText, loadingMsg) {
+        const response = await fetch('/api/reflect', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ feeling: feelingText })
+        });
+
+        if (!response.ok) {
+            throw new Error(`HTTP error: ${response.status}`);
+        }
+
+        const data = await response.json();
+
+        // Remove loading message
+        removeMessage(loadingMsg);
+
+        // Handle response
+        handleAIResponse(data);
+    }
+
     function handleAIResponse(data) {
         // Handle crisis response
         if (data.type === 'crisis') {
@@ -113,9 +181,34 @@ document.addEventListener('DOMContentLoaded', () => {
 
         if (data.new_pattern) {
             setTimeout(() => showNotification(data.new_pattern), delay + 500);
+        } else if (data.pattern_job) {
+            pollPatternJob(data.pattern_job);
         }
     }
 
+    // Pattern analysis runs in the background; check back for a new pattern
+    async function pollPatternJob(jobId, attempt = 0) {
+        if (attempt >= 10) return;
+
+        try {
+            const response = await fetch(`/api/jobs/${jobId}`);
+            if (!response.ok) return;
+
+            const job = await response.json();
+            if (job.status === 'done') {
+                if (job.result && job.result.new_pattern) {
+                    showNotification(job.result.new_pattern);
+                }
+                return;
+            }
+            if (job.status === 'failed') return;
+        } catch (error) {
+            return;
+        }
+
+        setTimeout(() => pollPatternJob(jobId, attempt + 1), 1500 + attempt * 500);
+    }
+
     function addMessage(text, className) {
         const msgDiv = document.createElement('div');
         msgDiv.className = `message ${className}`;
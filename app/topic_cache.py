@@ -0,0 +1,126 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from app.db import _write, get_db
+
+def normalize_topic_key(pattern_name, pattern_type, difficulty):
+    """'Avoidance  Coping!' / 'Behavioral' / 'beginner' -> 'avoidance coping|behavioral|beginner'"""
+    def norm(value):
+        value = re.sub(r"[^\w\s]", "", str(value or "").lower())
+        return " ".join(value.split())
+    return f"{norm(pattern_name)}|{norm(pattern_type)}|{norm(difficulty)}"
+
+class TopicCache:
+    """
+    Cross-user cache of generated learning topics.
+    Tier 1 is an in-process LRU; tier 2 is the `topic_cache` table, shared by
+    all workers and kept across restarts. Both tiers honour the same TTL.
+    Writes to the table go through the write buffer; the in-process tier
+    already has the topic, so callers don't wait for the commit.
+    """
+    def __init__(self, ttl=30 * 24 * 3600, memory_size=256, max_rows=5000):
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+
+        self._memory = OrderedDict() # cache_key -> (topic, created_at)
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_db = 0
+        self.misses = 0
+
+    def _remember(self, cache_key, topic, created_at):
+        with self._lock:
+            self._memory[cache_key] = (topic, created_at)
+            self._memory.move_to_end(cache_key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, pattern_name, pattern_type, difficulty="beginner"):
+        cache_key = normalize_topic_key(pattern_name, pattern_type, difficulty)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(cache_key)
+            if entry and now - entry[1] < self.ttl:
+                self._memory.move_to_end(cache_key)
+                self.hits_memory += 1
+                return entry[0]
+            if entry:
+                del self._memory[cache_key]
+
+        row = get_db().execute(
+            'SELECT payload, created_at FROM topic_cache WHERE cache_key = ? AND created_at > ?',
+            (cache_key, now - self.ttl)
+        ).fetchone()
+        if row:
+            _write(lambda db: db.execute(
+                'UPDATE topic_cache SET last_accessed = ? WHERE cache_key = ?', (now, cache_key)
+            ), wait=False)
+            topic = json.loads(row['payload'])
+            self._remember(cache_key, topic, row['created_at'])
+            with self._lock:
+                self.hits_db += 1
+            return topic
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, pattern_name, pattern_type, difficulty, topic, wait=True):
+        cache_key = normalize_topic_key(pattern_name, pattern_type, difficulty)
+        now = time.time()
+        self._remember(cache_key, topic, now)
+
+        def op(db):
+            db.execute(
+                '''INSERT INTO topic_cache (cache_key, payload, created_at, last_accessed) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(cache_key) DO UPDATE SET payload = excluded.payload,
+                   created_at = excluded.created_at, last_accessed = excluded.last_accessed''',
+                (cache_key, json.dumps(topic), now, now)
+            )
+            # Evict expired rows, then the least recently used beyond the size cap
+            db.execute('DELETE FROM topic_cache WHERE created_at <= ?', (now - self.ttl,))
+            db.execute(
+                '''DELETE FROM topic_cache WHERE cache_key IN (
+                       SELECT cache_key FROM topic_cache ORDER BY last_accessed DESC LIMIT -1 OFFSET ?)''',
+                (self.max_rows,)
+            )
+        _write(op, wait=wait)
+
+    def get_or_generate(self, pattern_name, pattern_type, difficulty, generate):
+        """Returns a cached topic, or calls generate() and caches a non-empty result."""
+        topic = self.get(pattern_name, pattern_type, difficulty)
+        if topic is None:
+            topic = generate()
+            if topic:
+                self.put(pattern_name, pattern_type, difficulty, topic, wait=False)
+        return topic
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_db": self.hits_db,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_topic_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = current_app.config
+                _cache = TopicCache(
+                    ttl=config.get("TOPIC_CACHE_TTL", 30 * 24 * 3600),
+                    memory_size=config.get("TOPIC_CACHE_MEMORY_SIZE", 256),
+                    max_rows=config.get("TOPIC_CACHE_MAX_ROWS", 5000),
+                )
+    return _cache
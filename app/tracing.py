@@ -0,0 +1,250 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from flask import current_app
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+class Span:
+    """One timed stage of a trace; children are the stages it called."""
+    __slots__ = ("name", "attrs", "start", "duration", "error", "children")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self.children = []
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+
+    def to_dict(self, origin):
+        return {
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round((self.duration if self.duration is not None else time.perf_counter() - self.start) * 1000, 2),
+            "attrs": self.attrs,
+            "error": self.error,
+            "children": [child.to_dict(origin) for child in list(self.children)],
+        }
+
+class _SpanContext:
+    def __init__(self, name, attrs):
+        self.span = Span(name, attrs)
+
+    def __enter__(self):
+        parent = _current.get()
+        if parent is not None:
+            parent.children.append(self.span) # list.append is atomic, so hedge threads can add spans too
+        self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        self.span.finish()
+        _current.reset(self._token)
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+    def finish(self):
+        pass
+
+_NOOP = _NoopSpan()
+
+def span(name, **attrs):
+    """
+    Context manager timing a stage of the current trace:
+
+        with span("gemini.attempt", model=model_name) as s:
+            ...
+            s.set(outcome="ok")
+
+    Outside a trace (tracing disabled, or code not under a request/job) it does nothing.
+    """
+    if _current.get() is None:
+        return _NOOP
+    return _SpanContext(name, attrs)
+
+def open_span(name, **attrs):
+    """
+    Starts a child of the current span without making it current; call .finish() on it.
+    For generators, which can't hold a span context open across their yields.
+    """
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    child = Span(name, attrs)
+    parent.children.append(child)
+    return child
+
+def traced(fn):
+    """Decorator: runs the function in a span named after its module, e.g. db.save_message."""
+    name = f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _current.get() is None:
+            return fn(*args, **kwargs)
+        with _SpanContext(name, {}):
+            return fn(*args, **kwargs)
+    return wrapper
+
+class Tracer:
+    """
+    Builds a span tree per request (and per background job). Traces slower
+    than `slow_threshold` seconds are kept in a ring of the last `ring_size`
+    and, with `export_path`, appended to a JSON-lines file for offline
+    analysis. Faster traces are dropped when they finish.
+    """
+    def __init__(self, slow_threshold=2.0, ring_size=100, export_path=None):
+        self.logger = logging.getLogger("Tracer")
+        self.slow_threshold = slow_threshold
+        self.export_path = export_path
+
+        self._slow = deque(maxlen=ring_size)
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self.traces = 0
+
+    def start(self, name, **attrs):
+        """Starts a root span for the calling context and returns it."""
+        root = Span(name, attrs)
+        _current.set(root)
+        return root
+
+    def finish(self, root):
+        """Ends a root span and keeps the trace if it was slow."""
+        root.finish()
+        if _current.get() is root:
+            _current.set(None)
+        with self._lock:
+            self.traces += 1
+        if root.duration >= self.slow_threshold:
+            self._record(root)
+
+    def _record(self, root):
+        trace = {
+            "trace_id": uuid.uuid4().hex[:16],
+            "started_at": time.time() - (time.perf_counter() - root.start),
+            **root.to_dict(root.start),
+        }
+        with self._lock:
+            self._slow.append(trace)
+        self.logger.warning(f"Slow trace {trace['trace_id']}: {root.name} took {root.duration:.2f}s")
+        if self.export_path:
+            try:
+                with self._export_lock, open(self.export_path, "a") as f:
+                    f.write(json.dumps(trace, default=str) + "\n")
+            except OSError as e:
+                self.logger.warning(f"Trace export failed: {e}")
+
+    def recent(self, limit=20):
+        """Summaries of the most recent slow traces, newest first."""
+        with self._lock:
+            traces = list(self._slow)[-limit:]
+        return [
+            {key: t[key] for key in ("trace_id", "name", "started_at", "duration_ms", "attrs", "error")}
+            for t in reversed(traces)
+        ]
+
+    def get(self, trace_id):
+        with self._lock:
+            return next((t for t in self._slow if t["trace_id"] == trace_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {"traces": self.traces, "slow_kept": len(self._slow)}
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+def get_tracer():
+    """Returns the process-wide tracer, or None when tracing is disabled."""
+    global _tracer
+    if not current_app.config.get("TRACING_ENABLED", True):
+        return None
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                config = current_app.config
+                _tracer = Tracer(
+                    slow_threshold=config.get("TRACE_SLOW_THRESHOLD", 2.0),
+                    ring_size=config.get("TRACE_RING_SIZE", 100),
+                    export_path=config.get("TRACE_EXPORT_PATH"),
+                )
+    return _tracer
+
+@contextlib.contextmanager
+def trace(name, **attrs):
+    """
+    Root span for work outside a request (e.g. a background job); needs an app context.
+    Nested inside another trace it is an ordinary span.
+    """
+    tracer = get_tracer()
+    if tracer is None or _current.get() is not None:
+        with span(name, **attrs) as s:
+            yield s
+        return
+    root = tracer.start(name, **attrs)
+    try:
+        yield root
+    except Exception as e:
+        root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        tracer.finish(root)
+
+def init_tracing(app):
+    """Traces every request, up to teardown (or, for a streamed response, until the body is sent)."""
+    if not app.config.get("TRACING_ENABLED", True):
+        return None
+    from flask import g, request
+
+    @app.before_request
+    def start_trace():
+        g.trace_root = get_tracer().start(
+            f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+
+    @app.after_request
+    def tag_trace(response):
+        root = g.get("trace_root")
+        if root is not None:
+            root.set(status=response.status_code)
+            if response.is_streamed:
+                # Teardown runs before a streamed body is sent; finish once it has been
+                g.pop("trace_root")
+                tracer = get_tracer()
+                response.call_on_close(lambda: tracer.finish(root))
+        return response
+
+    @app.teardown_request
+    def finish_trace(e=None):
+        root = g.pop("trace_root", None)
+        if root is not None:
+            if e is not None:
+                root.error = f"{type(e).__name__}: {e}"
+            get_tracer().finish(root)
+
+    with app.app_context():
+        return get_tracer()
@@ -0,0 +1,155 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from app.db import apply_pragmas
+
+_STOP = object()
+
+class WriteBuffer:
+    """
+    Group commit: a single writer thread owns the write connection and applies
+    queued writes from all request threads in one transaction, every
+    `max_delay` seconds or `max_batch` operations, whichever comes first.
+
+    Each write is an op(conn) callable; submit() returns a Future that resolves
+    with the op's return value once its transaction has committed. A failing op
+    is rolled back to its own savepoint and doesn't affect the rest of the batch.
+    """
+    def __init__(self, db_path, max_batch=64, max_delay=0.005):
+        self.logger = logging.getLogger("WriteBuffer")
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock() # orders submit() against close() and the writer's exit
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._closed = False
+        self._thread.start()
+
+    def submit(self, op):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                future.set_exception(RuntimeError("Write buffer is closed"))
+                return future
+            self._queue.put((op, future))
+        return future
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far is committed."""
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self, timeout=10):
+        """Commits what is queued, then stops the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit(self, conn, batch):
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for op, future in batch:
+                conn.execute('SAVEPOINT op')
+                try:
+                    outcomes.append((future, op(conn), None))
+                    conn.execute('RELEASE op')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO op')
+                    conn.execute('RELEASE op')
+                    self.logger.error(f"Write failed: {e}") # visible even if nobody waits on the future
+                    outcomes.append((future, None, e))
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            self.logger.error(f"Batch of {len(batch)} writes failed: {e}")
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _fail_pending(self, error):
+        """Fails every write still queued, so no caller waits on a writer that has gone."""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and not item[1].done():
+                item[1].set_exception(error)
+
+    def _run(self):
+        error = RuntimeError("Write buffer is closed")
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            apply_pragmas(conn, busy_timeout=30)
+
+            stopping = False
+            while not stopping:
+                batch, stopping = self._next_batch()
+                if batch:
+                    try:
+                        self._commit(conn, batch)
+                    except BaseException as e:
+                        error = RuntimeError(f"Write buffer stopped: {e!r}")
+                        for _, future in batch:
+                            if not future.done():
+                                future.set_exception(error)
+                        raise
+            conn.close()
+        except Exception as e:
+            error = RuntimeError(f"Write buffer stopped: {e!r}")
+            self.logger.error(f"Writer thread stopped: {e!r}")
+        finally:
+            self._fail_pending(error)
+
+def init_write_buffer(app):
+    """Starts the app's group-commit writer (see get_write_buffer in app/db.py)."""
+    if not app.config.get('WRITE_BUFFER_ENABLED', True):
+        return None
+
+    buffer = WriteBuffer(
+        app.config['DATABASE_PATH'],
+        max_batch=app.config.get('WRITE_BUFFER_MAX_BATCH', 64),
+        max_delay=app.config.get('WRITE_BUFFER_MAX_DELAY', 0.005),
+    )
+    app.extensions['write_buffer'] = buffer
+    atexit.register(buffer.close)
+    return buffer
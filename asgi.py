@@ -0,0 +1,16 @@
+"""
+ASGI entry point. The reflection API runs on the event loop with the async
+Gemini client; all other routes are served by the Flask app on a thread pool.
+Needs an ASGI server, which is not in requirements.txt:
+
+    pip install uvicorn
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+The WSGI entry point (run.py, or any WSGI server on run:app) is unchanged.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+from app import create_app
+from app.asgi import AsgiApp
+
+app = AsgiApp(create_app())
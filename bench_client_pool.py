@@ -0,0 +1,80 @@
+"""
+Microbenchmark: per-call genai.Client construction vs. the pooled client.
+
+Runs against a local HTTP server that mimics generateContent, so the numbers
+measure client setup + connection handling only (no network or model time).
+
+    python bench_client_pool.py [--calls 200]
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google import genai
+
+from app.client_pool import GeminiClientPool
+
+RESPONSE = json.dumps({
+    "candidates": [{"content": {"role": "model", "parts": [{"text": "{\"reflection\": \"ok\"}"}]}}]
+}).encode()
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like the real endpoint
+    connections = set()
+
+    def do_POST(self):
+        FakeGeminiHandler.connections.add(self.client_address)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+def run(label, get_client, calls):
+    FakeGeminiHandler.connections.clear()
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        client = get_client("bench-key")
+        client.models.generate_content(model="gemini-1.5-flash", contents="Ping")
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "label": label,
+        "calls": calls,
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(sorted(timings)[int(len(timings) * 0.95) - 1], 3),
+        "tcp_connections": len(FakeGeminiHandler.connections),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGeminiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    http_options = {"base_url": f"http://127.0.0.1:{server.server_port}"}
+
+    def new_client(api_key):
+        return genai.Client(api_key=api_key, http_options=http_options)
+
+    pool = GeminiClientPool(factory=new_client)
+
+    results = [
+        run("client_per_call", new_client, args.calls),
+        run("pooled_client", pool.get, args.calls),
+    ]
+    saved = results[0]["mean_ms"] - results[1]["mean_ms"]
+    print(json.dumps({"results": results, "saved_per_call_ms": round(saved, 3)}, indent=2))
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark: per-request sqlite3.connect (old get_db) vs. the pooled connection.
+
+Each simulated request runs the ~10 queries of one /api/reflect against a
+temporary database, so the difference is connection setup + statement prep.
+
+    python bench_db_pool.py [--requests 2000]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from flask import Flask
+
+from app.db import ConnectionPool, apply_pragmas, init_db
+
+USER = "bench-user"
+
+def reflect_queries(db):
+    """Roughly the statements one /api/reflect issues."""
+    db.execute('INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)', (USER, 'user', 'I feel anxious'))
+    db.commit()
+    db.execute('SELECT role, content FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?', (USER, 8)).fetchall()
+    db.execute('INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)', (USER, 'ai', 'I hear you.'))
+    db.commit()
+    db.execute('SELECT * FROM patterns WHERE user_id = ? ORDER BY last_detected DESC', (USER,)).fetchall()
+    for _ in range(3):
+        db.execute('SELECT * FROM learning_topics WHERE pattern_id = ? AND user_id = ?', (1, USER)).fetchone()
+    db.execute('SELECT * FROM patterns WHERE user_id = ? AND pattern_type = ?', (USER, 'emotional')).fetchall()
+    db.execute('SELECT * FROM learning_topics WHERE user_id = ? ORDER BY created_at DESC', (USER,)).fetchall()
+
+def run(label, open_conn, close_conn, requests):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        db = open_conn()
+        reflect_queries(db)
+        close_conn(db)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "label": label,
+        "requests": requests,
+        "mean_ms": round(statistics.mean(timings), 4),
+        "p50_ms": round(statistics.median(timings), 4),
+        "p95_ms": round(sorted(timings)[int(len(timings) * 0.95) - 1], 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    app = Flask(__name__)
+    app.config['DATABASE_PATH'] = db_path
+    init_db(app)
+
+    def fresh_connection():
+        conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.row_factory = sqlite3.Row
+        return apply_pragmas(conn)
+
+    pool = ConnectionPool(db_path)
+    results = [
+        run("connect_per_request", fresh_connection, lambda c: c.close(), args.requests),
+        run("pooled_connection", pool.acquire, pool.release, args.requests),
+    ]
+    saved = results[0]["mean_ms"] - results[1]["mean_ms"]
+    print(json.dumps({"results": results, "saved_per_request_ms": round(saved, 4)}, indent=2))
+
+if __name__ == "__main__":
+    main()
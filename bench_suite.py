@@ -0,0 +1,226 @@
+"""
+Benchmark suite: /api/reflect, /api/discoveries and /api/history under N
+concurrent simulated users, plus a microbenchmark of every app.db function.
+
+Gemini is replaced by the deterministic fake backend (app/fake_gemini.py), so
+the latency distribution, 429 bursts and malformed replies are controlled
+and runs are comparable. Results are printed (or written) as JSON for
+regression tracking.
+
+    python bench_suite.py [--users 20] [--turns 10] [--latency-ms 300] [--burst-rate 0.01]
+                          [--malformed-rate 0.02] [--rpm-per-key 0] [--db-iterations 500] [--output results.json]
+
+Per-key rate limits are off by default so the numbers measure the app, not the
+limiter; pass --rpm-per-key / --tpm-per-key to include it. Latency percentiles
+cover successful requests only; failures are counted under "errors".
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import app.client_pool
+from app.client_pool import GeminiClientPool
+from app.fake_gemini import FakeGeminiBackend
+from config import Config
+
+MESSAGES = (
+    "anxious",
+    "I keep putting off the conversation with my manager because I'm scared of how it will go.",
+    "ok",
+    "I always assume the worst will happen when my partner doesn't text back.",
+    "I said yes to another favour even though I'm exhausted.",
+    "thanks",
+    "Whenever I make a small mistake I replay it for hours.",
+    "I didn't go to the party, it felt easier to stay home alone again.",
+)
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(p * len(ordered))) - 1))]
+
+def summarize(timings, wall_seconds=None, unit="ms"):
+    summary = {
+        "count": len(timings),
+        f"mean_{unit}": round(statistics.mean(timings), 3),
+        f"p50_{unit}": round(percentile(timings, 0.50), 3),
+        f"p90_{unit}": round(percentile(timings, 0.90), 3),
+        f"p95_{unit}": round(percentile(timings, 0.95), 3),
+        f"p99_{unit}": round(percentile(timings, 0.99), 3),
+        f"max_{unit}": round(max(timings), 3),
+    }
+    if wall_seconds:
+        summary["throughput_rps"] = round(len(timings) / wall_seconds, 2)
+    return summary
+
+def make_config(args, db_path):
+    class BenchConfig(Config):
+        DATABASE_PATH = db_path
+        KEY_STATE_PATH = None
+        GOOGLE_API_KEYS = [f"fake-bench-key-{i:02d}" for i in range(args.keys)]
+        BACKGROUND_JOBS_ENABLED = not args.inline_jobs
+        GEMINI_RPM_PER_KEY = args.rpm_per_key # 0 = unlimited
+        GEMINI_TPM_PER_KEY = args.tpm_per_key
+    return BenchConfig
+
+def simulate_user(client, turns, offset, results, start):
+    """One user's session: reflect, then open the discoveries panel and the history."""
+    discoveries_etag = None
+    start.wait()
+    for turn in range(turns):
+        message = MESSAGES[(offset + turn) % len(MESSAGES)]
+        requests = (
+            ("/api/reflect", lambda: client.post("/api/reflect", json={"feeling": message})),
+            ("/api/discoveries", lambda: client.get(
+                "/api/discoveries", headers={"If-None-Match": discoveries_etag} if discoveries_etag else {})),
+            ("/api/history", lambda: client.get("/api/history")),
+        )
+        for endpoint, send in requests:
+            begin = time.perf_counter()
+            response = send()
+            elapsed = (time.perf_counter() - begin) * 1000
+            failed = response.status_code >= 400 or (
+                endpoint == "/api/reflect" and "error" in (response.get_json(silent=True) or {}))
+            results.append((endpoint, elapsed, response.status_code, failed))
+            if endpoint == "/api/discoveries" and response.headers.get("ETag"):
+                discoveries_etag = response.headers["ETag"]
+
+def bench_endpoints(flask_app, args):
+    results = [] # (endpoint, ms, status, failed); list.append is thread-safe
+    start = threading.Event()
+    threads = [
+        threading.Thread(target=simulate_user, args=(flask_app.test_client(), args.turns, i, results, start))
+        for i in range(args.users)
+    ]
+    for t in threads:
+        t.start()
+    begin = time.perf_counter()
+    start.set()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - begin
+
+    endpoints = {}
+    for endpoint in ("/api/reflect", "/api/discoveries", "/api/history"):
+        rows = [r for r in results if r[0] == endpoint]
+        succeeded = [r[1] for r in rows if not r[3]]
+        summary = summarize(succeeded, wall) if succeeded else {"count": 0}
+        summary["errors"] = len(rows) - len(succeeded)
+        summary["error_rate"] = round(summary["errors"] / len(rows), 4) if rows else 0.0
+        summary["status_codes"] = {str(code): sum(1 for r in rows if r[2] == code) for code in sorted({r[2] for r in rows})}
+        endpoints[endpoint] = summary
+    return {"wall_seconds": round(wall, 3), "total_rps": round(len(results) / wall, 2), "endpoints": endpoints}
+
+def bench_db(flask_app, iterations):
+    """Times each app.db function on its own (with the app's caches and write buffer as configured)."""
+    from app import db
+
+    user = "bench-db-user"
+    results = {}
+    with flask_app.app_context():
+        pattern_ids = [db.add_pattern(f"Seed Pattern {i}", "cognitive", 0.5, 0.5, user_id=user)[0] for i in range(50)]
+        topic_ids = [db.save_learning_topic(user, pid, "Title", "Content " * 40, "Hint") for pid in pattern_ids[:25]]
+        for i in range(40):
+            db.save_message(user, "user" if i % 2 == 0 else "ai", f"Seed message {i}")
+
+        counter = iter(range(10 ** 9))
+        calls = {
+            "save_message": lambda: db.save_message(user, "user", "I feel a bit anxious today."),
+            "get_recent_history": lambda: db.get_recent_history(user, limit=8),
+            "add_pattern": lambda: db.add_pattern(f"Bench Pattern {next(counter) % 200}", "behavioral", 0.6, 0.6, user_id=user),
+            "get_patterns": lambda: db.get_patterns(user),
+            "update_pattern_status": lambda: db.update_pattern_status(user, pattern_ids[0], "acknowledged"),
+            "save_learning_topic": lambda: db.save_learning_topic(user, None, "Title", "Content", "Hint"),
+            "get_learning_topic": lambda: db.get_learning_topic(user, pattern_ids[0]),
+            "get_patterns_with_topics": lambda: db.get_patterns_with_topics(user),
+            "get_all_learning_topics": lambda: db.get_all_learning_topics(user),
+            "update_topic_progress": lambda: db.update_topic_progress(user, topic_ids[0], "in_progress"),
+        }
+        for name, call in calls.items():
+            timings = []
+            for _ in range(iterations):
+                begin = time.perf_counter()
+                call()
+                timings.append((time.perf_counter() - begin) * 1_000_000)
+            summary = summarize(timings, unit="us")
+            summary["ops_per_sec"] = round(1_000_000 / summary["mean_us"], 1)
+            results[name] = summary
+    return results
+
+def cache_stats(flask_app):
+    from app.analysis_gate import get_analysis_gate
+    from app.history_cache import get_history_cache
+    from app.seed_cache import get_seed_cache
+    from app.topic_cache import get_topic_cache
+
+    with flask_app.app_context():
+        return {
+            name: cache.stats()
+            for name, cache in (
+                ("history", get_history_cache()), ("analysis_gate", get_analysis_gate()),
+                ("seed", get_seed_cache()), ("topics", get_topic_cache()),
+            )
+            if cache is not None
+        }
+
+def model_stats(flask_app):
+    from app.model_router import get_model_router
+    with flask_app.app_context():
+        return get_model_router().snapshot()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=10, help="reflect/discoveries/history rounds per user")
+    parser.add_argument("--keys", type=int, default=4, help="fake API keys")
+    parser.add_argument("--latency-ms", type=float, default=300, help="median fake model latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="log-normal spread of the latency")
+    parser.add_argument("--burst-rate", type=float, default=0.0, help="chance per call that a key starts a 429 burst")
+    parser.add_argument("--burst-length", type=int, default=5)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of replies that are truncated JSON")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls that fail with a 503")
+    parser.add_argument("--rpm-per-key", type=int, default=0, help="per-key requests/minute limit (0 = unlimited)")
+    parser.add_argument("--tpm-per-key", type=int, default=0, help="per-key tokens/minute limit (0 = unlimited)")
+    parser.add_argument("--inline-jobs", action="store_true", help="run pattern analysis on the request thread")
+    parser.add_argument("--db-iterations", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    backend = FakeGeminiBackend(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+        burst_rate=args.burst_rate, burst_length=args.burst_length,
+        malformed_rate=args.malformed_rate, error_rate=args.error_rate, seed=args.seed,
+    )
+    app.client_pool._pool = GeminiClientPool(factory=backend.client)
+
+    from app import create_app
+    with tempfile.TemporaryDirectory() as tmp:
+        flask_app = create_app(make_config(args, os.path.join(tmp, "bench.db")))
+        report = {
+            "config": vars(args),
+            "http": bench_endpoints(flask_app, args),
+            "db": bench_db(flask_app, args.db_iterations),
+            "fake_backend": backend.stats(),
+            "caches": cache_stats(flask_app),
+            "models": model_stats(flask_app),
+        }
+        from app.jobs import get_job_queue
+        if get_job_queue():
+            get_job_queue().stop()
+        buffer = flask_app.extensions.get("write_buffer")
+        if buffer:
+            buffer.close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+if __name__ == "__main__":
+    main()
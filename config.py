@@ -13,4 +13,150 @@ class Config:
     # Filter out None values
     GOOGLE_API_KEYS = [k for k in GOOGLE_API_KEYS if k]
     
+    # Reuse one HTTP client per key; HTTP/2 needs the optional 'h2' package (pip install httpx[http2])
+    GEMINI_HTTP2 = os.environ.get('GEMINI_HTTP2', '1') == '1'
+
+    # Per-key rate limits (token buckets shared by all workers); 0 disables a limit
+    GEMINI_RPM_PER_KEY = int(os.environ.get('GEMINI_RPM_PER_KEY', 15))
+    GEMINI_TPM_PER_KEY = int(os.environ.get('GEMINI_TPM_PER_KEY', 1000000))
+    GEMINI_KEY_WAIT_MAX = 5 # seconds to wait for budget before giving up on a call
+    GEMINI_KEY_COOLDOWN = 300 # seconds, when a 429 carries no retry delay
+
+    # Hedged requests: duplicate a slow call on another key once it exceeds the learned latency percentile
+    GEMINI_HEDGE_ENABLED = os.environ.get('GEMINI_HEDGE_ENABLED', '0') == '1'
+    GEMINI_HEDGE_PERCENTILE = 0.95
+    GEMINI_HEDGE_MAX_RATE = 0.1 # at most 10% of calls are hedged (bounds extra quota use)
+    GEMINI_HEDGE_MIN_SAMPLES = 20 # latency samples needed before hedging starts
+    GEMINI_HEDGE_WORKERS = None # threads for hedged calls; None sizes it from LLM_MAX_IN_FLIGHT
+
+    # Models per call type, in fallback order. A model whose p95 latency (seconds) or error rate
+    # goes over the call type's budget is skipped for GEMINI_MODEL_COOLDOWN seconds.
+    GEMINI_MODEL_ROUTES = {
+        'reflection': ['gemini-1.5-flash', 'gemini-1.5-flash-8b'], # live reply: latency matters most
+        'analysis': ['gemini-1.5-flash', 'gemini-1.5-flash-8b'], # background pattern detection
+        'topic': ['gemini-1.5-flash', 'gemini-1.5-flash-8b'], # background, cached across users
+        'summary': ['gemini-1.5-flash-8b', 'gemini-1.5-flash'], # background rolling summaries, plain text
+    }
+    GEMINI_MODEL_BUDGETS = {
+        'reflection': {'p95': 6.0, 'error_rate': 0.2},
+        'analysis': {'p95': 20.0, 'error_rate': 0.3},
+        'topic': {'p95': 30.0, 'error_rate': 0.3},
+        'summary': {'p95': 30.0, 'error_rate': 0.3},
+    }
+    GEMINI_MODEL_MIN_SAMPLES = 20 # calls before a model can be judged over budget
+    GEMINI_MODEL_COOLDOWN = 120 # seconds
+
+    # Send the Echo system prompt once per cache lifetime via the API's cached content. Off by default:
+    # the API only caches content of at least GEMINI_PROMPT_CACHE_MIN_TOKENS, far more than SYSTEM_PROMPT,
+    # and below that the cache stays off even when enabled
+    GEMINI_PROMPT_CACHE_ENABLED = os.environ.get('GEMINI_PROMPT_CACHE_ENABLED', '0') == '1'
+    GEMINI_PROMPT_CACHE_MIN_TOKENS = 32768 # the API's minimum cached content size for the gemini-1.5 models
+    GEMINI_PROMPT_CACHE_TTL = 3600 # seconds
+    GEMINI_PROMPT_CACHE_REFRESH_MARGIN = 300 # refresh this long before expiry
+
     DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'insideout_prod.db')
+    DB_POOL_MAX_SIZE = 32 # long-lived connections (one per thread) per database file
+    # Group commit: one writer thread batches writes from all threads into a single transaction
+    WRITE_BUFFER_ENABLED = os.environ.get('WRITE_BUFFER_ENABLED', '1') == '1'
+    WRITE_BUFFER_MAX_BATCH = 64 # operations per transaction
+    WRITE_BUFFER_MAX_DELAY = 0.005 # seconds to wait for more writes before committing
+    WRITE_BUFFER_TIMEOUT = 30 # seconds a caller waits for its write to commit before giving up
+    # Key health (cooldowns, round-robin cursor) shared by all worker processes; defaults to DATABASE_PATH.
+    # A separate file gets the same migrations (app/migrations.py)
+    KEY_STATE_PATH = os.environ.get('KEY_STATE_PATH')
+
+    # 'split': reflection and pattern analysis are separate calls
+    # 'combined': one structured-output call returns both (split is the fallback)
+    REFLECTION_MODE = os.environ.get('REFLECTION_MODE', 'split')
+
+    # Recent messages per user, kept in-process (write-through from save_message)
+    HISTORY_CACHE_ENABLED = os.environ.get('HISTORY_CACHE_ENABLED', '1') == '1'
+    HISTORY_CACHE_SIZE = 20 # messages per user (the most /api/history reads)
+    HISTORY_CACHE_MAX_USERS = 1000
+    HISTORY_CACHE_MAX_BYTES = 8 * 1024 * 1024 # of cached message text
+
+    # Store near-duplicate pattern names ('Avoidant Coping' ~ 'Avoidance Coping') as one pattern
+    PATTERN_DEDUP_ENABLED = os.environ.get('PATTERN_DEDUP_ENABLED', '1') == '1'
+    PATTERN_DEDUP_THRESHOLD = 0.7 # cosine similarity of name trigrams/stems, same pattern type only
+    PATTERN_INDEX_MAX_USERS = 1000 # per-user indexes kept in memory
+
+    # Pattern analysis in split mode: 'per_message' analyzes each message as it arrives;
+    # 'batched' keeps a per-user watermark and analyzes the messages after it in one call once
+    # PATTERN_BATCH_MESSAGES user messages are waiting or the oldest is PATTERN_BATCH_MAX_AGE old
+    PATTERN_ANALYSIS_MODE = os.environ.get('PATTERN_ANALYSIS_MODE', 'per_message')
+    PATTERN_BATCH_MESSAGES = 5
+    PATTERN_BATCH_MAX_AGE = 600 # seconds
+    PATTERN_BATCH_MAX = 30 # newest messages per call; older unanalyzed ones are skipped
+    PATTERN_BATCH_TOKEN_BUDGET = 2500
+
+    # Skip the pattern analysis call for low-signal messages ("ok", "thanks", repeats)
+    ANALYSIS_GATE_ENABLED = os.environ.get('ANALYSIS_GATE_ENABLED', '1') == '1'
+    ANALYSIS_GATE_MIN_WORDS = 4 # shorter messages need an emotion cue
+    ANALYSIS_GATE_NOVELTY_THRESHOLD = 0.8 # word overlap with a recent message that counts as a repeat
+    ANALYSIS_GATE_MIN_INTERVAL = 30 # seconds; cue-less messages this soon after an analysis are skipped
+
+    # Pre-generated first replies for short stock feelings ("anxious"); warm with warm_seed_cache.py
+    SEED_CACHE_ENABLED = os.environ.get('SEED_CACHE_ENABLED', '1') == '1'
+    SEED_CACHE_TTL = 7 * 24 * 3600 # seconds
+    SEED_CACHE_VARIANTS = 5 # replies kept per feeling, one picked at random
+    SEED_CACHE_MAX_WORDS = 3 # longer first messages always go to the model
+    SEED_CACHE_MAX_ROWS = 2000
+
+    # Cross-user learning topic cache (in-process LRU + SQLite table)
+    TOPIC_CACHE_TTL = 30 * 24 * 3600 # seconds
+    TOPIC_CACHE_MEMORY_SIZE = 256 # entries per process
+    TOPIC_CACHE_MAX_ROWS = 5000
+
+    # Background jobs (pattern analysis & learning topics run after the response is sent)
+    BACKGROUND_JOBS_ENABLED = os.environ.get('BACKGROUND_JOBS_ENABLED', '1') == '1'
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_MAX_ATTEMPTS = 5
+    JOB_RETRY_BACKOFF = 2 # seconds, doubled on every attempt
+    JOB_LEASE_SECONDS = 120 # a running job is re-queued if not finished within this time
+    JOB_RETENTION = 7 * 24 * 3600 # seconds done/failed jobs are kept; 0 keeps them forever
+    JOB_SWEEP_INTERVAL = 3600 # seconds between purges of expired jobs, run by an idle worker
+
+    # Shared executor for a request's independent Gemini calls: without a job queue, pattern analysis
+    # runs next to the reply instead of after it
+    LLM_FANOUT_ENABLED = os.environ.get('LLM_FANOUT_ENABLED', '1') == '1'
+    LLM_FANOUT_WORKERS = 16
+    LLM_FANOUT_TIMEOUT = 20 # seconds; an analysis still running then is cancelled and skipped
+    # Per-process cap on Gemini calls in flight (all call types); a call waits this long for a slot
+    LLM_MAX_IN_FLIGHT = int(os.environ.get('LLM_MAX_IN_FLIGHT', 256)) # room for an ASGI process's hundreds of reflections
+    LLM_SLOT_WAIT_MAX = 10 # seconds
+
+    # ASGI mode (uvicorn asgi:app): blocking work runs on thread pools while reflections await on the
+    # event loop. Keep their sum within DB_POOL_MAX_SIZE, as each thread holds a pooled connection.
+    ASYNC_DB_WORKERS = 16 # threads running SQLite steps for the async routes
+    ASGI_WSGI_WORKERS = 16 # threads serving the other routes through the Flask app
+
+    # Prompt size: the history part of a prompt is the user's rolling summary plus the newest
+    # messages that fit in the budget (tokens counted locally, see app/prompt_context.py)
+    PROMPT_HISTORY_TOKEN_BUDGET = 1200
+    PROMPT_MESSAGE_TOKEN_CAP = 250 # longer messages are cut
+    # Rolling summary: once SUMMARY_EVERY_TURNS turns have piled up beyond the newest
+    # SUMMARY_KEEP_RECENT messages, they are folded into the stored summary (a background
+    # job when the queue runs). Keep KEEP_RECENT + 2 * EVERY_TURNS within the 8 messages of
+    # history a prompt reads, so every message is in the summary or the recent turns.
+    SUMMARY_ENABLED = os.environ.get('SUMMARY_ENABLED', '1') == '1'
+    SUMMARY_EVERY_TURNS = 2 # a turn is a user message and its reply
+    SUMMARY_KEEP_RECENT = 4 # messages
+    SUMMARY_MAX_FOLD = 40 # messages folded per update, so a long backlog is caught up in steps
+    SUMMARY_MAX_WORDS = 150
+    SUMMARY_INPUT_TOKEN_BUDGET = 3000
+
+    # Per-request tracing: requests and jobs slower than the threshold keep their span tree
+    # (DB calls, Gemini attempts, service stages) for /debug/traces, loopback only
+    TRACING_ENABLED = os.environ.get('TRACING_ENABLED', '1') == '1'
+    TRACE_SLOW_THRESHOLD = float(os.environ.get('TRACE_SLOW_THRESHOLD', 2.0)) # seconds
+    TRACE_RING_SIZE = 100 # slow traces kept in memory
+    TRACE_EXPORT_PATH = os.environ.get('TRACE_EXPORT_PATH') # also append slow traces to this JSON-lines file
+
+    # Prometheus metrics at /metrics. With several worker processes, point METRICS_MULTIPROC_DIR at a
+    # shared directory: each process writes its counters there and a scrape adds them up (gauges are
+    # reported per pid; files of exited processes are folded into archive.json).
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+    METRICS_FLUSH_INTERVAL = 10 # seconds between writes of this process's metrics file
+    # /metrics answers loopback only, plus these addresses (e.g. the Prometheus server), comma-separated
+    METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
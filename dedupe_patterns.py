@@ -0,0 +1,45 @@
+"""
+Merges near-duplicate patterns that were stored before fuzzy deduplication
+(e.g. 'Avoidance Coping' and 'Avoidant Coping' for the same user).
+Run it while the app is stopped: running processes keep their in-memory index.
+
+    python dedupe_patterns.py [--threshold 0.7] [--dry-run] [db_path]
+"""
+import argparse
+import os
+import sqlite3
+from config import Config
+from app.migrations import run_migrations
+from app.pattern_index import merge_duplicate_patterns
+
+def dedupe(db_path=None, threshold=Config.PATTERN_DEDUP_THRESHOLD, dry_run=False):
+    db_path = db_path or Config.DATABASE_PATH
+    if not os.path.exists(db_path):
+        print(f"Database {db_path} not found.")
+        return
+
+    run_migrations(db_path)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        merges = merge_duplicate_patterns(conn, threshold=threshold, dry_run=dry_run)
+        conn.execute('ROLLBACK' if dry_run else 'COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    for user_id, duplicate, kept in merges:
+        print(f"{user_id}: '{duplicate}' -> '{kept}'")
+    action = "Would merge" if dry_run else "Merged"
+    print(f"{action} {len(merges)} duplicate patterns.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('db_path', nargs='?')
+    parser.add_argument('--threshold', type=float, default=Config.PATTERN_DEDUP_THRESHOLD)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    dedupe(args.db_path, args.threshold, args.dry_run)
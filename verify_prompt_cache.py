@@ -0,0 +1,112 @@
+import os
+import tempfile
+import time
+import unittest
+
+import app.client_pool
+from app import create_app
+from app.ai_service import GeminiService
+from app.client_pool import GeminiClientPool, get_client_pool
+from app.fake_gemini import FakeGeminiBackend
+from app.key_manager import get_key_manager
+from app.model_router import get_model_router
+from app.prompt_cache import get_prompt_cache
+from config import Config
+
+KEYS = ['fake-cache-key-1', 'fake-cache-key-2']
+
+class TestConfig(Config):
+    DATABASE_PATH = os.path.join(tempfile.mkdtemp(), 'test_prompt_cache.db')
+    GOOGLE_API_KEYS = KEYS
+    BACKGROUND_JOBS_ENABLED = False
+    GEMINI_RPM_PER_KEY = 0
+    GEMINI_TPM_PER_KEY = 0
+    GEMINI_PROMPT_CACHE_ENABLED = True
+    GEMINI_PROMPT_CACHE_MIN_TOKENS = 0 # SYSTEM_PROMPT is far below the real minimum
+
+class TestPromptCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.backend = FakeGeminiBackend(latency_ms=0)
+        app.client_pool._pool = GeminiClientPool(factory=cls.backend.client)
+        cls.app = create_app(TestConfig)
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+        cls.cache = get_prompt_cache()
+        cls.model = get_model_router().primary("reflection")
+
+        # The refresher thread creates one cache per key on startup
+        deadline = time.time() + 5
+        while time.time() < deadline and not all(
+                "cached_content" in cls.cache.config_for(key, cls.model) for key in KEYS):
+            time.sleep(0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.app_context.pop()
+        cls.app.extensions['write_buffer'].close()
+
+    def counts(self):
+        return dict(self.backend.stats())
+
+    def test_prefix_sent_once_per_cache_lifetime(self):
+        print("\n--- Testing System Prompt Sent Once Per Cache Lifetime ---")
+        before = self.counts()
+        self.assertEqual(before["caches_created"], len(KEYS))
+
+        for i in range(10):
+            GeminiService.generate_response(f"I feel stressed about work, turn {i}")
+        # Another refresher round inside the TTL has nothing to do
+        self.cache.warm(KEYS, self.model, get_client_pool(), get_key_manager())
+
+        after = self.counts()
+        self.assertEqual(after["caches_created"], len(KEYS))
+        self.assertEqual(after["caches_updated"], before["caches_updated"])
+        self.assertEqual(after["prompt_cached"] - before["prompt_cached"], 10)
+        self.assertEqual(after["prompt_inline"], before["prompt_inline"])
+        print(f"{len(KEYS)} caches created; 10 calls sent cached_content only.")
+
+    def test_refresh_extends_instead_of_recreating(self):
+        print("\n--- Testing Refresh Before Expiry ---")
+        before = self.counts()
+        slot = next(iter(self.cache._entries))
+        self.cache._entries[slot]["expires_at"] = time.time() + self.cache.refresh_margin / 2
+        self.cache.warm(KEYS, self.model, get_client_pool(), get_key_manager())
+
+        after = self.counts()
+        self.assertEqual(after["caches_updated"] - before["caches_updated"], 1)
+        self.assertEqual(after["caches_created"], before["caches_created"])
+        print("Cache near expiry had its TTL extended; nothing re-uploaded.")
+
+    def test_rejected_cache_falls_back_inline(self):
+        print("\n--- Testing Cache Deleted On The Server ---")
+        before = self.counts()
+        self.backend._caches.clear()
+        GeminiService.generate_response("I keep replaying a small mistake.")
+
+        after = self.counts()
+        self.assertEqual(after["prompt_inline"] - before["prompt_inline"], 1)
+        self.assertEqual(self.cache.config_for(KEYS[0], self.model), {"system_instruction": GeminiService.SYSTEM_PROMPT})
+        # Put the caches back for the other tests
+        self.cache._entries.clear()
+        self.cache._failed_until.clear()
+        self.cache.warm(KEYS, self.model, get_client_pool(), get_key_manager())
+        print("The 404 dropped the cache and the call was resent with the prompt inline.")
+
+    def test_small_prompt_is_never_cached(self):
+        print("\n--- Testing Prompt Below The API Minimum ---")
+        before = self.counts()
+        self.app.config['GEMINI_PROMPT_CACHE_MIN_TOKENS'] = 32768
+        try:
+            self.assertIsNone(get_prompt_cache())
+            GeminiService.generate_response("I feel a bit anxious today.")
+        finally:
+            self.app.config['GEMINI_PROMPT_CACHE_MIN_TOKENS'] = 0
+
+        after = self.counts()
+        self.assertEqual(after["caches_created"], before["caches_created"])
+        self.assertEqual(after["prompt_inline"] - before["prompt_inline"], 1)
+        print("No cache created; the prompt went inline as system_instruction.")
+
+if __name__ == '__main__':
+    unittest.main()
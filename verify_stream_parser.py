@@ -0,0 +1,45 @@
+import json
+import unittest
+
+from app.ai_service import JSONFieldStreamParser
+
+FIELDS = ["reflection", "insight", "follow_up"]
+
+def feed_in_chunks(text, size):
+    parser = JSONFieldStreamParser(FIELDS)
+    for i in range(0, len(text), size):
+        parser.feed(text[i:i + size])
+    return parser.values
+
+class TestJSONFieldStreamParser(unittest.TestCase):
+    def test_non_bmp_characters(self):
+        print("\n--- Testing Non-BMP Characters (Surrogate Pairs) ---")
+        payload = {
+            "reflection": "That sounds heavy 😔 but you're not alone 🌱",
+            "insight": "Music 𝄞 helps some people.",
+            "follow_up": "What would help right now?",
+        }
+        for ensure_ascii in (True, False):
+            text = json.dumps(payload, ensure_ascii=ensure_ascii)
+            # Every chunk size, so each pair is also split between its halves and inside \uXXXX
+            for size in range(1, 14):
+                values = feed_in_chunks(text, size)
+                self.assertEqual(values, payload, f"ensure_ascii={ensure_ascii} chunk size {size}")
+                values["reflection"].encode("utf-8") # no lone surrogates left to break save_message
+        print("Non-BMP characters decoded across chunk boundaries.")
+
+    def test_lone_surrogates_replaced(self):
+        print("\n--- Testing Lone Surrogates ---")
+        values = feed_in_chunks('{"reflection": "a\\ud83d b \\ude00 c\\ud83d"}', 3)
+        self.assertEqual(values["reflection"], "a� b � c�")
+        print("Unpaired surrogates became U+FFFD.")
+
+    def test_escapes_and_skipped_values(self):
+        print("\n--- Testing Escapes and Non-String Values ---")
+        text = '{"reflection": "line\\nnext \\"quoted\\" \\u00e9", "patterns_detected": [{"name": "x"}], "follow_up": "why?"}'
+        values = feed_in_chunks(text, 5)
+        self.assertEqual(values, {"reflection": 'line\nnext "quoted" é', "follow_up": "why?"})
+        print("Escapes decoded; nested values skipped.")
+
+if __name__ == '__main__':
+    unittest.main()
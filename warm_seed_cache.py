@@ -0,0 +1,38 @@
+"""
+Pre-generates first-turn replies for the stock feelings (app/seed_cache.py),
+so the /feeling entry flow is answered without a model call.
+
+    python warm_seed_cache.py [--variants 5] [feeling ...]
+"""
+import argparse
+from config import Config
+from app import create_app
+from app.ai_service import GeminiService
+from app.seed_cache import STOCK_SEEDS, get_seed_cache, normalize_seed
+from app.services import ReflectionService
+
+class WarmConfig(Config):
+    BACKGROUND_JOBS_ENABLED = False
+    SEED_CACHE_ENABLED = True
+
+def warm(feelings, variants):
+    app = create_app(WarmConfig)
+    with app.app_context():
+        cache = get_seed_cache()
+        for feeling in feelings:
+            seed_key = normalize_seed(feeling)
+            missing = max(0, variants - cache.variant_count(seed_key))
+            for _ in range(missing):
+                reply = GeminiService.generate_response(feeling, [{"role": "user", "content": feeling}])
+                if not reply:
+                    print(f"{seed_key}: generation failed, skipping.")
+                    break
+                cache.put(seed_key, ReflectionService._reply_fields(reply))
+            print(f"{seed_key}: {cache.variant_count(seed_key)} variants")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('feelings', nargs='*', default=list(STOCK_SEEDS))
+    parser.add_argument('--variants', type=int, default=Config.SEED_CACHE_VARIANTS)
+    args = parser.parse_args()
+    warm(args.feelings, args.variants)